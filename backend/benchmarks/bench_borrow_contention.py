@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Hot-row contention benchmark for the borrow/return concurrency modes.
+
+Each worker thread loops borrow -> return on a small set of "hot" books for a
+fixed duration. For every mode the benchmark reports completed checkouts per
+second, latency percentiles of borrow attempts, lost races ("already
+borrowed") and operations that exhausted their conflict retries.
+
+Usage: python benchmarks/bench_borrow_contention.py [--threads 32] [--hot-books 1] [--duration 10]
+Run from backend/ with the DB environment variables set (or a .env file).
+Creates its own books/members and deletes them afterwards, together with the
+ledger, loan, fine and change log rows they produced (catalog statistics are
+then recomputed).
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from db_helper import SessionLocal, Book, ChangeLog, Fine, Ledger, Loan, Member  # noqa: E402
+from repositories import BookRepository, CatalogStatsRepository, MemberRepository, ConcurrencyConflict  # noqa: E402
+from repositories.base_repository import conflicts_total, retries_total  # noqa: E402
+
+MODES = list(Config.BORROW_CONCURRENCY_MODES)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def run_mode(mode, book_ids, member_ids, duration):
+    Config.BORROW_CONCURRENCY_MODE = mode
+    repository = BookRepository()
+    latencies = []
+    counts = {'checkouts': 0, 'lost_races': 0, 'exhausted': 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    conflicts_before = conflicts_total.value(operation='borrow')
+    retries_before = retries_total.value(operation='borrow')
+
+    def worker(member_id):
+        local_latencies = []
+        local = {'checkouts': 0, 'lost_races': 0, 'exhausted': 0}
+        while time.perf_counter() < stop_at:
+            book_id = random.choice(book_ids)
+            started = time.perf_counter()
+            try:
+                repository.borrow_book(book_id, member_id)
+            except ValueError:
+                local['lost_races'] += 1
+                continue
+            except ConcurrencyConflict:
+                local['exhausted'] += 1
+                continue
+            finally:
+                local_latencies.append(time.perf_counter() - started)
+            repository.return_book(book_id, member_id)
+            local['checkouts'] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            for key, value in local.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker, args=(member_id,)) for member_id in member_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'mode': mode,
+        'checkouts_per_sec': counts['checkouts'] / duration,
+        'attempts': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+        'lost_races': counts['lost_races'],
+        'exhausted': counts['exhausted'],
+        'conflicts': conflicts_total.value(operation='borrow') - conflicts_before,
+        'retries': retries_total.value(operation='borrow') - retries_before,
+    }
+
+
+def cleanup(book_ids, member_ids):
+    """Delete the benchmark's books and members, and every row referencing them, children first"""
+    session = SessionLocal()
+    try:
+        loan_ids = [loan_id for loan_id, in session.query(Loan.id).filter(Loan.book_id.in_(book_ids))]
+        session.query(Fine).filter(Fine.loan_id.in_(loan_ids)).delete(synchronize_session=False)
+        session.query(Loan).filter(Loan.id.in_(loan_ids)).delete(synchronize_session=False)
+        session.query(Ledger).filter(Ledger.book_id.in_(book_ids)).delete(synchronize_session=False)
+        for entity, ids in (('book', book_ids), ('member', member_ids), ('loan', loan_ids)):
+            session.query(ChangeLog).filter(
+                ChangeLog.entity == entity, ChangeLog.entity_id.in_(ids)
+            ).delete(synchronize_session=False)
+        session.query(Book).filter(Book.id.in_(book_ids)).delete(synchronize_session=False)
+        session.query(Member).filter(Member.id.in_(member_ids)).delete(synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    # The deleted books were counted in the catalog statistics when created
+    CatalogStatsRepository().recompute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--hot-books', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    books = [BookRepository().create_book(f"Hot Book {i}", "Benchmark") for i in range(args.hot_books)]
+    members = [MemberRepository().create_member(f"Bench Member {i}", f"bench-{os.getpid()}-{i}@example.com")
+               for i in range(args.threads)]
+    book_ids = [book['id'] for book in books]
+    member_ids = [member['id'] for member in members]
+
+    try:
+        print(f"{'mode':<12} {'checkouts/s':>12} {'attempts':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+              f"{'lost':>6} {'exhausted':>9} {'conflicts':>9} {'retries':>8}")
+        for mode in args.modes.split(','):
+            result = run_mode(mode, book_ids, member_ids, args.duration)
+            print(f"{result['mode']:<12} {result['checkouts_per_sec']:>12.1f} {result['attempts']:>9} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} "
+                  f"{result['lost_races']:>6} {result['exhausted']:>9} {result['conflicts']:>9.0f} "
+                  f"{result['retries']:>8.0f}")
+    finally:
+        cleanup(book_ids, member_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Server cold start benchmark.
+
+Measures what a restarted server pays before it can take traffic:
+
+- importing server.py, in fresh interpreters (--runs of them), with the
+  slowest modules from ``python -X importtime`` (cumulative, top --top)
+- with --db: the startup schema step both ways, ``SCHEMA_CHECK=version``
+  (one query on schema_version) vs. ``create_all`` (table reflection), each
+  on a fresh engine so neither reuses a pooled connection
+- with --db: opening --connections pool connections one after another vs.
+  in parallel (startup.prewarm_pool)
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--top 15] [--db] [--connections 5]
+Run from backend/ (with the DB environment variables set when using --db).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def import_times(runs):
+    """Wall seconds of ``import server`` per fresh interpreter, and the last run's -X importtime report"""
+    seconds, report = [], ''
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True)
+        seconds.append(time.perf_counter() - started)
+        report = result.stderr
+    return seconds, report
+
+
+def slowest_imports(report, top):
+    """(cumulative us, module) of the slowest imports in an -X importtime report"""
+    modules = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative), name.rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def fresh_engine():
+    from sqlalchemy import create_engine
+    from db_helper import DATABASE_URL
+    return create_engine(DATABASE_URL, pool_pre_ping=True)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--db', action='store_true', help='Also time the schema step and pool prewarm')
+    parser.add_argument('--connections', type=int, default=5)
+    args = parser.parse_args()
+
+    seconds, report = import_times(args.runs)
+    print(f"import server: median {statistics.median(seconds) * 1000:.0f}ms, "
+          f"min {min(seconds) * 1000:.0f}ms over {args.runs} fresh interpreters")
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative, name in slowest_imports(report, args.top):
+        print(f"{cumulative / 1000:>14.1f}  {name}")
+
+    if args.db:
+        from db_helper import Base
+        from startup import check_schema_version, prewarm_pool
+
+        engine = fresh_engine()
+        check_seconds = timed(lambda: check_schema_version(engine))
+        engine.dispose()
+        engine = fresh_engine()
+        create_all_seconds = timed(lambda: Base.metadata.create_all(bind=engine))
+        engine.dispose()
+
+        engine = fresh_engine()
+
+        def serial():
+            connections = [engine.connect() for _ in range(args.connections)]
+            for connection in connections:
+                connection.close()
+
+        serial_seconds = timed(serial)
+        engine.dispose()
+        engine = fresh_engine()
+        parallel_seconds = timed(lambda: prewarm_pool(args.connections, engine))
+        engine.dispose()
+
+        print(f"\n{'startup step':<32} {'ms':>9}")
+        for step, step_seconds in [('schema: version check', check_seconds),
+                                   ('schema: create_all', create_all_seconds),
+                                   (f"{args.connections} connections, serial", serial_seconds),
+                                   (f"{args.connections} connections, parallel", parallel_seconds)]:
+            print(f"{step:<32} {step_seconds * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
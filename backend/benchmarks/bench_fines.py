@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Fines engine benchmark.
+
+Prices --loans synthetic overdue/returned loans in chunks, the way FinesJob
+does, and reports throughput for:
+
+- vectorized pricing (FinesJob.price) alone
+- pricing plus building the binary COPY payload (to_copy_binary)
+- a row-by-row Python loop over the same tier rules, on a --baseline-loans
+  sample, extrapolated to --loans
+
+With --db it also runs the full FinesJob against the configured database
+(whatever loans it currently holds) and reports end-to-end loans/s.
+
+Usage: python benchmarks/bench_fines.py [--loans 10000000] [--chunk-size 100000] [--baseline-loans 200000] [--db]
+Run from backend/ (with the DB environment variables set when using --db).
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs.fines import FinesJob, FineSchedule, to_copy_binary  # noqa: E402
+
+SECONDS_PER_DAY = 86400
+
+
+def synthetic_chunk(rng, first_id, size, now):
+    """(loan id, member id, due epoch, end epoch) rows: due up to 60 days ago, ending up to 90 days after due"""
+    ids = np.arange(first_id, first_id + size, dtype=np.int64)
+    members = rng.integers(1, 1_000_000, size, dtype=np.int64)
+    due = now - rng.integers(0, 60 * SECONDS_PER_DAY, size, dtype=np.int64)
+    end = due + rng.integers(-SECONDS_PER_DAY, 90 * SECONDS_PER_DAY, size, dtype=np.int64)
+    return np.column_stack((ids, members, due, end))
+
+
+def python_price(rows, tiers, max_cents):
+    """Row-at-a-time equivalent of FinesJob.price, for comparison"""
+    starts = [start for start, _ in tiers]
+    ends = [start - 1 for start in starts[1:]] + [sys.maxsize]
+    fines = []
+    for loan_id, member_id, due, end in rows:
+        days = max(math.ceil((end - due) / SECONDS_PER_DAY), 0)
+        cents = 0
+        for (start, rate), tier_end in zip(tiers, ends):
+            cents += max(min(days, tier_end) - start + 1, 0) * rate
+        if max_cents:
+            cents = min(cents, max_cents)
+        if cents > 0:
+            fines.append((loan_id, member_id, days, cents))
+    return fines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loans', type=int, default=10_000_000)
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--baseline-loans', type=int, default=200_000)
+    parser.add_argument('--db', action='store_true', help='Also run the full job against the database')
+    args = parser.parse_args()
+
+    tiers = [(1, 25), (8, 50), (31, 100)]
+    schedule = FineSchedule(tiers, max_cents=5000)
+    job = FinesJob(schedule=schedule, chunk_size=args.chunk_size)
+    rng = np.random.default_rng(42)
+    now = int(time.time())
+
+    price_seconds = serialize_seconds = 0.0
+    fined = 0
+    for first in range(0, args.loans, args.chunk_size):
+        chunk = synthetic_chunk(rng, first + 1, min(args.chunk_size, args.loans - first), now)
+        started = time.perf_counter()
+        fines = job.price(chunk)
+        priced = time.perf_counter()
+        to_copy_binary(fines)
+        price_seconds += priced - started
+        serialize_seconds += time.perf_counter() - priced
+        fined += len(fines)
+
+    sample = synthetic_chunk(rng, 1, min(args.baseline_loans, args.loans), now).tolist()
+    started = time.perf_counter()
+    python_price(sample, tiers, 5000)
+    baseline_seconds = (time.perf_counter() - started) * args.loans / len(sample)
+
+    print(f"{args.loans} loans, {fined} fined, chunks of {args.chunk_size}")
+    print(f"{'stage':<28} {'seconds':>9} {'loans/s':>14}")
+    for stage, seconds in [('vectorized price', price_seconds),
+                           ('vectorized price + COPY', price_seconds + serialize_seconds),
+                           ('python loop (extrapolated)', baseline_seconds)]:
+        print(f"{stage:<28} {seconds:>9.2f} {args.loans / seconds:>14,.0f}")
+
+    if args.db:
+        started = time.perf_counter()
+        totals = job.run()
+        elapsed = time.perf_counter() - started
+        print(f"database run: {totals['loans']} loans, {totals['upserted']} fines written in {elapsed:.2f}s "
+              f"({totals['loans'] / elapsed if elapsed else 0:,.0f} loans/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Partitioned vs. unpartitioned ledger benchmark.
+
+Builds two standalone copies of the ledger layout, a plain table and one
+range-partitioned by month, with the same indexes, and fills both with
+--rows synthetic entries spread over --months months. It then measures:
+
+- single-row INSERT latency (the ledger write of every borrow/return)
+- a member's newest history page (ListLedger without dates)
+- a member's history within the last month (ListLedger with a date range)
+
+Usage: python benchmarks/bench_ledger_partitions.py [--rows 100000000] [--months 36] [--samples 500] [--keep]
+Run from backend/ with the DB environment variables set (or a .env file).
+Loading 100M rows per table takes a while and roughly 2 x 15 GB of disk;
+use a smaller --rows for a quick comparison.
+"""
+import argparse
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+import psycopg2
+
+load_dotenv()
+
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_PORT = os.getenv('DB_PORT', '5435')
+DB_NAME = os.getenv('DB_NAME', 'library_db')
+DB_USER = os.getenv('DB_USER', 'library_user')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'library_pass')
+
+TABLES = ['bench_ledger_plain', 'bench_ledger_part']
+CHUNK_ROWS = 1_000_000
+NUM_MEMBERS = 1_000_000
+NUM_BOOKS = 5_000_000
+
+COLUMNS = """
+    id BIGINT NOT NULL,
+    book_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    action_type TEXT NOT NULL,
+    log_date TIMESTAMP NOT NULL,
+    due_date_snapshot TIMESTAMP
+"""
+
+
+def get_conn():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def create_tables(cur, months):
+    for table in TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+    cur.execute(f"CREATE TABLE bench_ledger_plain ({COLUMNS}, PRIMARY KEY (id))")
+    cur.execute(f"CREATE TABLE bench_ledger_part ({COLUMNS}, PRIMARY KEY (id, log_date)) PARTITION BY RANGE (log_date)")
+    cur.execute("SELECT date_trunc('month', CURRENT_DATE)::date")
+    current = cur.fetchone()[0]
+    for offset in range(-months + 1, 2):
+        cur.execute(
+            "SELECT (%s::date + %s * INTERVAL '1 month')::date, (%s::date + (%s + 1) * INTERVAL '1 month')::date",
+            (current, offset, current, offset)
+        )
+        start, end = cur.fetchone()
+        cur.execute(
+            f"CREATE TABLE bench_ledger_part_{start.year:04d}{start.month:02d} PARTITION OF bench_ledger_part "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+
+def create_indexes(cur):
+    for table in TABLES:
+        cur.execute(f"CREATE INDEX ON {table} (member_id, log_date DESC, id DESC) INCLUDE (book_id, action_type, due_date_snapshot)")
+        cur.execute(f"CREATE INDEX ON {table} (book_id, log_date DESC, id DESC) INCLUDE (member_id, action_type, due_date_snapshot)")
+        cur.execute(f"CREATE INDEX ON {table} (log_date DESC, id DESC)")
+
+
+def load_rows(conn, rows, months):
+    span_seconds = months * 30 * 86400
+    for table in TABLES:
+        started = time.perf_counter()
+        for offset in range(0, rows, CHUNK_ROWS):
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT INTO {table} (id, book_id, member_id, action_type, log_date, due_date_snapshot) "
+                    "SELECT g, 1 + (g * 7919) %% %(books)s, 1 + (g * 104729) %% %(members)s, "
+                    "CASE WHEN g %% 2 = 0 THEN 'BORROW' ELSE 'RETURN' END, "
+                    "NOW() - ((%(rows)s - g)::float / %(rows)s * %(span)s) * INTERVAL '1 second', NULL "
+                    "FROM generate_series(%(start)s, %(end)s) g",
+                    {'books': NUM_BOOKS, 'members': NUM_MEMBERS, 'rows': rows, 'span': span_seconds,
+                     'start': offset + 1, 'end': min(offset + CHUNK_ROWS, rows)}
+                )
+            conn.commit()
+        print(f"Loaded {rows} rows into {table} in {time.perf_counter() - started:.1f}s")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def timed(cur, sql, params_fn, samples):
+    latencies = []
+    for i in range(samples):
+        started = time.perf_counter()
+        cur.execute(sql, params_fn(i))
+        if cur.description:
+            cur.fetchall()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--keep', action='store_true', help='Keep the benchmark tables afterwards')
+    args = parser.parse_args()
+
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            create_tables(cur, args.months)
+        conn.commit()
+        load_rows(conn, args.rows, args.months)
+        with conn.cursor() as cur:
+            create_indexes(cur)
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(f"VACUUM (ANALYZE) {table}")
+
+        print(f"{'table':<20} {'insert p50':>11} {'insert p99':>11} {'history p50':>12} {'history p99':>12} "
+              f"{'month p50':>10} {'month p99':>10}   (ms)")
+        next_id = args.rows
+        for table in TABLES:
+            with conn.cursor() as cur:
+                def insert_params(i):
+                    return (next_id + i + 1, random.randint(1, NUM_BOOKS), random.randint(1, NUM_MEMBERS))
+
+                insert = timed(cur,
+                               f"INSERT INTO {table} (id, book_id, member_id, action_type, log_date) "
+                               "VALUES (%s, %s, %s, 'BORROW', NOW())",
+                               insert_params, args.samples)
+                history = timed(cur,
+                                f"SELECT * FROM {table} WHERE member_id = %s ORDER BY log_date DESC, id DESC LIMIT 50",
+                                lambda i: (random.randint(1, NUM_MEMBERS),), args.samples)
+                month = timed(cur,
+                              f"SELECT * FROM {table} WHERE member_id = %s AND log_date >= NOW() - INTERVAL '30 days' "
+                              "ORDER BY log_date DESC, id DESC LIMIT 50",
+                              lambda i: (random.randint(1, NUM_MEMBERS),), args.samples)
+            print(f"{table:<20} {insert[0]:>11.3f} {insert[1]:>11.3f} {history[0]:>12.3f} {history[1]:>12.3f} "
+                  f"{month[0]:>10.3f} {month[1]:>10.3f}")
+    finally:
+        if not args.keep:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for table in TABLES:
+                    cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import os
+from typing import Any, Dict
+
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,10 +16,225 @@ class Config:
 
     # Server
     SERVER_PORT = os.getenv('SERVER_PORT', '50051')
+    # WatchBooks and health Watch streams each hold one of these worker threads
+    # while open; WATCH_MAX_SUBSCRIBERS + HEALTH_MAX_WATCHERS may use at most
+    # half of them (checked at startup), leaving the rest for unary RPCs
+    SERVER_MAX_WORKERS = int(os.getenv('SERVER_MAX_WORKERS', '10'))
+    BATCH_GET_MAX_IDS = int(os.getenv('BATCH_GET_MAX_IDS', '1000'))
+    LEDGER_PAGE_MAX = int(os.getenv('LEDGER_PAGE_MAX', '500'))
+
+    # Startup: 'version' checks schema_version against db_helper.SCHEMA_VERSION
+    # with one query and refuses to start on an unmigrated database;
+    # 'create_all' creates missing tables (slow; for throwaway databases).
+    # POOL_PREWARM_CONNECTIONS are opened in parallel before serving
+    SCHEMA_CHECK = os.getenv('SCHEMA_CHECK', 'version')
+    POOL_PREWARM_CONNECTIONS = int(os.getenv('POOL_PREWARM_CONNECTIONS', '5'))
+
+    # Health (grpc.health.v1 on SERVER_PORT): the database is probed every
+    # HEALTH_PROBE_SECONDS on its own connection and counts as down once no
+    # probe has succeeded for HEALTH_DB_STALE_SECONDS. NOT_SERVING is also
+    # reported while checked-out connections reach HEALTH_MAX_POOL_UTILIZATION
+    # of pool size + overflow, or more than HEALTH_MAX_QUEUE_DEPTH calls wait
+    # for a worker. At most HEALTH_MAX_WATCHERS Watch streams are open at once;
+    # they share the stream half of SERVER_MAX_WORKERS with WatchBooks
+    # (WATCH_MAX_SUBSCRIBERS). On SIGTERM the server reports
+    # NOT_SERVING for DRAIN_SECONDS, then stops, giving calls in flight
+    # SHUTDOWN_GRACE_SECONDS
+    HEALTH_PROBE_SECONDS = float(os.getenv('HEALTH_PROBE_SECONDS', '2'))
+    HEALTH_DB_STALE_SECONDS = float(os.getenv('HEALTH_DB_STALE_SECONDS', '6'))
+    HEALTH_MAX_POOL_UTILIZATION = float(os.getenv('HEALTH_MAX_POOL_UTILIZATION', '0.9'))
+    HEALTH_MAX_QUEUE_DEPTH = int(os.getenv('HEALTH_MAX_QUEUE_DEPTH', '5'))
+    HEALTH_MAX_WATCHERS = int(os.getenv('HEALTH_MAX_WATCHERS', '2'))
+    DRAIN_SECONDS = float(os.getenv('DRAIN_SECONDS', '10'))
+    SHUTDOWN_GRACE_SECONDS = float(os.getenv('SHUTDOWN_GRACE_SECONDS', '20'))
+
+    # Borrow/return concurrency: 'pessimistic' (SELECT ... FOR UPDATE),
+    # 'optimistic' (version compare-and-swap) or 'nowait' (FOR UPDATE NOWAIT)
+    BORROW_CONCURRENCY_MODES = ('pessimistic', 'optimistic', 'nowait')
+    BORROW_CONCURRENCY_MODE = os.getenv('BORROW_CONCURRENCY_MODE', 'pessimistic')
+    BORROW_MAX_RETRIES = int(os.getenv('BORROW_MAX_RETRIES', '5'))
+    BORROW_RETRY_BASE_DELAY_MS = int(os.getenv('BORROW_RETRY_BASE_DELAY_MS', '5'))
+    BORROW_RETRY_MAX_DELAY_MS = int(os.getenv('BORROW_RETRY_MAX_DELAY_MS', '200'))
+    # Callers allowed to queue in-process on one book before new ones are
+    # turned away with ABORTED; 0 means unbounded
+    HOT_KEY_MAX_WAITERS = int(os.getenv('HOT_KEY_MAX_WAITERS', '32'))
+
+    # In-memory availability index (book id -> borrowed state/member)
+    AVAILABILITY_INDEX_ENABLED = os.getenv('AVAILABILITY_INDEX_ENABLED', 'true').lower() == 'true'
+    AVAILABILITY_RECONCILE_SECONDS = int(os.getenv('AVAILABILITY_RECONCILE_SECONDS', '300'))
+
+    # Ledger monthly partitions: created this many months ahead, and detached
+    # to the ledger_archive schema after LEDGER_RETENTION_MONTHS (0 keeps all)
+    LEDGER_PARTITION_MONTHS_AHEAD = int(os.getenv('LEDGER_PARTITION_MONTHS_AHEAD', '3'))
+    LEDGER_RETENTION_MONTHS = int(os.getenv('LEDGER_RETENTION_MONTHS', '0'))
+    LEDGER_PARTITION_CHECK_SECONDS = int(os.getenv('LEDGER_PARTITION_CHECK_SECONDS', '3600'))
+
+    # Due-date policy: loans run LOAN_PERIOD_DAYS from the borrow, optionally
+    # extended to the end of that (UTC) day
+    LOAN_PERIOD_DAYS = int(os.getenv('LOAN_PERIOD_DAYS', '14'))
+    LOAN_DUE_END_OF_DAY = os.getenv('LOAN_DUE_END_OF_DAY', 'true').lower() == 'true'
+
+    # Late fees (python -m jobs.fines). Tiers are '<first overdue day>:<cents per day>'
+    # pairs; each day is charged at the rate of the tier it falls in
+    FINE_RATE_TIERS = os.getenv('FINE_RATE_TIERS', '1:25,8:50,31:100')
+    FINE_MAX_CENTS = int(os.getenv('FINE_MAX_CENTS', '5000'))  # Per loan; 0 means uncapped
+    FINE_RECENT_RETURN_DAYS = int(os.getenv('FINE_RECENT_RETURN_DAYS', '30'))
+    FINE_CHUNK_SIZE = int(os.getenv('FINE_CHUNK_SIZE', '100000'))
+
+    # Catalog statistics: counter rows per statistic (more shards, less row
+    # contention between concurrent borrows) and the largest author list served
+    CATALOG_STATS_SHARDS = int(os.getenv('CATALOG_STATS_SHARDS', '16'))
+    CATALOG_STATS_AUTHORS_MAX = int(os.getenv('CATALOG_STATS_AUTHORS_MAX', '100'))
+
+    # Daily ledger rollups: ledger ids folded per transaction, how old a ledger
+    # row must be before it is folded (so slow in-flight transactions are not
+    # skipped), refresh interval (0 disables the in-process refresher) and the
+    # most rollup rows one query returns
+    ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', '50000'))
+    ROLLUP_SAFETY_SECONDS = int(os.getenv('ROLLUP_SAFETY_SECONDS', '60'))
+    ROLLUP_INTERVAL_SECONDS = int(os.getenv('ROLLUP_INTERVAL_SECONDS', '300'))
+    ROLLUP_QUERY_MAX_ROWS = int(os.getenv('ROLLUP_QUERY_MAX_ROWS', '5000'))
+
+    # "Also borrowed" recommendations (python -m jobs.related_books): ledger
+    # ids folded per transaction, how old a ledger row must be before it is
+    # folded, neighbours kept per book, and members with more distinct books
+    # than this are left out (their pairs grow quadratically and say little)
+    RELATED_BOOKS_BATCH_SIZE = int(os.getenv('RELATED_BOOKS_BATCH_SIZE', '50000'))
+    RELATED_BOOKS_SAFETY_SECONDS = int(os.getenv('RELATED_BOOKS_SAFETY_SECONDS', '60'))
+    RELATED_BOOKS_TOP_K = int(os.getenv('RELATED_BOOKS_TOP_K', '20'))
+    RELATED_BOOKS_MAX_MEMBER_BOOKS = int(os.getenv('RELATED_BOOKS_MAX_MEMBER_BOOKS', '500'))
+
+    # Change feed: largest ListChanges page, and how long changes are kept
+    # (pruned every CHANGE_LOG_PRUNE_SECONDS) before clients must re-list
+    CHANGE_LOG_PAGE_MAX = int(os.getenv('CHANGE_LOG_PAGE_MAX', '1000'))
+    CHANGE_LOG_RETENTION_HOURS = int(os.getenv('CHANGE_LOG_RETENTION_HOURS', '168'))
+    CHANGE_LOG_PRUNE_SECONDS = int(os.getenv('CHANGE_LOG_PRUNE_SECONDS', '3600'))
+
+    # WatchBooks streams: events buffered per stream before a slow consumer is
+    # dropped, streams per process (each holds a server worker; see
+    # SERVER_MAX_WORKERS for the budget shared with HEALTH_MAX_WATCHERS), and
+    # how often the change log is re-read if a notification is missed
+    WATCH_QUEUE_SIZE = int(os.getenv('WATCH_QUEUE_SIZE', '256'))
+    WATCH_MAX_SUBSCRIBERS = int(os.getenv('WATCH_MAX_SUBSCRIBERS', '3'))
+    WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '5'))
+
+    # Idempotency keys on BorrowBook/ReturnBook: longest accepted key, how long
+    # a key is honoured, recent keys cached per process, and the expired-key
+    # sweep (every IDEMPOTENCY_GC_SECONDS, in batches; 0 disables it)
+    IDEMPOTENCY_KEY_MAX_LENGTH = int(os.getenv('IDEMPOTENCY_KEY_MAX_LENGTH', '128'))
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+    IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+    IDEMPOTENCY_GC_SECONDS = int(os.getenv('IDEMPOTENCY_GC_SECONDS', '600'))
+    IDEMPOTENCY_GC_BATCH_SIZE = int(os.getenv('IDEMPOTENCY_GC_BATCH_SIZE', '1000'))
+
+    # Per-client rate limits: a token bucket per client (the
+    # RATE_LIMIT_CLIENT_HEADER metadata value, else the peer host) refilled at
+    # RATE_LIMIT_TOKENS_PER_SECOND up to RATE_LIMIT_BURST; each call costs 1
+    # unless listed in the '<method>:<cost>' pairs. A rate of 0 disables
+    # limiting. Re-read from .env / the environment on SIGHUP.
+    RATE_LIMIT_TOKENS_PER_SECOND = float(os.getenv('RATE_LIMIT_TOKENS_PER_SECOND', '20'))
+    RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '40'))
+    RATE_LIMIT_METHOD_COSTS = os.getenv(
+        'RATE_LIMIT_METHOD_COSTS',
+        'SearchBooks:5,SearchMembers:5,ListBooks:2,ListMembers:2,ListLedger:2,ListOverdueLoans:2,'
+        'BatchGetBooks:3,BatchGetMembers:3,GetCirculationRollup:3,WatchBooks:10'
+    )
+    RATE_LIMIT_CLIENT_HEADER = os.getenv('RATE_LIMIT_CLIENT_HEADER', 'x-client-id')
+    RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))
+
+    # Tracing: share of requests traced when the caller sent no sampling
+    # decision (an incoming W3C traceparent's sampled flag wins; 0 traces only
+    # those), and the OTLP/JSON-lines file spans are appended to every
+    # TRACE_FLUSH_SECONDS; spans beyond TRACE_QUEUE_SIZE pending are dropped
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+    TRACE_FILE = os.getenv('TRACE_FILE', 'logs/traces.jsonl')
+    TRACE_FLUSH_SECONDS = float(os.getenv('TRACE_FLUSH_SECONDS', '1'))
+    TRACE_QUEUE_SIZE = int(os.getenv('TRACE_QUEUE_SIZE', '10000'))
+    TRACE_SQL_MAX_LENGTH = int(os.getenv('TRACE_SQL_MAX_LENGTH', '2000'))
+
+    # Loan backfill from the ledger (python -m jobs.loan_backfill)
+    LOAN_BACKFILL_WORKERS = int(os.getenv('LOAN_BACKFILL_WORKERS', '4'))
+    LOAN_BACKFILL_BATCH_SIZE = int(os.getenv('LOAN_BACKFILL_BATCH_SIZE', '1000'))
+
+    # Borrow count backfill from the ledger (python -m jobs.borrow_count_backfill)
+    BORROW_COUNT_BACKFILL_WORKERS = int(os.getenv('BORROW_COUNT_BACKFILL_WORKERS', '4'))
+    BORROW_COUNT_BACKFILL_BATCH_SIZE = int(os.getenv('BORROW_COUNT_BACKFILL_BATCH_SIZE', '1000'))
+
+    # Metrics (Prometheus text format); 0 disables the exporter
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+    # Diagnostics admin service: its own port and interface (localhost, so
+    # only reachable from inside the pod/host; 0 disables it), the default
+    # tracemalloc top-N and snapshot interval, and the longest interval or
+    # profile capture one call may ask for
+    ADMIN_PORT = int(os.getenv('ADMIN_PORT', '50052'))
+    ADMIN_HOST = os.getenv('ADMIN_HOST', '127.0.0.1')
+    ADMIN_MAX_WORKERS = int(os.getenv('ADMIN_MAX_WORKERS', '4'))
+    DIAGNOSTICS_MEMORY_TOP_N = int(os.getenv('DIAGNOSTICS_MEMORY_TOP_N', '25'))
+    DIAGNOSTICS_MEMORY_INTERVAL_SECONDS = float(os.getenv('DIAGNOSTICS_MEMORY_INTERVAL_SECONDS', '10'))
+    DIAGNOSTICS_MAX_WAIT_SECONDS = float(os.getenv('DIAGNOSTICS_MAX_WAIT_SECONDS', '300'))
 
     # Logging
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
     LOG_FILE = os.getenv('LOG_FILE', 'logs/backend.log')
 
+    # SQL profiling: statements slower than SLOW_QUERY_MS go to the slow-query
+    # log (0 disables it), and RPCs issuing more statements than their budget
+    # ('<method>:<statements>' pairs, else QUERY_BUDGET_DEFAULT) are flagged
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    SLOW_QUERY_LOG_FILE = os.getenv('SLOW_QUERY_LOG_FILE', 'logs/slow_queries.log')
+    QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', '10'))
+    QUERY_BUDGETS = os.getenv('QUERY_BUDGETS', 'BorrowBook:20,ReturnBook:20,CreateBook:12,UpdateBook:12')
+
+    # Sampling profiler: samples RPC thread stacks at PROFILER_SAMPLE_HZ
+    # (slowed down so sampling stays under PROFILER_MAX_OVERHEAD of a core).
+    # SIGUSR2 writes PROFILER_CAPTURE_SECONDS of collapsed stacks to
+    # PROFILER_DIR, sampling just for the capture when not enabled
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+    PROFILER_SAMPLE_HZ = float(os.getenv('PROFILER_SAMPLE_HZ', '19'))
+    PROFILER_MAX_OVERHEAD = float(os.getenv('PROFILER_MAX_OVERHEAD', '0.01'))
+    PROFILER_MAX_DEPTH = int(os.getenv('PROFILER_MAX_DEPTH', '64'))
+    PROFILER_MAX_STACKS = int(os.getenv('PROFILER_MAX_STACKS', '20000'))
+    PROFILER_CAPTURE_SECONDS = float(os.getenv('PROFILER_CAPTURE_SECONDS', '30'))
+    PROFILER_DIR = os.getenv('PROFILER_DIR', 'logs/profiles')
+
     # Email/SQS keyword
     ERROR_KEYWORD = os.getenv('ERROR_KEYWORD', '[LIBRARY_ERROR]')
+
+    @classmethod
+    def validate(cls) -> None:
+        """Reject settings with no fallback worth running on; called once at startup"""
+        if cls.BORROW_CONCURRENCY_MODE not in cls.BORROW_CONCURRENCY_MODES:
+            raise ValueError(f"BORROW_CONCURRENCY_MODE must be one of {', '.join(cls.BORROW_CONCURRENCY_MODES)}, "
+                             f"not {cls.BORROW_CONCURRENCY_MODE!r}")
+        # Streams hold their worker for as long as they are open; the other half is kept for unary RPCs
+        if cls.WATCH_MAX_SUBSCRIBERS + cls.HEALTH_MAX_WATCHERS > cls.SERVER_MAX_WORKERS // 2:
+            raise ValueError(f"WATCH_MAX_SUBSCRIBERS + HEALTH_MAX_WATCHERS ({cls.WATCH_MAX_SUBSCRIBERS} + "
+                             f"{cls.HEALTH_MAX_WATCHERS}) must be at most half of SERVER_MAX_WORKERS "
+                             f"({cls.SERVER_MAX_WORKERS})")
+
+    @classmethod
+    def read(cls, *names: str) -> Dict[str, Any]:
+        """Parse the named settings from .env / the environment, keeping each one's type, without applying them
+
+        Settings that are not set are left out. Raises ValueError naming the
+        first one that does not parse.
+        """
+        load_dotenv(override=True)
+        values = {}
+        for name in names:
+            value = os.getenv(name)
+            if value is None:
+                continue
+            current = getattr(cls, name)
+            try:
+                values[name] = value.lower() == 'true' if isinstance(current, bool) else type(current)(value)
+            except ValueError:
+                raise ValueError(f"Invalid {name}: {value!r}")
+        return values
+
+    @classmethod
+    def apply(cls, values: Dict[str, Any]) -> None:
+        """Swap in settings returned by ``read``"""
+        for name, value in values.items():
+            setattr(cls, name, value)
@@ -1,12 +1,15 @@
 import json
 import os
 import re
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, BigInteger, Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from dotenv import load_dotenv
 from datetime import datetime
 
+from tracing import timed_calls
+
 load_dotenv()
 
 Base = declarative_base()
@@ -43,9 +46,24 @@ class Book(Base):
     author = Column(String, nullable=False)
     is_borrowed = Column(Boolean, default=False)
     current_member_id = Column(Integer, ForeignKey('member.id'))
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # Bumped on every borrow/return
+    borrow_count = Column(Integer, nullable=False, default=0, server_default='0')  # Incremented by every borrow
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Open loans only: member's borrowed books and the 'borrowed' list filter
+        Index('idx_book_open_loans_member', 'current_member_id', 'id', postgresql_where=text('is_borrowed')),
+        Index('idx_book_open_loans', 'id', postgresql_where=text('is_borrowed')),
+        # Foreign key lookups (member deletes), which have no is_borrowed predicate
+        Index('idx_book_current_member_fk', 'current_member_id',
+              postgresql_where=text('current_member_id IS NOT NULL')),
+        # Recent books ordered by updated_at, id as tie-breaker
+        Index('idx_book_updated_at_id', 'updated_at', 'id'),
+        # 'popular' order: most borrowed first, id as tie-breaker
+        Index('idx_book_borrow_count', borrow_count.desc(), 'id'),
+    )
+
     @classmethod
     def validate_data(cls, title, author):
         if not title or not title.strip():
@@ -66,13 +84,182 @@ class Book(Base):
 
 class Ledger(Base):
     __tablename__ = 'ledger'
-    id = Column(Integer, primary_key=True)
+    # Range-partitioned by log_date (monthly), so the partition key must be
+    # part of the primary key; partitions are managed by LedgerPartitionRepository
+    id = Column(Integer, primary_key=True, autoincrement=True)
     book_id = Column(Integer, ForeignKey('book.id'), nullable=False)
     member_id = Column(Integer, ForeignKey('member.id'), nullable=False)
     action_type = Column(String, nullable=False)  # 'BORROW' or 'RETURN'
-    log_date = Column(DateTime, default=datetime.utcnow)
+    log_date = Column(DateTime, primary_key=True, default=datetime.utcnow)
     due_date_snapshot = Column(DateTime)
 
+    __table_args__ = (
+        # Member / book history, newest first, keyset-paged on (log_date, id).
+        # INCLUDE makes the history pages index-only scans.
+        Index('idx_ledger_member_history', member_id, log_date.desc(), id.desc(),
+              postgresql_include=['book_id', 'action_type', 'due_date_snapshot']),
+        Index('idx_ledger_book_history', book_id, log_date.desc(), id.desc(),
+              postgresql_include=['member_id', 'action_type', 'due_date_snapshot']),
+        # Unfiltered / date-range listing
+        Index('idx_ledger_log_date', log_date.desc(), id.desc()),
+        {'postgresql_partition_by': 'RANGE (log_date)'},
+    )
+
+
+class Loan(Base):
+    __tablename__ = 'loan'
+    # One row per borrow, closed by the matching return. Written in the same
+    # transaction as the book update and ledger entries; borrowed_at/returned_at
+    # equal the log_date of the BORROW/RETURN ledger rows.
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, ForeignKey('book.id'), nullable=False)
+    member_id = Column(Integer, ForeignKey('member.id'), nullable=False)
+    borrowed_at = Column(DateTime, nullable=False)
+    due_at = Column(DateTime)
+    returned_at = Column(DateTime)  # NULL while the loan is open
+
+    __table_args__ = (
+        # Book history, and the natural key the ledger backfill upserts on
+        Index('idx_loan_book_borrowed_at', 'book_id', 'borrowed_at', unique=True),
+        # At most one open loan per book; also the lookup used by returns
+        Index('idx_loan_open_book', 'book_id', unique=True, postgresql_where=text('returned_at IS NULL')),
+        # Member history, newest first
+        Index('idx_loan_member_history', member_id, borrowed_at.desc(), id.desc()),
+        # Loans started in a date range
+        Index('idx_loan_borrowed_at', borrowed_at, id),
+        # Overdue report: open loans only, oldest due date first
+        Index('idx_loan_open_due', due_at, id, postgresql_where=text('returned_at IS NULL')),
+        # Recently returned loans, read by the fines job
+        Index('idx_loan_returned_at', returned_at, postgresql_where=text('returned_at IS NOT NULL')),
+    )
+
+
+class Fine(Base):
+    __tablename__ = 'fine'
+    # Late fee per loan, recomputed in bulk by jobs.fines. member_id is
+    # denormalized from loan so member balances need no join.
+    loan_id = Column(Integer, ForeignKey('loan.id'), primary_key=True)
+    member_id = Column(Integer, nullable=False)
+    days_overdue = Column(Integer, nullable=False)
+    amount_cents = Column(Integer, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('idx_fine_member', 'member_id', 'loan_id', postgresql_include=['amount_cents']),
+    )
+
+
+class CatalogStat(Base):
+    __tablename__ = 'catalog_stats'
+    # Catalog-wide counters ('total_books', 'borrowed_books', 'active_borrowers')
+    # split over shards so concurrent transactions rarely update the same row;
+    # a counter's value is the sum of its shards.
+    name = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class AuthorStat(Base):
+    __tablename__ = 'author_stats'
+    author = Column(String, primary_key=True)
+    book_count = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('idx_author_stats_book_count', book_count.desc(), author),
+    )
+
+
+class LedgerDailyRollup(Base):
+    __tablename__ = 'ledger_daily_rollup'
+    # Borrows/returns per day, per dimension: 'all' (key ''), 'author' (book
+    # author) or 'cohort' (member sign-up month, 'YYYY-MM'). Built from the
+    # ledger incrementally by jobs.ledger_rollup.
+    dimension = Column(String, primary_key=True)
+    dimension_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    borrows = Column(BigInteger, nullable=False, default=0)
+    returns = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        # Every key of a dimension over a date range
+        Index('idx_ledger_rollup_dimension_day', 'dimension', 'day'),
+    )
+
+
+class RollupWatermark(Base):
+    __tablename__ = 'rollup_watermark'
+    # Highest ledger.id already folded into a rollup
+    name = Column(String, primary_key=True)
+    last_id = Column(BigInteger, nullable=False, default=0)
+
+
+class BookCooccurrence(Base):
+    __tablename__ = 'book_cooccurrence'
+    # Sparse co-occurrence matrix: distinct members who borrowed both books.
+    # Stored in both directions; built incrementally by jobs.related_books.
+    book_id = Column(Integer, primary_key=True)
+    related_book_id = Column(Integer, primary_key=True)
+    members = Column(Integer, nullable=False)
+
+
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+    # Transactional outbox: one row per changed book/member/loan, written in
+    # the same transaction as the change and read by ListChanges
+    seq = Column(BigInteger, primary_key=True)
+    entity = Column(String, nullable=False)  # 'book', 'member' or 'loan'
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # 'create', 'update', 'borrow' or 'return'
+    data = Column(JSONB, nullable=False)  # Changed fields; every field on create
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Writing transaction's id; rows are served in (txid, seq) order, once
+    # txid is below the snapshot xmin (no earlier change can still commit)
+    txid = Column(BigInteger, nullable=False, server_default=text('pg_current_xact_id()::text::bigint'))
+
+    __table_args__ = (
+        # Serving order: ListChanges pages, WatchBooks and pruning
+        Index('idx_change_log_txid_seq', txid, seq),
+    )
+
+
+class RelatedBooks(Base):
+    __tablename__ = 'related_books'
+    # Top-K rows of book_cooccurrence per book, most shared members first
+    book_id = Column(Integer, primary_key=True)
+    related_ids = Column(ARRAY(Integer), nullable=False)
+    members = Column(ARRAY(Integer), nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_key'
+    # Client-supplied key of a BorrowBook/ReturnBook call and the ledger entry
+    # it produced, written in the same transaction. Kept apart from the
+    # partitioned ledger, whose unique indexes must include log_date.
+    key = Column(String, primary_key=True)
+    operation = Column(String, nullable=False)  # 'borrow' or 'return'
+    book_id = Column(Integer, nullable=False)
+    member_id = Column(Integer, nullable=False)
+    ledger_entry = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Expired-key sweep, oldest first
+        Index('idx_idempotency_key_created_at', created_at),
+    )
+
+
+# Number of the latest migration in migrations/. Each migration from 014 on
+# records its number in schema_version, which the server checks on startup.
+SCHEMA_VERSION = 14
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    # One row per applied migration
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 
 # Database setup
 DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
@@ -90,6 +277,7 @@ def get_db():
 
 class DatabaseHelper:
     @staticmethod
+    @timed_calls('sqlalchemy_to_dict')
     def sqlalchemy_to_dict(obj):
         data = {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
         data.pop('_sa_instance_state', None)
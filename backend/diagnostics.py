@@ -0,0 +1,230 @@
+import gc
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from concurrent import futures
+from typing import Any, Dict, List, Optional
+
+import grpc
+
+import diagnostics_pb2
+import diagnostics_pb2_grpc
+from config import Config
+from db_helper import engine as default_engine
+from error_codes import ErrorCodes
+from logger import logger
+from repositories import availability_index, idempotency_cache
+from repositories.availability_index import lookups_total as availability_lookups_total
+from sampling_profiler import profiler, rpc_threads
+
+# Only one tracemalloc diff at a time: a call may start and stop tracing
+_memory_lock = threading.Lock()
+
+
+def pool_status(engine=default_engine, executor: Optional[futures.ThreadPoolExecutor] = None) -> Dict[str, int]:
+    """Engine pool occupancy and the gRPC executor's workers and backlog"""
+    pool = engine.pool
+    status = {
+        'pool_size': pool.size() if hasattr(pool, 'size') else 0,
+        'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else 0,
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else 0,
+        'overflow': pool.overflow() if hasattr(pool, 'overflow') else 0,
+        'max_overflow': getattr(pool, '_max_overflow', 0),
+        'active_rpcs': len(rpc_threads()),
+    }
+    if executor is not None:
+        # ThreadPoolExecutor has no public view of its threads or queue
+        status['executor_workers'] = len(executor._threads)
+        status['executor_max_workers'] = executor._max_workers
+        status['executor_queue_depth'] = executor._work_queue.qsize()
+    return status
+
+
+def thread_stacks() -> List[Dict[str, Any]]:
+    """Every thread's current stack, formatted like a traceback"""
+    frames = sys._current_frames()
+    methods = rpc_threads()
+    threads = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        threads.append({
+            'thread_id': thread.ident or 0,
+            'name': thread.name,
+            'daemon': thread.daemon,
+            'rpc_method': methods.get(thread.ident, ''),
+            'stack': ''.join(traceback.format_stack(frame)) if frame is not None else '',
+        })
+    return threads
+
+
+def memory_top(top_n: int = Config.DIAGNOSTICS_MEMORY_TOP_N,
+               interval_seconds: float = Config.DIAGNOSTICS_MEMORY_INTERVAL_SECONDS) -> Dict[str, Any]:
+    """Allocation sites that grew most between two tracemalloc snapshots ``interval_seconds`` apart
+
+    When tracemalloc is not already tracing (PYTHONTRACEMALLOC), it is
+    started for the interval only, so the first snapshot is empty and the
+    diff shows what was allocated, and is still alive, during the interval.
+    """
+    with _memory_lock:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            first = tracemalloc.take_snapshot()
+            time.sleep(interval_seconds)
+            second = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+    ignored = (tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+    diffs = second.filter_traces(ignored).compare_to(first.filter_traces(ignored), 'lineno')
+    allocations = []
+    for stat in diffs[:top_n]:
+        frame = stat.traceback[0]
+        allocations.append({
+            'location': f"{frame.filename}:{frame.lineno}",
+            'size_bytes': stat.size,
+            'size_diff_bytes': stat.size_diff,
+            'count': stat.count,
+            'count_diff': stat.count_diff,
+        })
+    return {'allocations': allocations, 'traced_bytes': traced, 'traced_peak_bytes': peak,
+            'tracing_was_enabled': was_tracing}
+
+
+def gc_stats() -> Dict[str, Any]:
+    """Per-generation collector statistics"""
+    counts, thresholds = gc.get_count(), gc.get_threshold()
+    generations = [{
+        'generation': generation,
+        'collections': stats['collections'],
+        'collected': stats['collected'],
+        'uncollectable': stats['uncollectable'],
+        'pending': counts[generation],
+        'threshold': thresholds[generation],
+    } for generation, stats in enumerate(gc.get_stats())]
+    return {'generations': generations, 'garbage': len(gc.garbage), 'enabled': gc.isenabled()}
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """Hit rates of the process-wide caches"""
+    idempotency = idempotency_cache.stats()
+    caches = [dict(name='idempotency_cache', **idempotency), {
+        # Lookups the index answered vs. those sent to the database before it loaded
+        'name': 'availability_index',
+        'hits': int(availability_lookups_total.value(source='index')),
+        'misses': int(availability_lookups_total.value(source='database')),
+        'size': availability_index.counts()[0] if availability_index.loaded else 0,
+        'capacity': 0,
+    }]
+    for cache in caches:
+        lookups = cache['hits'] + cache['misses']
+        cache['hit_rate'] = cache['hits'] / lookups if lookups else 0.0
+    return caches
+
+
+def _wait_seconds(requested: float, default: float) -> float:
+    if requested < 0 or requested > Config.DIAGNOSTICS_MAX_WAIT_SECONDS:
+        raise ValueError(f"Duration must be between 0 and {Config.DIAGNOSTICS_MAX_WAIT_SECONDS} seconds")
+    return requested or default
+
+
+class DiagnosticsGrpcService(diagnostics_pb2_grpc.DiagnosticsServicer):
+    """Admin RPCs looking inside this process (see start_admin_server)"""
+
+    def __init__(self, executor: Optional[futures.ThreadPoolExecutor] = None, engine=default_engine):
+        self._executor = executor
+        self._engine = engine
+
+    @staticmethod
+    def _fail(context, operation: str, error: Exception, response):
+        if isinstance(error, ValueError):
+            logger.warning(f"{operation} validation error: {str(error)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(error)}))
+        else:
+            logger.error(f"{Config.ERROR_KEYWORD} {operation} operation failed: {str(error)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+        return response
+
+    def GetPoolStatus(self, request, context):
+        """Engine pool and executor occupancy"""
+        try:
+            return diagnostics_pb2.GetPoolStatusResponse(**pool_status(self._engine, self._executor))
+        except Exception as e:
+            return self._fail(context, 'GetPoolStatus', e, diagnostics_pb2.GetPoolStatusResponse())
+
+    def GetThreadStacks(self, request, context):
+        """Stacks of every thread in the process"""
+        logger.info("GetThreadStacks operation started")
+        try:
+            threads = [diagnostics_pb2.ThreadStack(**thread) for thread in thread_stacks()]
+            return diagnostics_pb2.GetThreadStacksResponse(threads=threads)
+        except Exception as e:
+            return self._fail(context, 'GetThreadStacks', e, diagnostics_pb2.GetThreadStacksResponse())
+
+    def GetMemoryTop(self, request, context):
+        """Top allocation growth between two tracemalloc snapshots"""
+        logger.info(f"GetMemoryTop operation started for top_n: {request.top_n}, "
+                    f"interval: {request.interval_seconds}s")
+        try:
+            if request.top_n < 0:
+                raise ValueError("top_n cannot be negative")
+            interval = _wait_seconds(request.interval_seconds, Config.DIAGNOSTICS_MEMORY_INTERVAL_SECONDS)
+            result = memory_top(request.top_n or Config.DIAGNOSTICS_MEMORY_TOP_N, interval)
+            allocations = [diagnostics_pb2.AllocationDiff(**allocation) for allocation in result.pop('allocations')]
+            return diagnostics_pb2.GetMemoryTopResponse(allocations=allocations, **result)
+        except Exception as e:
+            return self._fail(context, 'GetMemoryTop', e, diagnostics_pb2.GetMemoryTopResponse())
+
+    def GetGcStats(self, request, context):
+        """Garbage collector statistics per generation"""
+        try:
+            result = gc_stats()
+            generations = [diagnostics_pb2.GcGeneration(**generation) for generation in result.pop('generations')]
+            return diagnostics_pb2.GetGcStatsResponse(generations=generations, **result)
+        except Exception as e:
+            return self._fail(context, 'GetGcStats', e, diagnostics_pb2.GetGcStatsResponse())
+
+    def GetCacheStats(self, request, context):
+        """Hit rates of the in-process caches"""
+        try:
+            caches = [diagnostics_pb2.CacheStats(**cache) for cache in cache_stats()]
+            return diagnostics_pb2.GetCacheStatsResponse(caches=caches)
+        except Exception as e:
+            return self._fail(context, 'GetCacheStats', e, diagnostics_pb2.GetCacheStatsResponse())
+
+    def CaptureProfile(self, request, context):
+        """Collapsed stacks from the sampling profiler over the requested duration"""
+        logger.info(f"CaptureProfile operation started for {request.duration_seconds}s, "
+                    f"method: {request.method or 'all'}")
+        try:
+            duration = _wait_seconds(request.duration_seconds, Config.PROFILER_CAPTURE_SECONDS)
+            collapsed = profiler.capture(duration, request.method or None)
+            samples = sum(int(line.rsplit(' ', 1)[1]) for line in collapsed.splitlines())
+            return diagnostics_pb2.CaptureProfileResponse(collapsed_stacks=collapsed, samples=samples)
+        except Exception as e:
+            return self._fail(context, 'CaptureProfile', e, diagnostics_pb2.CaptureProfileResponse())
+
+
+def start_admin_server(port: int, executor: Optional[futures.ThreadPoolExecutor] = None) -> grpc.Server:
+    """Serve the Diagnostics service on ADMIN_HOST:``port``, apart from the client-facing server
+
+    It has its own small executor, so it still answers when every client
+    worker is busy, and none of the client interceptors (rate limits,
+    deadlines, query budgets) apply.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=Config.ADMIN_MAX_WORKERS,
+                                                    thread_name_prefix='admin'))
+    diagnostics_pb2_grpc.add_DiagnosticsServicer_to_server(DiagnosticsGrpcService(executor), server)
+    server.add_insecure_port(f"{Config.ADMIN_HOST}:{port}")
+    server.start()
+    logger.info(f"Diagnostics admin server listening on {Config.ADMIN_HOST}:{port}")
+    return server
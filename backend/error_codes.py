@@ -5,4 +5,12 @@ class ErrorCodes:
     BOOK_NOT_BORROWED = "BOOK_NOT_BORROWED"
     BOOK_NOT_BORROWED_BY_MEMBER = "BOOK_NOT_BORROWED_BY_MEMBER"
     EMAIL_ALREADY_EXISTS = "EMAIL_ALREADY_EXISTS"
-    INVALID_INPUT = "INVALID_INPUT"
\ No newline at end of file
+    INVALID_INPUT = "INVALID_INPUT"
+    CONCURRENT_MODIFICATION = "CONCURRENT_MODIFICATION"
+    CHANGES_EXPIRED = "CHANGES_EXPIRED"
+    TOO_MANY_WATCHERS = "TOO_MANY_WATCHERS"
+    WATCH_TOO_SLOW = "WATCH_TOO_SLOW"
+    IDEMPOTENCY_KEY_REUSED = "IDEMPOTENCY_KEY_REUSED"
+    DEADLINE_EXCEEDED = "DEADLINE_EXCEEDED"
+    CANCELLED = "CANCELLED"
+    RATE_LIMITED = "RATE_LIMITED"
\ No newline at end of file
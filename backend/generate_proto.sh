@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # Generate Python code from proto files
-python -m grpc_tools.protoc -I./proto --python_out=. --grpc_python_out=. ./proto/book.proto ./proto/member.proto ./proto/ledger.proto ./proto/library.proto
+python -m grpc_tools.protoc -I./proto --python_out=. --grpc_python_out=. ./proto/book.proto ./proto/member.proto ./proto/ledger.proto ./proto/change.proto ./proto/library.proto ./proto/diagnostics.proto ./proto/health.proto
 
 echo "Proto files generated successfully!"
 
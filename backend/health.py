@@ -0,0 +1,216 @@
+import threading
+import time
+from concurrent import futures
+from typing import Callable, Optional, Tuple
+
+import grpc
+import psycopg2
+
+import health_pb2
+import health_pb2_grpc
+from config import Config
+from db_helper import DATABASE_URL, engine as default_engine
+from diagnostics import pool_status
+from logger import logger
+from metrics import registry
+from startup import Readiness, readiness as default_readiness
+
+SERVING = health_pb2.HealthCheckResponse.SERVING
+NOT_SERVING = health_pb2.HealthCheckResponse.NOT_SERVING
+SERVICE_UNKNOWN = health_pb2.HealthCheckResponse.SERVICE_UNKNOWN
+
+# '' is the server as a whole; every service shares its status
+SERVICES = ('', 'library.LibraryService')
+
+transitions_total = registry.counter(
+    'library_health_transitions_total', 'Health status changes, by the status entered and why')
+
+
+class HealthMonitor:
+    """Serving status from startup, a background database probe, pool use and executor backlog
+
+    The database is probed on a dedicated connection (so a full pool does not
+    block the probe, and the probe never takes a pooled connection) every
+    HEALTH_PROBE_SECONDS. The status is NOT_SERVING until the server is
+    ready, while the last successful probe is older than
+    HEALTH_DB_STALE_SECONDS, while the pool or the executor queue is
+    saturated, and for good once ``drain`` is called.
+    """
+
+    def __init__(self, executor: Optional[futures.ThreadPoolExecutor] = None, engine=default_engine,
+                 readiness: Readiness = default_readiness, probe: Optional[Callable[[], None]] = None):
+        self._executor = executor
+        self._engine = engine
+        self._readiness = readiness
+        self._probe = probe or self._probe_database
+        self._connection = None
+        self._last_probe_ok: Optional[float] = None
+        self._draining = False
+        self._drain_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._status, self._reason = NOT_SERVING, 'starting'
+
+    def _probe_database(self) -> None:
+        if self._connection is None or self._connection.closed:
+            self._connection = psycopg2.connect(
+                DATABASE_URL, connect_timeout=max(int(Config.HEALTH_DB_STALE_SECONDS), 1),
+                options=f"-c statement_timeout={int(Config.HEALTH_PROBE_SECONDS * 1000)}")
+            self._connection.autocommit = True
+        with self._connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    def probe(self) -> bool:
+        """Run one database probe and refresh the status; returns whether the probe succeeded"""
+        try:
+            self._probe()
+            self._last_probe_ok = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning(f"Health database probe failed: {str(e)}")
+            if self._connection is not None:
+                try:
+                    self._connection.close()
+                except Exception:
+                    pass
+                self._connection = None
+            return False
+        finally:
+            self.refresh()
+
+    def evaluate(self) -> Tuple[int, str]:
+        """(status, reason) from the current state"""
+        if self._draining:
+            return NOT_SERVING, 'draining'
+        if not self._readiness.ready:
+            return NOT_SERVING, 'starting'
+        if self._last_probe_ok is None or time.monotonic() - self._last_probe_ok > Config.HEALTH_DB_STALE_SECONDS:
+            return NOT_SERVING, 'database unreachable'
+        status = pool_status(self._engine, self._executor)
+        capacity = status['pool_size'] + max(status['max_overflow'], 0)
+        if capacity and status['checked_out'] / capacity >= Config.HEALTH_MAX_POOL_UTILIZATION:
+            return NOT_SERVING, f"pool saturated ({status['checked_out']}/{capacity} connections in use)"
+        if status.get('executor_queue_depth', 0) > Config.HEALTH_MAX_QUEUE_DEPTH:
+            return NOT_SERVING, f"executor backlog ({status['executor_queue_depth']} RPCs waiting)"
+        return SERVING, 'ok'
+
+    def refresh(self) -> int:
+        """Re-evaluate the status, logging and announcing a change; returns the status"""
+        status, reason = self.evaluate()
+        with self._changed:
+            if (status, reason) != (self._status, self._reason):
+                if status != self._status:
+                    name = health_pb2.HealthCheckResponse.ServingStatus.Name(status)
+                    transitions_total.inc(status=name, reason=reason.split(' (')[0])
+                    logger.info(f"Health status is now {name}: {reason}")
+                self._status, self._reason = status, reason
+                self._changed.notify_all()
+        return status
+
+    @property
+    def status(self) -> int:
+        return self._status
+
+    def wait_for_change(self, status: int, timeout: float) -> int:
+        """Block until the status differs from ``status`` or ``timeout`` passes; returns the status"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._status != status, timeout)
+            return self._status
+
+    def drain(self) -> bool:
+        """Report NOT_SERVING from now on so load balancers stop sending calls; False if already draining"""
+        with self._drain_lock:
+            first = not self._draining
+            self._draining = True
+        self.refresh()
+        return first
+
+    def start(self, interval_seconds: float = Config.HEALTH_PROBE_SECONDS) -> threading.Event:
+        """Probe every ``interval_seconds`` on a daemon thread; set the returned event to stop"""
+        stop = threading.Event()
+
+        def run():
+            while True:
+                self.probe()
+                if stop.wait(interval_seconds):
+                    break
+
+        threading.Thread(target=run, name='health-probe', daemon=True).start()
+        return stop
+
+
+class HealthGrpcService(health_pb2_grpc.HealthServicer):
+    """grpc.health.v1.Health backed by a HealthMonitor
+
+    Each Watch stream holds an executor worker for as long as it is open, as
+    WatchBooks streams do, so streams beyond ``max_watchers`` are refused with
+    RESOURCE_EXHAUSTED. Config.validate keeps the two caps together within
+    half of the server's workers.
+    """
+
+    def __init__(self, monitor: HealthMonitor, max_watchers: int = Config.HEALTH_MAX_WATCHERS):
+        self._monitor = monitor
+        self._max_watchers = max_watchers
+        self._lock = threading.Lock()
+        self._watchers = 0
+
+    def Check(self, request, context):
+        """Current serving status"""
+        if request.service not in SERVICES:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"Unknown service: {request.service}")
+            return health_pb2.HealthCheckResponse()
+        # Pool and executor use change between probes, so they are re-read here
+        return health_pb2.HealthCheckResponse(status=self._monitor.refresh())
+
+    def Watch(self, request, context):
+        """The serving status now, then each time it changes"""
+        if request.service not in SERVICES:
+            yield health_pb2.HealthCheckResponse(status=SERVICE_UNKNOWN)
+            return
+        with self._lock:
+            full = self._watchers >= self._max_watchers
+            if not full:
+                self._watchers += 1
+        if full:
+            logger.warning(f"Health Watch rejected: {self._max_watchers} streams already open")
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details("Too many health watchers on this server, retry later")
+            return
+        try:
+            status = self._monitor.refresh()
+            yield health_pb2.HealthCheckResponse(status=status)
+            while context.is_active():
+                changed = self._monitor.wait_for_change(status, Config.HEALTH_PROBE_SECONDS)
+                if changed != status:
+                    status = changed
+                    yield health_pb2.HealthCheckResponse(status=status)
+        finally:
+            with self._lock:
+                self._watchers -= 1
+
+
+def start_drain(monitor: HealthMonitor, server: grpc.Server, drain_seconds: float = Config.DRAIN_SECONDS,
+                grace_seconds: float = Config.SHUTDOWN_GRACE_SECONDS,
+                admin_server: Optional[grpc.Server] = None) -> Optional[threading.Thread]:
+    """Report NOT_SERVING, wait ``drain_seconds`` for load balancers to notice, then stop the server
+
+    Calls still in flight when the server stops get ``grace_seconds`` to
+    finish. The admin server, if given, is stopped last so diagnostics stay
+    available while draining. Runs on a daemon thread so it can be started
+    from a signal handler; once a drain is under way, later calls return None.
+    """
+    if not monitor.drain():
+        logger.info("Already draining, ignoring the repeated shutdown request")
+        return None
+
+    def run():
+        logger.info(f"Draining: NOT_SERVING for {drain_seconds}s, then stopping with a {grace_seconds}s grace period")
+        time.sleep(drain_seconds)
+        server.stop(grace_seconds).wait()
+        if admin_server is not None:
+            admin_server.stop(grace_seconds).wait()
+        logger.info("Server drained and stopped")
+
+    thread = threading.Thread(target=run, name='drain', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,280 @@
+import json
+import threading
+
+import grpc
+
+from error_codes import ErrorCodes
+from logger import logger
+from rate_limiter import RateLimiter, rate_limited_total, rate_limiter
+from request_context import DeadlineExceeded, RequestAborted, request_scope
+from sampling_profiler import rpc_method
+from sql_profiler import check_budget, profile_queries
+from tracing import KIND_INTERNAL, activate, current_span, start_trace
+
+
+# Health checks come from load balancers and probes, which must never be rate limited
+UNLIMITED_PREFIX = '/grpc.health.v1.Health/'
+
+
+def _method_name(handler_call_details) -> str:
+    return handler_call_details.method.rsplit('/', 1)[-1]
+
+
+def _abort(context, method: str, error: RequestAborted) -> None:
+    logger.warning(f"{method} abandoned: {str(error)}")
+    if isinstance(error, DeadlineExceeded):
+        context.abort(grpc.StatusCode.DEADLINE_EXCEEDED,
+                      json.dumps({"code": ErrorCodes.DEADLINE_EXCEEDED, "message": str(error)}))
+    context.abort(grpc.StatusCode.CANCELLED, json.dumps({"code": ErrorCodes.CANCELLED, "message": str(error)}))
+
+
+class DeadlineInterceptor(grpc.ServerInterceptor):
+    """Propagates each RPC's deadline and cancellation to its database work
+
+    Handlers run inside a RequestScope (see request_context), so sessions are
+    not opened once the deadline has passed, every transaction carries a
+    statement_timeout of the time left, and a client cancellation cancels
+    the statements in flight. The resulting RequestAborted is answered with
+    DEADLINE_EXCEEDED or CANCELLED.
+    """
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def unary_unary(request, context):
+                with request_scope(context):
+                    try:
+                        return behavior(request, context)
+                    except RequestAborted as e:
+                        _abort(context, method, e)
+
+            return handler._replace(unary_unary=unary_unary)
+
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            def unary_stream(request, context):
+                with request_scope(context):
+                    try:
+                        yield from behavior(request, context)
+                    except RequestAborted as e:
+                        _abort(context, method, e)
+
+            return handler._replace(unary_stream=unary_stream)
+
+        return handler
+
+
+class RateLimitInterceptor(grpc.ServerInterceptor):
+    """Rejects calls from clients that ran out of tokens with RESOURCE_EXHAUSTED
+
+    Runs before any other interceptor so a client over its limit costs one
+    bucket update, not a worker's time in a handler or a database
+    connection. Rejections carry a ``retry-after`` trailer in seconds.
+    Health checks are never limited.
+    """
+
+    def __init__(self, limiter: RateLimiter = rate_limiter):
+        self._limiter = limiter
+
+    def _admit(self, method: str, context) -> None:
+        if not self._limiter.enabled:
+            return
+        client = self._limiter.client_key(context.invocation_metadata(), context.peer())
+        wait = self._limiter.acquire(client, method)
+        if wait:
+            rate_limited_total.inc(method=method)
+            retry_after = RateLimiter.retry_after(wait)
+            logger.warning(f"{method} rate limited for {client}, retry after {retry_after}s")
+            context.set_trailing_metadata((('retry-after', retry_after),))
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, json.dumps({
+                "code": ErrorCodes.RATE_LIMITED, "message": f"Rate limit exceeded, retry after {retry_after}s"
+            }))
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler_call_details.method.startswith(UNLIMITED_PREFIX):
+            return handler
+        method = _method_name(handler_call_details)
+
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def unary_unary(request, context):
+                self._admit(method, context)
+                return behavior(request, context)
+
+            return handler._replace(unary_unary=unary_unary)
+
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            def unary_stream(request, context):
+                self._admit(method, context)
+                yield from behavior(request, context)
+
+            return handler._replace(unary_stream=unary_stream)
+
+        return handler
+
+
+class TracingInterceptor(grpc.ServerInterceptor):
+    """Opens the root span of each sampled RPC
+
+    The trace continues the caller's W3C ``traceparent`` metadata when there
+    is one. Response serialization runs after the handler returns, so it is
+    recorded as a 'grpc.serialize' child of the root span by wrapping the
+    handler's serializer.
+    """
+
+    def __init__(self):
+        # Root span of the unary call whose response this thread serializes next
+        self._serializing = threading.local()
+
+    def _start(self, service: str, method: str, context):
+        traceparent = dict(context.invocation_metadata() or ()).get('traceparent')
+        return start_trace(f"{service}/{method}", traceparent, **{
+            'rpc.system': 'grpc', 'rpc.service': service, 'rpc.method': method,
+        })
+
+    @staticmethod
+    def _finish(root, context, error=None) -> None:
+        code = context.code() if hasattr(context, 'code') else None
+        if code is not None:
+            root.set_attribute('rpc.grpc.status_code', code.name if hasattr(code, 'name') else str(code))
+        if error is not None:
+            root.set_error(f"{type(error).__name__}: {error}")
+        elif code not in (None, grpc.StatusCode.OK, 0):
+            root.set_error(str(context.details() if hasattr(context, 'details') else code))
+        root.end()
+
+    def _traced_serializer(self, serializer):
+        if serializer is None:
+            return None
+
+        def serialize(response):
+            root = getattr(self._serializing, 'span', None) or current_span()
+            self._serializing.span = None
+            if root is None:
+                return serializer(response)
+            child = root.child('grpc.serialize', KIND_INTERNAL)
+            try:
+                data = serializer(response)
+                child.set_attribute('rpc.response_bytes', len(data))
+                return data
+            finally:
+                child.end()
+
+        return serialize
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        service, _, method = handler_call_details.method.lstrip('/').rpartition('/')
+        serializer = self._traced_serializer(handler.response_serializer)
+
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def unary_unary(request, context):
+                self._serializing.span = None
+                root = self._start(service, method, context)
+                if root is None:
+                    return behavior(request, context)
+                error = None
+                try:
+                    with activate(root):
+                        return behavior(request, context)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self._finish(root, context, error)
+                    self._serializing.span = root
+
+            return handler._replace(unary_unary=unary_unary, response_serializer=serializer)
+
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            def unary_stream(request, context):
+                root = self._start(service, method, context)
+                if root is None:
+                    yield from behavior(request, context)
+                    return
+                error = None
+                try:
+                    with activate(root):
+                        yield from behavior(request, context)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self._finish(root, context, error)
+
+            return handler._replace(unary_stream=unary_stream, response_serializer=serializer)
+
+        return handler
+
+
+class ProfilingInterceptor(grpc.ServerInterceptor):
+    """Tells the sampling profiler which RPC method each worker thread is handling"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = _method_name(handler_call_details)
+
+        if handler.unary_unary:
+            behavior = handler.unary_unary
+
+            def unary_unary(request, context):
+                with rpc_method(method):
+                    return behavior(request, context)
+
+            return handler._replace(unary_unary=unary_unary)
+
+        if handler.unary_stream:
+            behavior = handler.unary_stream
+
+            def unary_stream(request, context):
+                with rpc_method(method):
+                    yield from behavior(request, context)
+
+            return handler._replace(unary_stream=unary_stream)
+
+        return handler
+
+
+class QueryBudgetInterceptor(grpc.ServerInterceptor):
+    """Profiles the SQL statements of each unary RPC against its query budget
+
+    Statement counts and SQL time go to the per-method metrics; RPCs over
+    their QUERY_BUDGETS entry are logged with their most repeated
+    statements, which is how N+1 patterns show up. Streams are long-lived
+    and not budgeted.
+    """
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler.unary_unary:
+            return handler
+        method = _method_name(handler_call_details)
+        behavior = handler.unary_unary
+
+        def unary_unary(request, context):
+            with profile_queries(method) as stats:
+                try:
+                    return behavior(request, context)
+                finally:
+                    check_budget(stats)
+
+        return handler._replace(unary_unary=unary_unary)
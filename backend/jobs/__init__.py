@@ -0,0 +1,35 @@
+import importlib
+
+# Jobs are imported on first use: the server only needs LedgerRollupJob, and
+# the fines and related-books jobs pull in numpy
+_JOB_MODULES = {
+    'LoanBackfillJob': 'loan_backfill',
+    'FinesJob': 'fines',
+    'FineSchedule': 'fines',
+    'CatalogStatsRepairJob': 'catalog_stats_repair',
+    'LedgerRollupJob': 'ledger_rollup',
+    'BorrowCountBackfillJob': 'borrow_count_backfill',
+    'RelatedBooksJob': 'related_books',
+}
+
+__all__ = [
+    'LoanBackfillJob',
+    'FinesJob',
+    'FineSchedule',
+    'CatalogStatsRepairJob',
+    'LedgerRollupJob',
+    'BorrowCountBackfillJob',
+    'RelatedBooksJob'
+]
+
+
+def __getattr__(name):
+    if name not in _JOB_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_JOB_MODULES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
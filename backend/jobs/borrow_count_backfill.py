@@ -0,0 +1,67 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
+from config import Config
+from logger import logger
+from repositories import BookRepository, LoanRepository
+
+
+class BorrowCountBackfillJob:
+    """Sets book.borrow_count from the BORROW entries in the ledger
+
+    Borrows keep the counter up to date once it exists; this job computes
+    the initial values for books borrowed before that. The book ID space is
+    split into ranges of ``batch_size`` books, each counted and written in
+    its own transaction by one of ``workers`` threads. A count is only ever
+    raised to the ledger's, never lowered (the ledger loses history once
+    retention detaches partitions), so a failed or interrupted run can
+    simply be started again.
+    """
+
+    def __init__(self, workers: int = Config.BORROW_COUNT_BACKFILL_WORKERS,
+                 batch_size: int = Config.BORROW_COUNT_BACKFILL_BATCH_SIZE):
+        self._workers = max(workers, 1)
+        self._batch_size = max(batch_size, 1)
+        self._book_repository = BookRepository()
+        self._loan_repository = LoanRepository()
+
+    def run(self, start_id: Optional[int] = None) -> Dict[str, int]:
+        """Backfill every book range; returns batch, failure and updated-book counts"""
+        low, high = self._loan_repository.get_book_id_range()
+        if start_id is not None:
+            low = max(low, start_id)
+        ranges = [(first, min(first + self._batch_size, high + 1))
+                  for first in range(low, high + 1, self._batch_size)] if high else []
+
+        totals = {'batches': len(ranges), 'failed': 0, 'books': 0}
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='borrow-count-backfill') as executor:
+            futures = {executor.submit(self._book_repository.backfill_borrow_counts, first, end): (first, end)
+                       for first, end in ranges}
+            for done, future in enumerate(as_completed(futures), 1):
+                first, end = futures[future]
+                try:
+                    totals['books'] += future.result()
+                except Exception as e:
+                    totals['failed'] += 1
+                    logger.error(f"{Config.ERROR_KEYWORD} Borrow count backfill failed for books [{first}, {end}): {str(e)}")
+                if done % 100 == 0:
+                    logger.info(f"Borrow count backfill: {done}/{len(ranges)} batches, {totals['books']} books")
+
+        logger.info(f"Borrow count backfill finished: {totals}")
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill book borrow counts from the ledger')
+    parser.add_argument('--workers', type=int, default=Config.BORROW_COUNT_BACKFILL_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=Config.BORROW_COUNT_BACKFILL_BATCH_SIZE,
+                        help='Books per transaction')
+    parser.add_argument('--start-id', type=int, default=None, help='Resume from this book ID')
+    args = parser.parse_args()
+    totals = BorrowCountBackfillJob(args.workers, args.batch_size).run(args.start_id)
+    print(f"Updated {totals['books']} books in {totals['batches']} batches ({totals['failed']} failed)")
+
+
+if __name__ == '__main__':
+    main()
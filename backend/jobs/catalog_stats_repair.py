@@ -0,0 +1,40 @@
+import argparse
+from typing import Dict, Tuple
+
+from logger import logger
+from repositories import CatalogStatsRepository
+
+
+class CatalogStatsRepairJob:
+    """Recomputes the catalog statistics from scratch and reports drift
+
+    The counters are maintained transactionally, so drift means something
+    bypassed the repositories (manual SQL, restored backups, bulk imports).
+    Every drifted statistic is logged with its stored and actual value.
+    """
+
+    def __init__(self):
+        self._stats_repository = CatalogStatsRepository()
+
+    def run(self, apply: bool = True) -> Dict[str, Tuple[int, int]]:
+        """Recompute (and with ``apply``, correct) the statistics; returns {statistic: (stored, actual)} for drift"""
+        drift = self._stats_repository.recompute(apply=apply)
+        for name, (stored, actual) in sorted(drift.items()):
+            logger.warning(f"Catalog stats drift on {name}: stored {stored}, actual {actual}")
+        logger.info(f"Catalog stats repair finished: {len(drift)} statistics drifted"
+                    f"{', corrected' if apply and drift else ''}")
+        return drift
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute catalog statistics and report drift')
+    parser.add_argument('--dry-run', action='store_true', help='Report drift without correcting it')
+    args = parser.parse_args()
+    drift = CatalogStatsRepairJob().run(apply=not args.dry_run)
+    for name, (stored, actual) in sorted(drift.items()):
+        print(f"{name}: stored {stored}, actual {actual}")
+    print(f"{len(drift)} statistics drifted")
+
+
+if __name__ == '__main__':
+    main()
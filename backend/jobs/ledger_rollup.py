@@ -0,0 +1,73 @@
+import argparse
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from config import Config
+from logger import logger
+from repositories import LedgerRollupRepository
+
+
+class LedgerRollupJob:
+    """Folds new ledger rows into the daily circulation rollups
+
+    Each batch of ``batch_size`` ledger ids is aggregated and committed
+    together with the watermark, so the job can be stopped or crash at any
+    point and the next run resumes where the last committed batch ended.
+    Ledger rows younger than ``safety_seconds`` are left for a later run.
+    Concurrent runs (several servers, or the CLI next to a server) skip
+    instead of waiting while another holds the watermark.
+    """
+
+    def __init__(self, batch_size: int = Config.ROLLUP_BATCH_SIZE,
+                 safety_seconds: int = Config.ROLLUP_SAFETY_SECONDS):
+        self._batch_size = max(batch_size, 1)
+        self._safety_seconds = max(safety_seconds, 0)
+        self._rollup_repository = LedgerRollupRepository()
+
+    def run(self, max_batches: Optional[int] = None) -> Dict[str, int]:
+        """Fold batches until caught up (or ``max_batches``); returns batch count and watermark"""
+        safe_before = datetime.utcnow() - timedelta(seconds=self._safety_seconds)
+        totals = {'batches': 0, 'watermark': 0}
+        while max_batches is None or totals['batches'] < max_batches:
+            folded = self._rollup_repository.fold_next_batch(self._batch_size, safe_before)
+            if folded is None:
+                logger.info("Ledger rollup skipped: another run holds the watermark")
+                break
+            low, high = folded
+            totals['watermark'] = high
+            if high == low:
+                break
+            totals['batches'] += 1
+        logger.info(f"Ledger rollup finished: {totals}")
+        return totals
+
+    def start(self, interval_seconds: float) -> threading.Event:
+        """Run periodically on a daemon thread; set the returned event to stop"""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval_seconds):
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.error(f"{Config.ERROR_KEYWORD} Ledger rollup failed: {str(e)}")
+
+        threading.Thread(target=run, name='ledger-rollup', daemon=True).start()
+        return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fold new ledger rows into the daily circulation rollups')
+    parser.add_argument('--batch-size', type=int, default=Config.ROLLUP_BATCH_SIZE,
+                        help='Ledger ids per transaction')
+    parser.add_argument('--safety-seconds', type=int, default=Config.ROLLUP_SAFETY_SECONDS,
+                        help='Leave ledger rows younger than this for a later run')
+    parser.add_argument('--max-batches', type=int, default=None)
+    args = parser.parse_args()
+    totals = LedgerRollupJob(args.batch_size, args.safety_seconds).run(args.max_batches)
+    print(f"Folded {totals['batches']} batches, watermark at ledger id {totals['watermark']}")
+
+
+if __name__ == '__main__':
+    main()
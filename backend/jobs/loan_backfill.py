@@ -0,0 +1,63 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
+from config import Config
+from logger import logger
+from repositories import LoanRepository
+
+
+class LoanBackfillJob:
+    """Builds the loan table from existing ledger history
+
+    The book ID space is split into ranges of ``batch_size`` books and each
+    range is backfilled in its own transaction by one of ``workers`` threads.
+    Batches are independent and idempotent, so a failed or interrupted run can
+    simply be started again (optionally from ``start_id``).
+    """
+
+    def __init__(self, workers: int = Config.LOAN_BACKFILL_WORKERS,
+                 batch_size: int = Config.LOAN_BACKFILL_BATCH_SIZE):
+        self._workers = max(workers, 1)
+        self._batch_size = max(batch_size, 1)
+        self._loan_repository = LoanRepository()
+
+    def run(self, start_id: Optional[int] = None) -> Dict[str, int]:
+        """Backfill every book range; returns batch, failure and inserted-loan counts"""
+        low, high = self._loan_repository.get_book_id_range()
+        if start_id is not None:
+            low = max(low, start_id)
+        ranges = [(first, min(first + self._batch_size, high + 1))
+                  for first in range(low, high + 1, self._batch_size)] if high else []
+
+        totals = {'batches': len(ranges), 'failed': 0, 'loans': 0}
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='loan-backfill') as executor:
+            futures = {executor.submit(self._loan_repository.backfill_book_range, first, end): (first, end)
+                       for first, end in ranges}
+            for done, future in enumerate(as_completed(futures), 1):
+                first, end = futures[future]
+                try:
+                    totals['loans'] += future.result()
+                except Exception as e:
+                    totals['failed'] += 1
+                    logger.error(f"{Config.ERROR_KEYWORD} Loan backfill failed for books [{first}, {end}): {str(e)}")
+                if done % 100 == 0:
+                    logger.info(f"Loan backfill: {done}/{len(ranges)} batches, {totals['loans']} loans")
+
+        logger.info(f"Loan backfill finished: {totals}")
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the loan table from the ledger')
+    parser.add_argument('--workers', type=int, default=Config.LOAN_BACKFILL_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=Config.LOAN_BACKFILL_BATCH_SIZE,
+                        help='Books per transaction')
+    parser.add_argument('--start-id', type=int, default=None, help='Resume from this book ID')
+    args = parser.parse_args()
+    totals = LoanBackfillJob(args.workers, args.batch_size).run(args.start_id)
+    print(f"Backfilled {totals['loans']} loans in {totals['batches']} batches ({totals['failed']} failed)")
+
+
+if __name__ == '__main__':
+    main()
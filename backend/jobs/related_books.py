@@ -0,0 +1,116 @@
+import argparse
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from logger import logger
+from repositories import RelatedBooksRepository
+from .fines import to_copy_binary
+
+
+def _keys(pairs: np.ndarray) -> np.ndarray:
+    """Pack (a, b) int32 pairs into one sortable int64 per row"""
+    return (pairs[:, 0].astype(np.int64) << 32) | pairs[:, 1].astype(np.int64)
+
+
+def _pairs_by_member(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """(left book, right book) for every two (member, book) rows with the same member
+
+    A vectorized sort-merge join: each left row's matches are a contiguous
+    run of the member-sorted right rows, expanded with repeat/arange.
+    """
+    right = right[np.argsort(right[:, 0], kind='stable')]
+    start = np.searchsorted(right[:, 0], left[:, 0], side='left')
+    counts = np.searchsorted(right[:, 0], left[:, 0], side='right') - start
+    left_index = np.repeat(np.arange(len(left)), counts)
+    right_index = np.arange(counts.sum()) + np.repeat(start - np.cumsum(counts) + counts, counts)
+    return np.column_stack((left[left_index, 1], right[right_index, 1]))
+
+
+def cooccurrence_deltas(new: np.ndarray, old: np.ndarray, max_member_books: int = 0) -> np.ndarray:
+    """Co-occurrence increments from new (member, book) borrows
+
+    ``old`` holds the same members' earlier borrows. A book counts once per
+    member, so re-borrows add nothing; a member's first borrow of a book adds
+    one to its pair with each of the member's other books, in both
+    directions. Members with more than ``max_member_books`` distinct books
+    (0 for no limit) are skipped. Returns (book id, related book id, members)
+    rows with unique pairs.
+    """
+    new = np.unique(new.reshape(-1, 2), axis=0)
+    old = np.unique(old.reshape(-1, 2), axis=0)
+    new = new[~np.isin(_keys(new), _keys(old))]
+    if max_member_books:
+        members, books = np.unique(np.concatenate((new[:, 0], old[:, 0])), return_counts=True)
+        heavy = members[books > max_member_books]
+        new = new[~np.isin(new[:, 0], heavy)]
+        old = old[~np.isin(old[:, 0], heavy)]
+
+    with_old = _pairs_by_member(new, old)
+    within_new = _pairs_by_member(new, new)
+    pairs = np.concatenate((with_old, with_old[:, ::-1], within_new[within_new[:, 0] != within_new[:, 1]]))
+    keys, counts = np.unique(_keys(pairs), return_counts=True)
+    return np.column_stack((keys >> 32, keys & 0xFFFFFFFF, counts))
+
+
+class RelatedBooksJob:
+    """Builds the "members who borrowed this also borrowed" recommendations
+
+    Each batch of ledger ids is turned into co-occurrence increments with
+    NumPy, bulk-loaded with COPY and added to the stored sparse matrix, and
+    the top ``top_k`` neighbours of every book whose row changed are
+    re-ranked, all in one transaction with the watermark. A run only reads
+    ledger rows added since the last one; a crashed run is simply redone.
+    """
+
+    def __init__(self, batch_size: int = Config.RELATED_BOOKS_BATCH_SIZE,
+                 safety_seconds: int = Config.RELATED_BOOKS_SAFETY_SECONDS,
+                 top_k: int = Config.RELATED_BOOKS_TOP_K,
+                 max_member_books: int = Config.RELATED_BOOKS_MAX_MEMBER_BOOKS):
+        self._batch_size = max(batch_size, 1)
+        self._safety_seconds = max(safety_seconds, 0)
+        self._top_k = max(top_k, 1)
+        self._max_member_books = max(max_member_books, 0)
+        self._related_repository = RelatedBooksRepository()
+
+    def run(self, max_batches: Optional[int] = None) -> Dict[str, int]:
+        """Fold batches until caught up (or ``max_batches``); returns batch, pair and watermark totals"""
+        safe_before = datetime.utcnow() - timedelta(seconds=self._safety_seconds)
+        totals = {'batches': 0, 'pairs': 0, 'watermark': 0}
+
+        def count_pairs(new: List[Tuple[int, int]], old: List[Tuple[int, int]]) -> Optional[BinaryIO]:
+            deltas = cooccurrence_deltas(np.array(new, dtype=np.int64), np.array(old, dtype=np.int64),
+                                         self._max_member_books)
+            totals['pairs'] += len(deltas)
+            return to_copy_binary(deltas) if len(deltas) else None
+
+        while max_batches is None or totals['batches'] < max_batches:
+            folded = self._related_repository.fold_next_batch(self._batch_size, safe_before, self._top_k, count_pairs)
+            if folded is None:
+                logger.info("Related books job skipped: another run holds the watermark")
+                break
+            low, high = folded
+            totals['watermark'] = high
+            if high == low:
+                break
+            totals['batches'] += 1
+        logger.info(f"Related books job finished: {totals}")
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fold new ledger borrows into the "also borrowed" recommendations')
+    parser.add_argument('--batch-size', type=int, default=Config.RELATED_BOOKS_BATCH_SIZE,
+                        help='Ledger ids per transaction')
+    parser.add_argument('--top-k', type=int, default=Config.RELATED_BOOKS_TOP_K)
+    parser.add_argument('--max-batches', type=int, default=None)
+    args = parser.parse_args()
+    totals = RelatedBooksJob(batch_size=args.batch_size, top_k=args.top_k).run(args.max_batches)
+    print(f"Folded {totals['batches']} batches ({totals['pairs']} pair increments), "
+          f"watermark at ledger id {totals['watermark']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -25,5 +25,19 @@ def setup_logging():
     return logger
 
 
+def setup_slow_query_logging():
+    """Slow-query log: one JSON object per line in its own file, kept out of the main log"""
+    slow_query_logger = logging.getLogger('library_backend.slow_query')
+    slow_query_logger.setLevel(logging.INFO)
+    slow_query_logger.propagate = False
+
+    file_handler = logging.FileHandler(Config.SLOW_QUERY_LOG_FILE)
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_query_logger.addHandler(file_handler)
+
+    return slow_query_logger
+
+
 # Global logger instance
 logger = setup_logging()
+slow_query_logger = setup_slow_query_logging()
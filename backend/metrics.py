@@ -0,0 +1,93 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+from logger import logger
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self) -> Dict[Tuple[Tuple[str, str], ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Counter] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Get or create a counter by name"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, description)
+            return self._metrics[name]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return current values as {metric: {label string: value}}"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {_format_labels(key): value for key, value in metric.samples().items()}
+                for metric in metrics}
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} counter")
+            for key, value in metric.samples().items():
+                lines.append(f"{metric.name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...]) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in key) + '}'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_exporter(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics in Prometheus format from a daemon thread"""
+    server = ThreadingHTTPServer(('', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+    logger.info(f"Metrics exporter listening on port {port}")
+    return server
+
+
+# Global registry instance
+registry = MetricsRegistry()
@@ -0,0 +1,27 @@
+-- Replace the single-column indexes with ones that match the repository queries.
+--
+-- idx_book_is_borrowed and idx_ledger_action_type are low-selectivity and are
+-- never chosen by the planner; the other single-column indexes are superseded
+-- by the composite ones below. book.current_member_id keeps an index of its own
+-- for the foreign key: member deletes and updates look up referencing books
+-- without the is_borrowed predicate, so the open-loan index cannot serve them.
+-- It is partial because books on the shelf have no member.
+--
+-- CONCURRENTLY cannot run inside a transaction block, so run this file with
+-- autocommit (e.g. `psql -f migrations/001_tuned_indexes.sql`).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_book_open_loans_member ON book(current_member_id, id) WHERE is_borrowed;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_book_open_loans ON book(id) WHERE is_borrowed;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_book_current_member_fk ON book(current_member_id) WHERE current_member_id IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_book_updated_at_id ON book(updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ledger_member_log_date ON ledger(member_id, log_date DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ledger_book_log_date ON ledger(book_id, log_date DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_book_is_borrowed;
+DROP INDEX CONCURRENTLY IF EXISTS idx_book_current_member;
+DROP INDEX CONCURRENTLY IF EXISTS idx_ledger_book_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_ledger_member_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_ledger_action_type;
+
+ANALYZE book;
+ANALYZE ledger;
@@ -0,0 +1,4 @@
+-- Version column used as a compare-and-swap guard by borrow/return.
+-- Adding a column with a constant default does not rewrite the table.
+
+ALTER TABLE book ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,17 @@
+-- Covering indexes for ListLedger keyset pagination on (log_date DESC, id DESC).
+-- Supersede the (member_id, log_date) / (book_id, log_date) indexes from 001.
+--
+-- CONCURRENTLY cannot run inside a transaction block; run with autocommit.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ledger_member_history
+    ON ledger(member_id, log_date DESC, id DESC) INCLUDE (book_id, action_type, due_date_snapshot);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ledger_book_history
+    ON ledger(book_id, log_date DESC, id DESC) INCLUDE (member_id, action_type, due_date_snapshot);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ledger_log_date
+    ON ledger(log_date DESC, id DESC);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_ledger_member_log_date;
+DROP INDEX CONCURRENTLY IF EXISTS idx_ledger_book_log_date;
+
+-- Index-only scans need an up-to-date visibility map
+VACUUM (ANALYZE) ledger;
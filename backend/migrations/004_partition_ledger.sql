@@ -0,0 +1,60 @@
+-- Convert ledger to a table range-partitioned by month on log_date.
+--
+-- Copies existing rows into monthly partitions covering the oldest entry
+-- through three months ahead, keeping ids and the id sequence. Takes an
+-- exclusive lock on ledger for the duration of the copy, so run it in a
+-- maintenance window. The old table is kept as ledger_unpartitioned; drop it
+-- once the new one is verified.
+
+BEGIN;
+
+LOCK TABLE ledger IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE ledger RENAME TO ledger_unpartitioned;
+ALTER INDEX ledger_pkey RENAME TO ledger_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_ledger_member_history RENAME TO idx_ledger_unpartitioned_member_history;
+ALTER INDEX IF EXISTS idx_ledger_book_history RENAME TO idx_ledger_unpartitioned_book_history;
+ALTER INDEX IF EXISTS idx_ledger_log_date RENAME TO idx_ledger_unpartitioned_log_date;
+
+CREATE TABLE ledger (
+    id INTEGER NOT NULL DEFAULT nextval('ledger_id_seq'),
+    book_id INTEGER NOT NULL REFERENCES book(id),
+    member_id INTEGER NOT NULL REFERENCES member(id),
+    action_type TEXT NOT NULL,
+    log_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    due_date_snapshot TIMESTAMP,
+    PRIMARY KEY (id, log_date)
+) PARTITION BY RANGE (log_date);
+
+ALTER SEQUENCE ledger_id_seq OWNED BY ledger.id;
+ALTER TABLE ledger_unpartitioned ALTER COLUMN id DROP DEFAULT;
+
+DO $$
+DECLARE
+    month DATE;
+    last_month DATE := date_trunc('month', CURRENT_DATE) + INTERVAL '3 months';
+BEGIN
+    SELECT date_trunc('month', COALESCE(min(log_date), CURRENT_DATE)) INTO month FROM ledger_unpartitioned;
+    WHILE month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ledger FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, '"ledger_y"YYYY"m"MM'), month, month + INTERVAL '1 month'
+        );
+        month := month + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+-- Rows without a log_date (never written by the backend) are stamped with the
+-- migration time so they land in a partition.
+INSERT INTO ledger (id, book_id, member_id, action_type, log_date, due_date_snapshot)
+SELECT id, book_id, member_id, action_type, COALESCE(log_date, CURRENT_TIMESTAMP), due_date_snapshot
+FROM ledger_unpartitioned;
+
+-- Created on the parent, so every existing and future partition gets them
+CREATE INDEX idx_ledger_member_history ON ledger(member_id, log_date DESC, id DESC) INCLUDE (book_id, action_type, due_date_snapshot);
+CREATE INDEX idx_ledger_book_history ON ledger(book_id, log_date DESC, id DESC) INCLUDE (member_id, action_type, due_date_snapshot);
+CREATE INDEX idx_ledger_log_date ON ledger(log_date DESC, id DESC);
+
+COMMIT;
+
+VACUUM (ANALYZE) ledger;
@@ -0,0 +1,18 @@
+-- Loan intervals derived from BORROW/RETURN ledger pairs. The borrow/return
+-- path writes loans from this migration on; history is filled afterwards by
+--   python -m jobs.loan_backfill
+-- which is idempotent and can run while the service is live.
+
+CREATE TABLE IF NOT EXISTS loan (
+    id SERIAL PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES book(id),
+    member_id INTEGER NOT NULL REFERENCES member(id),
+    borrowed_at TIMESTAMP NOT NULL,
+    due_at TIMESTAMP,
+    returned_at TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_loan_book_borrowed_at ON loan(book_id, borrowed_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_loan_open_book ON loan(book_id) WHERE returned_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_loan_member_history ON loan(member_id, borrowed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_loan_borrowed_at ON loan(borrowed_at, id);
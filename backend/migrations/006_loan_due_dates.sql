@@ -0,0 +1,12 @@
+-- Overdue report index: open loans only, ordered by due date.
+--
+-- CONCURRENTLY cannot run inside a transaction block; run with autocommit.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loan_open_due
+    ON loan(due_at, id) WHERE returned_at IS NULL;
+
+-- Borrows before the due-date policy were stamped due at the moment they
+-- started. Give open ones the default 14-day loan period (LOAN_PERIOD_DAYS)
+-- so they are not all reported overdue.
+UPDATE loan SET due_at = borrowed_at + INTERVAL '14 days'
+WHERE returned_at IS NULL AND (due_at IS NULL OR due_at <= borrowed_at);
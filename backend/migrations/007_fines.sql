@@ -0,0 +1,15 @@
+-- Late fees computed in bulk by the nightly fines job (python -m jobs.fines),
+-- plus the index it uses to find recently returned loans.
+--
+-- CONCURRENTLY cannot run inside a transaction block; run with autocommit.
+
+CREATE TABLE IF NOT EXISTS fine (
+    loan_id INTEGER PRIMARY KEY REFERENCES loan(id),
+    member_id INTEGER NOT NULL,
+    days_overdue INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    computed_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_fine_member ON fine(member_id, loan_id) INCLUDE (amount_cents);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_loan_returned_at ON loan(returned_at) WHERE returned_at IS NOT NULL;
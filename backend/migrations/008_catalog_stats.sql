@@ -0,0 +1,32 @@
+-- Catalog statistics maintained in the same transaction as book
+-- create/update/borrow/return, seeded here from the current tables.
+-- Afterwards, python -m jobs.catalog_stats_repair recomputes them and
+-- reports any drift.
+
+CREATE TABLE IF NOT EXISTS catalog_stats (
+    name TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, shard)
+);
+
+CREATE TABLE IF NOT EXISTS author_stats (
+    author TEXT PRIMARY KEY,
+    book_count BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_author_stats_book_count ON author_stats(book_count DESC, author);
+
+BEGIN;
+LOCK TABLE book IN SHARE MODE;
+DELETE FROM catalog_stats;
+DELETE FROM author_stats;
+INSERT INTO catalog_stats (name, shard, value)
+SELECT 'total_books', 0, count(*) FROM book
+UNION ALL
+SELECT 'borrowed_books', 0, count(*) FILTER (WHERE is_borrowed) FROM book
+UNION ALL
+SELECT 'active_borrowers', 0, count(DISTINCT current_member_id) FILTER (WHERE is_borrowed) FROM book;
+INSERT INTO author_stats (author, book_count)
+SELECT author, count(*) FROM book GROUP BY author;
+COMMIT;
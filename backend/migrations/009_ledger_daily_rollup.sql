@@ -0,0 +1,20 @@
+-- Daily circulation rollups (borrows/returns per day, per author and per
+-- member sign-up month). Starts empty with no watermark: the first run of
+-- python -m jobs.ledger_rollup (or the in-process refresher) folds the
+-- existing ledger in batches, later runs only the rows added since.
+
+CREATE TABLE IF NOT EXISTS ledger_daily_rollup (
+    dimension TEXT NOT NULL,
+    dimension_key TEXT NOT NULL,
+    day DATE NOT NULL,
+    borrows BIGINT NOT NULL DEFAULT 0,
+    returns BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, dimension_key, day)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_watermark (
+    name TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_rollup_dimension_day ON ledger_daily_rollup(dimension, day);
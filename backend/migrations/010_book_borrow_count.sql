@@ -0,0 +1,9 @@
+-- Borrow counter for the 'popular' ListBooks order. Borrows increment it
+-- from this migration on; existing history is counted afterwards by
+--   python -m jobs.borrow_count_backfill
+-- which is idempotent and can run while the service is live.
+-- Adding a column with a constant default does not rewrite the table.
+
+ALTER TABLE book ADD COLUMN IF NOT EXISTS borrow_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_book_borrow_count ON book(borrow_count DESC, id);
@@ -0,0 +1,17 @@
+-- "Also borrowed" recommendations. Both tables start empty; the first run
+-- of python -m jobs.related_books folds the existing ledger in batches,
+-- later runs only the borrows added since.
+
+CREATE TABLE IF NOT EXISTS book_cooccurrence (
+    book_id INTEGER NOT NULL,
+    related_book_id INTEGER NOT NULL,
+    members INTEGER NOT NULL,
+    PRIMARY KEY (book_id, related_book_id)
+);
+
+CREATE TABLE IF NOT EXISTS related_books (
+    book_id INTEGER PRIMARY KEY,
+    related_ids INTEGER[] NOT NULL,
+    members INTEGER[] NOT NULL,
+    computed_at TIMESTAMP NOT NULL
+);
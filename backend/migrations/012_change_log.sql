@@ -0,0 +1,18 @@
+-- Change log (outbox) behind ListChanges. Only changes made after this
+-- migration are recorded; clients do one full list, then sync from the
+-- next_seq of their first ListChanges call. Requires PostgreSQL 13+
+-- (pg_current_xact_id / pg_snapshot_xmin).
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    data JSONB NOT NULL,
+    changed_at TIMESTAMP NOT NULL,
+    txid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint
+);
+
+-- Serving order: changes are listed (and pruned) by (txid, seq), see
+-- ChangeLogRepository
+CREATE INDEX IF NOT EXISTS idx_change_log_txid_seq ON change_log(txid, seq);
@@ -0,0 +1,14 @@
+-- Idempotency keys for BorrowBook/ReturnBook. A separate table because the
+-- ledger is partitioned by log_date, so a unique key on it would have to
+-- include log_date. Expired keys are deleted in batches by the server.
+
+CREATE TABLE IF NOT EXISTS idempotency_key (
+    key TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    ledger_entry JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_key_created_at ON idempotency_key(created_at);
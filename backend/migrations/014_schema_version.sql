@@ -0,0 +1,11 @@
+-- Applied migrations, one row each. The server checks max(version) against
+-- db_helper.SCHEMA_VERSION on startup with one query instead of running
+-- create_all. Every later migration must end with its own INSERT.
+
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 001-013 predate this table; recording 14 vouches for them
+INSERT INTO schema_version (version) VALUES (14) ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,116 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from logger import logger
+from metrics import registry
+
+# Settings re-read by ``RateLimiter.reload``
+RELOADABLE_SETTINGS = ('RATE_LIMIT_TOKENS_PER_SECOND', 'RATE_LIMIT_BURST', 'RATE_LIMIT_METHOD_COSTS',
+                       'RATE_LIMIT_CLIENT_HEADER', 'RATE_LIMIT_MAX_CLIENTS')
+
+rate_limited_total = registry.counter(
+    'library_rate_limited_total', 'Calls rejected with RESOURCE_EXHAUSTED because the client ran out of tokens')
+
+
+def parse_method_costs(spec: str) -> Dict[str, float]:
+    """Parse '<method>:<cost>' pairs, e.g. 'SearchBooks:5,ListBooks:2'"""
+    costs = {}
+    for pair in filter(None, (part.strip() for part in spec.split(','))):
+        method, _, cost = pair.partition(':')
+        try:
+            costs[method.strip()] = float(cost)
+        except ValueError:
+            raise ValueError(f"Invalid rate limit method cost: {pair!r}")
+    return costs
+
+
+class RateLimiter:
+    """Per-client token buckets with per-method costs
+
+    A client's bucket holds up to ``burst`` tokens and refills at ``rate``
+    tokens per second; a call is admitted if the bucket holds its method's
+    cost. Buckets are created full on a client's first call and the least
+    recently seen clients are forgotten beyond ``max_clients``. Settings are
+    read from Config and can be swapped at runtime with ``reload``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._apply_config(parse_method_costs(Config.RATE_LIMIT_METHOD_COSTS))
+
+    def _apply_config(self, costs: Dict[str, float]) -> None:
+        with self._lock:
+            self.rate = max(Config.RATE_LIMIT_TOKENS_PER_SECOND, 0.0)
+            self.burst = max(Config.RATE_LIMIT_BURST, 1.0)
+            self.costs = costs
+            self.client_header = Config.RATE_LIMIT_CLIENT_HEADER.lower()
+            self.max_clients = max(Config.RATE_LIMIT_MAX_CLIENTS, 1)
+
+    def reload(self) -> bool:
+        """Re-read the rate limit settings; existing buckets keep their tokens (capped at the new burst)
+
+        Every setting is parsed before any is applied, so a bad value is
+        logged and the current limits stay in force. Returns whether the new
+        settings were applied.
+        """
+        try:
+            values = Config.read(*RELOADABLE_SETTINGS)
+            costs = parse_method_costs(values.get('RATE_LIMIT_METHOD_COSTS', Config.RATE_LIMIT_METHOD_COSTS))
+        except Exception as e:
+            logger.error(f"Rate limits not reloaded, keeping the current ones: {str(e)}")
+            return False
+        Config.apply(values)
+        self._apply_config(costs)
+        logger.info(f"Rate limits reloaded: {self.rate}/s, burst {self.burst}, costs {self.costs}")
+        return True
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def client_key(self, metadata: Optional[Tuple[Tuple[str, str], ...]], peer: str) -> str:
+        """The caller's client id from metadata, else its peer host (without the ephemeral port)"""
+        for key, value in metadata or ():
+            if key == self.client_header and value:
+                return f"id:{value}"
+        host, _, port = peer.rpartition(':')
+        return f"peer:{host if host and port.isdigit() else peer}"
+
+    def acquire(self, client: str, method: str, now: Optional[float] = None) -> float:
+        """Take the cost of ``method`` from the client's bucket
+
+        Returns 0 when admitted, otherwise the seconds until enough tokens
+        will have refilled (nothing is taken).
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            cost = min(self.costs.get(method, 1.0), self.burst)
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = [self.burst, now]
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / self.rate
+
+    @staticmethod
+    def retry_after(wait_seconds: float) -> str:
+        """Retry-after metadata value: whole seconds, at least 1"""
+        return str(max(math.ceil(wait_seconds), 1))
+
+
+# Process-wide limiter used by the rate limit interceptor
+rate_limiter = RateLimiter()
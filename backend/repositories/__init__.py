@@ -1,11 +1,39 @@
-from .base_repository import BaseRepository
+from .base_repository import BaseRepository, ConcurrencyConflict
 from .book_repository import BookRepository
 from .member_repository import MemberRepository
 from .ledger_repository import LedgerRepository
+from .loan_repository import LoanRepository
+from .fine_repository import FineRepository
+from .ledger_partition_repository import LedgerPartitionRepository
+from .catalog_stats_repository import CatalogStatsRepository
+from .ledger_rollup_repository import LedgerRollupRepository
+from .related_books_repository import RelatedBooksRepository
+from .change_log_repository import ChangeLogRepository, ChangeLogExpired
+from .idempotency_repository import IdempotencyRepository, IdempotencyCache, idempotency_cache
+from .availability_index import AvailabilityIndex, availability_index
+from .book_watch_hub import BookWatchHub, TooManyWatchers, WatchSubscription, book_watch_hub
 
 __all__ = [
     'BaseRepository',
+    'ConcurrencyConflict',
     'BookRepository',
     'MemberRepository',
-    'LedgerRepository'
+    'LedgerRepository',
+    'LoanRepository',
+    'FineRepository',
+    'LedgerPartitionRepository',
+    'CatalogStatsRepository',
+    'LedgerRollupRepository',
+    'RelatedBooksRepository',
+    'ChangeLogRepository',
+    'ChangeLogExpired',
+    'IdempotencyRepository',
+    'IdempotencyCache',
+    'idempotency_cache',
+    'AvailabilityIndex',
+    'availability_index',
+    'BookWatchHub',
+    'TooManyWatchers',
+    'WatchSubscription',
+    'book_watch_hub'
 ]
\ No newline at end of file
@@ -0,0 +1,209 @@
+import threading
+from array import array
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select
+
+from db_helper import SessionLocal, Book
+from logger import logger
+from metrics import registry
+
+WORD_BITS = 64
+
+reconcile_drift_total = registry.counter(
+    'library_availability_index_drift_total', 'Books whose cached availability differed from the database on reconcile')
+lookups_total = registry.counter(
+    'library_availability_lookups_total', 'Availability lookups, by source (index, or database before the index loaded)')
+
+
+class AvailabilityIndex:
+    """In-memory index of which books exist, which are borrowed and by whom
+
+    Two bitsets (``array('Q')`` words indexed by book id) record existence and
+    borrowed state, and an ``array('i')`` maps book id to the current member id
+    (0 when not borrowed). Lookups are O(1) and totals are a popcount over the
+    words, O(n/64), instead of a COUNT(*) scan.
+
+    The index is filled by one streaming query in ``load`` and kept current by
+    BookRepository after each committed create/borrow/return. Writes made by
+    other processes are picked up by ``reconcile``, which rebuilds the index
+    from the database and reports how many books had drifted; until then an
+    entry can be stale, so callers confirm negative answers in the database.
+    Until ``load`` has run, ``loaded`` is False and callers should fall back
+    to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exists = array('Q')
+        self._borrowed = array('Q')
+        self._members = array('i')
+        self._loaded = False
+        # Updates applied while a rebuild is streaming, replayed onto the new arrays
+        self._pending_updates: Optional[List[Tuple[int, bool, int]]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, batch_size: int = 10000) -> int:
+        """Build the index from the database; returns the number of books loaded"""
+        with self._lock:
+            self._pending_updates = []
+        try:
+            exists, borrowed, members, count = self._read_all(batch_size)
+        except Exception:
+            with self._lock:
+                self._pending_updates = None
+            raise
+        with self._lock:
+            previous = (self._exists, self._borrowed, self._members) if self._loaded else None
+            self._exists, self._borrowed, self._members = exists, borrowed, members
+            for book_id, is_borrowed, member_id in self._pending_updates:
+                self._set(book_id, is_borrowed, member_id)
+            self._pending_updates = None
+            self._loaded = True
+        if previous is not None:
+            drift = self._count_drift(previous)
+            if drift:
+                reconcile_drift_total.inc(drift)
+                logger.warning(f"Availability index reconcile corrected {drift} books")
+        return count
+
+    def reconcile(self) -> int:
+        """Rebuild from the database, logging and counting any drift"""
+        return self.load()
+
+    def start_reconciler(self, interval_seconds: float, load_first: bool = False) -> threading.Event:
+        """Reconcile every ``interval_seconds`` on a daemon thread; set the returned event to stop
+
+        With ``load_first`` the thread loads the index before its first wait,
+        so startup does not block on the full scan.
+        """
+        stop = threading.Event()
+
+        def run():
+            if load_first:
+                try:
+                    logger.info(f"Availability index loaded with {self.load()} books")
+                except Exception as e:
+                    logger.error(f"Availability index load failed: {str(e)}")
+            while not stop.wait(interval_seconds):
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"Availability index reconcile failed: {str(e)}")
+
+        threading.Thread(target=run, name='availability-reconciler', daemon=True).start()
+        return stop
+
+    def mark_created(self, book_id: int) -> None:
+        self._update(book_id, False, 0)
+
+    def mark_borrowed(self, book_id: int, member_id: int) -> None:
+        self._update(book_id, True, member_id)
+
+    def mark_returned(self, book_id: int) -> None:
+        self._update(book_id, False, 0)
+
+    def is_available(self, book_id: int) -> bool:
+        with self._lock:
+            return self._bit(self._exists, book_id) and not self._bit(self._borrowed, book_id)
+
+    def is_borrowed_by_member(self, book_id: int, member_id: int) -> bool:
+        with self._lock:
+            return (self._bit(self._borrowed, book_id)
+                    and book_id < len(self._members) and self._members[book_id] == member_id)
+
+    def counts(self) -> Tuple[int, int]:
+        """Return (total books, borrowed books)"""
+        with self._lock:
+            return _popcount(self._exists), _popcount(self._borrowed)
+
+    def _read_all(self, batch_size: int):
+        exists, borrowed, members = array('Q'), array('Q'), array('i')
+        count = 0
+        session = SessionLocal()
+        try:
+            rows = session.execute(
+                select(Book.id, Book.is_borrowed, Book.current_member_id)
+                .execution_options(stream_results=True, yield_per=batch_size)
+            )
+            for book_id, is_borrowed, member_id in rows:
+                _grow(exists, borrowed, members, book_id)
+                word, bit = divmod(book_id, WORD_BITS)
+                exists[word] |= 1 << bit
+                if is_borrowed:
+                    borrowed[word] |= 1 << bit
+                    members[book_id] = member_id or 0
+                count += 1
+        finally:
+            session.close()
+        return exists, borrowed, members, count
+
+    def _update(self, book_id: int, is_borrowed: bool, member_id: int) -> None:
+        with self._lock:
+            if self._pending_updates is not None:
+                self._pending_updates.append((book_id, is_borrowed, member_id))
+            if self._loaded:
+                self._set(book_id, is_borrowed, member_id)
+
+    def _set(self, book_id: int, is_borrowed: bool, member_id: int) -> None:
+        _grow(self._exists, self._borrowed, self._members, book_id)
+        word, bit = divmod(book_id, WORD_BITS)
+        self._exists[word] |= 1 << bit
+        if is_borrowed:
+            self._borrowed[word] |= 1 << bit
+        else:
+            self._borrowed[word] &= ~(1 << bit)
+        self._members[book_id] = member_id
+
+    def _count_drift(self, previous) -> int:
+        """Books whose existence, borrowed state or borrowing member changed in the rebuild"""
+        old_exists, old_borrowed, old_members = previous
+        with self._lock:
+            drift = 0
+            for word in range(max(len(old_borrowed), len(self._borrowed))):
+                old = (old_exists[word] if word < len(old_exists) else 0,
+                       old_borrowed[word] if word < len(old_borrowed) else 0)
+                new = (self._exists[word] if word < len(self._exists) else 0,
+                       self._borrowed[word] if word < len(self._borrowed) else 0)
+                changed = (old[0] ^ new[0]) | (old[1] ^ new[1])
+                # Borrowed before and after: drifted if the member differs
+                still_borrowed = old[1] & new[1] & ~changed
+                while still_borrowed:
+                    low = still_borrowed & -still_borrowed
+                    book_id = word * WORD_BITS + low.bit_length() - 1
+                    if old_members[book_id] != self._members[book_id]:
+                        changed |= low
+                    still_borrowed ^= low
+                drift += _bit_count(changed)
+            return drift
+
+    @staticmethod
+    def _bit(words: array, book_id: int) -> bool:
+        word, bit = divmod(book_id, WORD_BITS)
+        return word < len(words) and bool(words[word] >> bit & 1)
+
+
+def _grow(exists: array, borrowed: array, members: array, book_id: int) -> None:
+    """Grow the arrays (geometrically) so ``book_id`` is addressable"""
+    if book_id < len(members):
+        return
+    size = max(book_id + 1, len(members) * 2, WORD_BITS)
+    members.extend(array('i', [0]) * (size - len(members)))
+    words = (size + WORD_BITS - 1) // WORD_BITS
+    exists.extend(array('Q', [0]) * (words - len(exists)))
+    borrowed.extend(array('Q', [0]) * (words - len(borrowed)))
+
+
+# Set bits in an int; int.bit_count is new in Python 3.10
+_bit_count = getattr(int, 'bit_count', lambda value: bin(value).count('1'))
+
+
+def _popcount(words: array) -> int:
+    return sum(map(_bit_count, words))
+
+
+# Process-wide instance shared by every BookRepository
+availability_index = AvailabilityIndex()
@@ -1,6 +1,27 @@
+import random
+import time
 from abc import ABC, abstractmethod
+from typing import Callable, TypeVar
 from sqlalchemy.orm import Session
 from db_helper import SessionLocal
+from config import Config
+from metrics import registry
+from request_context import check_deadline
+from tracing import trace_session
+import sql_profiler  # noqa: F401 (registers the statement profiling listeners)
+
+T = TypeVar('T')
+
+conflicts_total = registry.counter(
+    'library_repository_conflicts_total', 'Concurrency conflicts detected by repository operations')
+retries_total = registry.counter(
+    'library_repository_retries_total', 'Repository operations retried after a concurrency conflict')
+retries_exhausted_total = registry.counter(
+    'library_repository_retries_exhausted_total', 'Repository operations that gave up after the maximum retries')
+
+
+class ConcurrencyConflict(Exception):
+    """Raised when a row was changed or locked by a concurrent transaction"""
 
 
 class BaseRepository(ABC):
@@ -10,8 +31,15 @@ class BaseRepository(ABC):
         self._session_factory = SessionLocal
 
     def _get_session(self) -> Session:
-        """Get a database session"""
-        return self._session_factory()
+        """Get a database session
+
+        Raises RequestAborted instead when the RPC being served has already
+        expired or been cancelled, so no database work is started for it.
+        """
+        check_deadline()
+        session = self._session_factory()
+        trace_session(session)
+        return session
 
     def _commit_and_refresh(self, session: Session, obj):
         """Commit transaction and refresh object"""
@@ -22,4 +50,24 @@ class BaseRepository(ABC):
     def _rollback_on_error(self, session: Session, error):
         """Rollback transaction on error"""
         session.rollback()
-        raise error
\ No newline at end of file
+        raise error
+
+    def _retry_on_conflict(self, operation: str, attempt: Callable[[], T]) -> T:
+        """Run ``attempt`` until it stops raising ConcurrencyConflict
+
+        Retries up to ``Config.BORROW_MAX_RETRIES`` times with capped exponential
+        backoff and full jitter, so contending transactions spread out instead of
+        retrying in lock-step.
+        """
+        max_retries = Config.BORROW_MAX_RETRIES
+        for retry in range(max_retries + 1):
+            try:
+                return attempt()
+            except ConcurrencyConflict:
+                conflicts_total.inc(operation=operation)
+                if retry == max_retries:
+                    retries_exhausted_total.inc(operation=operation)
+                    raise
+                retries_total.inc(operation=operation)
+                cap_ms = min(Config.BORROW_RETRY_MAX_DELAY_MS, Config.BORROW_RETRY_BASE_DELAY_MS * (2 ** retry))
+                time.sleep(random.uniform(0, cap_ms) / 1000.0)
@@ -1,21 +1,43 @@
-from typing import List, Optional, Tuple, Dict, Any
-from sqlalchemy import or_, desc
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from datetime import datetime
+from typing import List, Optional, Tuple, Dict, Any, Iterable, Callable
+from sqlalchemy import or_, and_, desc, any_, bindparam, text, update, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
 
-from db_helper import Book, Member, DatabaseHelper
-from .base_repository import BaseRepository
+from config import Config
+from db_helper import Book, Member, Ledger, Loan, DatabaseHelper
+from .base_repository import BaseRepository, ConcurrencyConflict
+from .availability_index import availability_index, lookups_total as availability_lookups_total
+from .catalog_stats_repository import CatalogStatsRepository, TOTAL_BOOKS, BORROWED_BOOKS
+from .change_log_repository import ChangeLogRepository
+from .idempotency_repository import IdempotencyRepository
+
+# Postgres error raised by FOR UPDATE NOWAIT when the row is locked
+LOCK_NOT_AVAILABLE = '55P03'
 
 
 class BookRepository(BaseRepository):
     """Repository for Book entity operations"""
 
+    def __init__(self):
+        super().__init__()
+        self._stats = CatalogStatsRepository()
+        self._changes = ChangeLogRepository()
+        self._idempotency = IdempotencyRepository()
+
     def create_book(self, title: str, author: str) -> Dict[str, Any]:
         """Create a new book"""
         session = self._get_session()
         try:
             book = Book(title=title, author=author, is_borrowed=False)
             session.add(book)
-            return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, book))
+            session.flush()
+            self._stats.record_book_created(session, author)
+            self._changes.record(session, 'book', book.id, 'create', DatabaseHelper.sqlalchemy_to_dict(book))
+            result = DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, book))
+            availability_index.mark_created(book.id)
+            return result
         except IntegrityError as e:
             self._rollback_on_error(session, ValueError("Book creation failed due to integrity constraint"))
         except SQLAlchemyError as e:
@@ -30,9 +52,13 @@ class BookRepository(BaseRepository):
             book = session.query(Book).filter(Book.id == book_id).first()
             if not book:
                 return None
+            self._stats.record_author_changed(session, book.author, author)
             book.title = title
             book.author = author
             book.updated_at = book.updated_at  # This will trigger the onupdate
+            session.flush()
+            self._changes.record(session, 'book', book_id, 'update',
+                                 {'title': title, 'author': author, 'updated_at': book.updated_at})
             return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, book))
         except SQLAlchemyError as e:
             self._rollback_on_error(session, e)
@@ -50,6 +76,34 @@ class BookRepository(BaseRepository):
         finally:
             session.close()
 
+    def get_books_by_ids(self, book_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Get several books in one query, keyed by book ID
+
+        Uses a single array parameter (``id = ANY(:ids)``) so the statement text
+        is the same regardless of how many IDs are requested. Missing IDs are
+        simply absent from the returned mapping.
+        """
+        ids = list(dict.fromkeys(book_ids))
+        if not ids:
+            return {}
+        session = self._get_session()
+        try:
+            books = session.query(Book, Member.name.label('current_member_name')).outerjoin(
+                Member, Book.current_member_id == Member.id
+            ).filter(
+                Book.id == any_(bindparam('ids', value=ids, type_=ARRAY(Integer)))
+            ).all()
+            result = {}
+            for book, member_name in books:
+                book_dict = DatabaseHelper.sqlalchemy_to_dict(book)
+                book_dict['current_member_name'] = member_name or ''
+                result[book.id] = book_dict
+            return result
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
     def list_books(self) -> List[Dict[str, Any]]:
         """List all books with member information"""
         session = self._get_session()
@@ -93,10 +147,11 @@ class BookRepository(BaseRepository):
         
         Args:
             limit: Maximum number of books to return
-            cursor: Cursor for pagination (book ID or timestamp depending on order_by)
+            cursor: Cursor for pagination (book ID, or 'borrow_count|id' for 'popular')
             filter_type: 'all', 'available', or 'borrowed'
             search: Search query for title/author
-            order_by: 'id' for ID-based pagination, 'updated_at' for recent books
+            order_by: 'id' for ID-based pagination, 'updated_at' for recent books,
+                'popular' for most borrowed first
         """
         session = self._get_session()
         try:
@@ -122,6 +177,15 @@ class BookRepository(BaseRepository):
                 query = query.order_by(desc(Book.updated_at))
                 # Cursor-based pagination with updated_at is complex, so we'll just use limit
                 # For recent books, cursor is typically not used
+            elif order_by == 'popular':
+                # Keyset on (borrow_count DESC, id), matching idx_book_borrow_count
+                query = query.order_by(desc(Book.borrow_count), Book.id)
+                if cursor:
+                    cursor_count, cursor_id = self._parse_popular_cursor(cursor)
+                    query = query.filter(or_(
+                        Book.borrow_count < cursor_count,
+                        and_(Book.borrow_count == cursor_count, Book.id > cursor_id)
+                    ))
             else:
                 # Default: order by ID for consistent pagination
                 query = query.order_by(Book.id)
@@ -134,7 +198,7 @@ class BookRepository(BaseRepository):
                         pass  # Invalid cursor, ignore
 
             # Limit results
-            books = query.limit(limit + 1).all() if order_by == 'id' else query.limit(limit).all()
+            books = query.limit(limit).all() if order_by == 'updated_at' else query.limit(limit + 1).all()
 
             result = []
             for book, member_name in books[:limit]:
@@ -147,6 +211,10 @@ class BookRepository(BaseRepository):
                 # For recent books, we don't use cursor-based pagination
                 has_more = False
                 next_cursor = None
+            elif order_by == 'popular':
+                has_more = len(books) > limit
+                last = books[limit - 1][0] if result and has_more else None
+                next_cursor = f"{last.borrow_count}|{last.id}" if last else None
             else:
                 has_more = len(books) > limit
                 next_cursor = str(books[limit - 1][0].id) if result and has_more else None
@@ -157,6 +225,43 @@ class BookRepository(BaseRepository):
         finally:
             session.close()
 
+    @staticmethod
+    def _parse_popular_cursor(cursor: str) -> Tuple[int, int]:
+        try:
+            borrow_count, book_id = cursor.split('|', 1)
+            return int(borrow_count), int(book_id)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+
+    def backfill_borrow_counts(self, start_id: int, end_id: int) -> int:
+        """Set borrow_count from the ledger for books with start_id <= id < end_id
+
+        The range's book rows are share-locked first, so no borrow of those
+        books can commit between counting and writing. Counts only ever go
+        up: once ledger retention has detached old partitions the ledger
+        holds fewer borrows than the counter, so a lower count is left alone
+        and re-running a range is harmless. Returns the number of books changed.
+        """
+        session = self._get_session()
+        try:
+            session.execute(text("SELECT id FROM book WHERE id >= :start AND id < :end FOR SHARE"),
+                            {'start': start_id, 'end': end_id})
+            updated = session.execute(text("""
+                UPDATE book SET borrow_count = counts.borrows
+                FROM (
+                    SELECT b.id, (SELECT count(*) FROM ledger l
+                                  WHERE l.book_id = b.id AND l.action_type = 'BORROW') AS borrows
+                    FROM book b WHERE b.id >= :start AND b.id < :end
+                ) counts
+                WHERE book.id = counts.id AND book.borrow_count < counts.borrows
+            """), {'start': start_id, 'end': end_id}).rowcount
+            session.commit()
+            return updated
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+
     def search_books(self, query: str) -> List[Dict[str, Any]]:
         """Search books by title or author"""
         session = self._get_session()
@@ -178,7 +283,17 @@ class BookRepository(BaseRepository):
             session.close()
 
     def is_book_available(self, book_id: int) -> bool:
-        """Check if a book is available for borrowing"""
+        """Check if a book is available for borrowing
+
+        The availability index only answers yes: it misses other processes'
+        writes until the next reconcile, so a no is confirmed in the database
+        rather than rejecting a borrow on a stale entry. A stale yes is caught
+        by the borrow itself, which re-reads the book row.
+        """
+        if availability_index.loaded and availability_index.is_available(book_id):
+            availability_lookups_total.inc(source='index')
+            return True
+        availability_lookups_total.inc(source='database')
         session = self._get_session()
         try:
             return Book.is_available(session, book_id)
@@ -186,60 +301,162 @@ class BookRepository(BaseRepository):
             session.close()
 
     def is_book_borrowed_by_member(self, book_id: int, member_id: int) -> bool:
-        """Check if a book is borrowed by a specific member"""
+        """Check if a book is borrowed by a specific member
+
+        As in is_book_available, only a yes from the availability index is
+        final; a no is confirmed in the database.
+        """
+        if availability_index.loaded and availability_index.is_borrowed_by_member(book_id, member_id):
+            availability_lookups_total.inc(source='index')
+            return True
+        availability_lookups_total.inc(source='database')
         session = self._get_session()
         try:
             return Book.is_borrowed_by_member(session, book_id, member_id)
         finally:
             session.close()
 
-    def borrow_book(self, book_id: int, member_id: int) -> Dict[str, Any]:
-        """Mark a book as borrowed by a member"""
-        session = self._get_session()
-        try:
-            # Get the book with row-level lock to prevent concurrent modifications
-            book = session.query(Book).filter(Book.id == book_id).with_for_update().first()
-            if not book:
-                raise ValueError("Book not found")
+    def count_books_by_status(self) -> Tuple[int, int]:
+        """Return (total books, borrowed books)"""
+        if availability_index.loaded:
+            availability_lookups_total.inc(source='index')
+            return availability_index.counts()
+        availability_lookups_total.inc(source='database')
+        stats = self._stats.get_stats(author_limit=0)
+        return stats[TOTAL_BOOKS], stats[BORROWED_BOOKS]
+
+    def borrow_book(self, book_id: int, member_id: int, due_date: Optional[datetime] = None,
+                    idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Mark a book as borrowed by a member
+
+        The book update, the BORROW ledger entry, the new loan and the
+        idempotency key (if any) commit in one transaction. Returns the ledger
+        entry.
+        """
+        def apply(book):
             if book.is_borrowed:
                 raise ValueError("Book is already borrowed")
+            return {Book.is_borrowed: True, Book.current_member_id: member_id,
+                    Book.borrow_count: Book.borrow_count + 1}
 
-            # Update book
-            book.is_borrowed = True
-            book.current_member_id = member_id
-            book.updated_at = book.updated_at  # Trigger onupdate
+        def record(session, now):
+            loan = Loan(book_id=book_id, member_id=member_id, borrowed_at=now, due_at=due_date)
+            session.add(loan)
+            session.flush()
+            self._stats.record_borrow(session, member_id)
+            self._changes.record(session, 'book', book_id, 'borrow',
+                                 {'is_borrowed': True, 'current_member_id': member_id, 'updated_at': now})
+            self._changes.record(session, 'loan', loan.id, 'create', DatabaseHelper.sqlalchemy_to_dict(loan))
+            return Ledger(book_id=book_id, member_id=member_id, action_type='BORROW',
+                          log_date=now, due_date_snapshot=due_date)
 
-            self._commit_and_refresh(session, book)
-            return DatabaseHelper.sqlalchemy_to_dict(book)
-        except SQLAlchemyError as e:
-            self._rollback_on_error(session, e)
-        finally:
-            session.close()
+        result = self._change_loan_state('borrow', book_id, member_id, apply, record, idempotency_key)
+        availability_index.mark_borrowed(book_id, member_id)
+        return result
 
-    def return_book(self, book_id: int, member_id: int) -> Dict[str, Any]:
-        """Mark a book as returned by a member"""
-        session = self._get_session()
-        try:
-            # Get the book with row-level lock to prevent concurrent modifications
-            book = session.query(Book).filter(Book.id == book_id).with_for_update().first()
-            if not book:
-                raise ValueError("Book not found")
+    def return_book(self, book_id: int, member_id: int, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Mark a book as returned by a member
+
+        The book update, the RETURN ledger entry, closing the open loan and the
+        idempotency key (if any) commit in one transaction. Returns the ledger
+        entry.
+        """
+        def apply(book):
             if not book.is_borrowed:
                 raise ValueError("Book is not currently borrowed")
             if book.current_member_id != member_id:
                 raise ValueError("This member did not borrow this book")
+            return {Book.is_borrowed: False, Book.current_member_id: None}
 
-            # Update book
-            book.is_borrowed = False
-            book.current_member_id = None
-            book.updated_at = book.updated_at  # Trigger onupdate
+        def record(session, now):
+            # Loans borrowed before the loan table existed have no open row
+            # until the ledger backfill creates it, so zero matches is fine
+            loan_id = session.execute(
+                update(Loan).where(Loan.book_id == book_id, Loan.returned_at.is_(None))
+                .values(returned_at=now).returning(Loan.id)
+            ).scalar()
+            self._stats.record_return(session, member_id)
+            self._changes.record(session, 'book', book_id, 'return',
+                                 {'is_borrowed': False, 'current_member_id': None, 'updated_at': now})
+            if loan_id is not None:
+                self._changes.record(session, 'loan', loan_id, 'return', {'returned_at': now})
+            return Ledger(book_id=book_id, member_id=member_id, action_type='RETURN', log_date=now)
 
-            self._commit_and_refresh(session, book)
-            return DatabaseHelper.sqlalchemy_to_dict(book)
-        except SQLAlchemyError as e:
-            self._rollback_on_error(session, e)
-        finally:
-            session.close()
+        result = self._change_loan_state('return', book_id, member_id, apply, record, idempotency_key)
+        availability_index.mark_returned(book_id)
+        return result
+
+    def _change_loan_state(self, operation: str, book_id: int, member_id: int,
+                           apply: Callable[[Book], Dict[Any, Any]],
+                           record: Callable[[Session, datetime], Ledger],
+                           idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Validate and apply a borrow/return under the configured concurrency mode
+
+        ``apply`` checks the current row and returns the column values to write.
+        ``record`` then writes the loan, catalog statistics and change log rows
+        in the same session and returns the ledger entry to add, so they all
+        commit together with the book update, as does ``idempotency_key``
+        along with the resulting ledger entry.
+        The write is always a compare-and-swap on ``version``:
+
+        - 'pessimistic': the row is read with SELECT ... FOR UPDATE, so the
+          swap cannot fail and concurrent callers queue on the row lock.
+        - 'optimistic': the row is read without a lock; a concurrent change
+          makes the swap match no rows and the attempt is retried.
+        - 'nowait': the row is read with FOR UPDATE NOWAIT; if it is locked the
+          attempt fails immediately and is retried.
+
+        Retries re-read the row, so a book borrowed by the winner of a race is
+        reported as unavailable rather than retried again.
+        """
+        mode = Config.BORROW_CONCURRENCY_MODE
+
+        def attempt():
+            session = self._get_session()
+            try:
+                query = session.query(Book).filter(Book.id == book_id)
+                if mode == 'pessimistic':
+                    query = query.with_for_update()
+                elif mode == 'nowait':
+                    query = query.with_for_update(nowait=True)
+                book = query.first()
+                if not book:
+                    raise ValueError("Book not found")
+
+                now = datetime.utcnow()
+                values = apply(book)
+                values[Book.version] = Book.version + 1
+                values[Book.updated_at] = now
+                updated = session.query(Book).filter(
+                    Book.id == book_id, Book.version == book.version
+                ).update(values, synchronize_session=False)
+                if updated == 0:
+                    session.rollback()
+                    raise ConcurrencyConflict(f"Book {book_id} was modified concurrently")
+
+                entry = record(session, now)
+                session.add(entry)
+                if idempotency_key is None:
+                    return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, entry))
+                session.flush()
+                result = DatabaseHelper.sqlalchemy_to_dict(entry)
+                stored = self._idempotency.record(session, idempotency_key, operation, book_id, member_id, result)
+                session.commit()
+                self._idempotency.remember(idempotency_key, stored)
+                return result
+            except OperationalError as e:
+                session.rollback()
+                if getattr(e.orig, 'pgcode', None) == LOCK_NOT_AVAILABLE:
+                    raise ConcurrencyConflict(f"Book {book_id} is locked by another transaction") from e
+                raise e
+            except SQLAlchemyError as e:
+                self._rollback_on_error(session, e)
+            finally:
+                session.close()
+
+        if mode == 'pessimistic':
+            return attempt()
+        return self._retry_on_conflict(operation, attempt)
 
     def list_borrowed_books(self, member_id: int) -> List[Dict[str, Any]]:
         """List all books borrowed by a member"""
@@ -0,0 +1,211 @@
+import queue
+import select
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import psycopg2
+
+from config import Config
+from db_helper import DATABASE_URL
+from logger import logger
+from metrics import registry
+from .change_log_repository import CHANNEL, ChangeLogExpired, ChangeLogRepository, Position, change_position
+
+# Change log operations that change a book's availability
+AVAILABILITY_OPERATIONS = ('create', 'borrow', 'return')
+
+watch_dropped_total = registry.counter(
+    'library_watch_dropped_total', 'WatchBooks subscribers dropped because their queue was full')
+
+
+class TooManyWatchers(Exception):
+    """Raised when the process already serves its maximum number of streams"""
+
+
+def availability_event(change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Map a change log row to a book availability event, or None if it is not one"""
+    if change['entity'] != 'book' or change['operation'] not in AVAILABILITY_OPERATIONS:
+        return None
+    return {
+        'seq': change['seq'],
+        'book_id': change['entity_id'],
+        'operation': change['operation'],
+        'is_borrowed': bool(change['data'].get('is_borrowed')),
+        'current_member_id': change['data'].get('current_member_id'),
+        'changed_at': change['changed_at'],
+        'txid': change['txid'],
+    }
+
+
+class WatchSubscription:
+    """One WatchBooks stream: replays missed events, then yields live ones
+
+    Live events arrive on a bounded queue filled by the hub. A subscriber
+    that falls ``queue_size`` events behind is dropped (``dropped`` is set
+    and iteration ends) rather than slowing every other stream down; it can
+    reconnect with the last seq it saw. Events are compared by their change
+    log position (see change_position), not by seq.
+    """
+
+    def __init__(self, hub: 'BookWatchHub', since: Optional[Position], start: Position, queue_size: int):
+        self._hub = hub
+        self._since = since
+        self._start = start
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        self.dropped = False
+
+    def close(self) -> None:
+        self._closed.set()
+        self._hub.unsubscribe(self)
+
+    def close_quietly(self) -> None:
+        """End the stream without touching the hub (the caller holds its lock)"""
+        self._closed.set()
+
+    def offer(self, event: Dict[str, Any]) -> bool:
+        """Queue a live event; returns False (and marks the subscriber dropped) when the queue is full"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped = True
+            self._closed.set()
+            return False
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        last = self._start
+        if self._since is not None:
+            yield from self._hub.replay(self._since, self._start)
+            # The stream may resume ahead of this hub (from another process's events)
+            last = max(self._since, self._start)
+        while not self._closed.is_set():
+            try:
+                event = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if change_position(event) > last:
+                last = change_position(event)
+                yield event
+
+
+class BookWatchHub:
+    """Fans committed book availability changes out to WatchBooks streams
+
+    One dedicated connection per process LISTENs on the change log channel.
+    Each notification (or, as a fallback, every ``poll_seconds``) makes the
+    hub read the change log from where it left off, once for all
+    subscribers, and offer the book availability events to each of them.
+    Events carry their change log seq, which clients pass back to resume.
+    The hub starts with its first subscriber.
+    """
+
+    def __init__(self, poll_seconds: float = Config.WATCH_POLL_SECONDS,
+                 queue_size: int = Config.WATCH_QUEUE_SIZE,
+                 max_subscribers: int = Config.WATCH_MAX_SUBSCRIBERS):
+        self._poll_seconds = poll_seconds
+        self._queue_size = queue_size
+        self._max_subscribers = max_subscribers
+        self._changes = ChangeLogRepository()
+        self._lock = threading.Lock()
+        self._subscribers: List[WatchSubscription] = []
+        self._last_position: Optional[Position] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def subscribe(self, since_seq: int = 0) -> WatchSubscription:
+        """Register a stream; events after ``since_seq`` (or from now, for 0) will be yielded
+
+        Raises ChangeLogExpired when events after ``since_seq`` were pruned,
+        and TooManyWatchers when the process already serves ``max_subscribers``.
+        """
+        self._ensure_started()
+        # Fails fast on pruned history instead of after the stream opened
+        since = self._changes.position(since_seq) if since_seq else None
+        with self._lock:
+            if len(self._subscribers) >= self._max_subscribers:
+                raise TooManyWatchers("Too many watchers on this server, retry later")
+            subscription = WatchSubscription(self, since, self._last_position, self._queue_size)
+            self._subscribers.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: WatchSubscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def replay(self, since: Position, until: Position) -> Iterator[Dict[str, Any]]:
+        """Yield availability events positioned after ``since``, up to and including ``until``"""
+        while since < until:
+            changes, _ = self._changes.list_changes_after(since, Config.CHANGE_LOG_PAGE_MAX)
+            for change in changes:
+                if change_position(change) > until:
+                    return
+                event = availability_event(change)
+                if event:
+                    yield event
+            if not changes:
+                return
+            since = change_position(changes[-1])
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._last_position = self._changes.head_position()
+            self._thread = threading.Thread(target=self._run, name='book-watch-hub', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(DATABASE_URL)
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute(f"LISTEN {CHANNEL}")
+                # Catch up on anything committed while not listening
+                self._dispatch()
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], self._poll_seconds) != ([], [], []):
+                        connection.poll()
+                        connection.notifies.clear()
+                    self._dispatch()
+            except Exception as e:
+                logger.error(f"Book watch hub connection failed, reconnecting: {str(e)}")
+                self._stop.wait(self._poll_seconds)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _dispatch(self) -> None:
+        """Read the change log past the hub's position and offer availability events to every subscriber"""
+        has_more = True
+        while has_more:
+            try:
+                changes, has_more = self._changes.list_changes_after(self._last_position, Config.CHANGE_LOG_PAGE_MAX)
+            except ChangeLogExpired:
+                # Fell behind the retention window: streams cannot be continued
+                logger.warning("Book watch hub fell behind the change log retention, dropping all streams")
+                with self._lock:
+                    for subscription in self._subscribers:
+                        subscription.dropped = True
+                        subscription.close_quietly()
+                    self._subscribers = []
+                    self._last_position = self._changes.head_position()
+                return
+            if not changes:
+                return
+            events = [event for event in map(availability_event, changes) if event]
+            with self._lock:
+                for subscription in list(self._subscribers):
+                    if not all(subscription.offer(event) for event in events):
+                        watch_dropped_total.inc()
+                        self._subscribers.remove(subscription)
+                self._last_position = change_position(changes[-1])
+
+
+# Process-wide hub shared by every WatchBooks stream
+book_watch_hub = BookWatchHub()
@@ -0,0 +1,148 @@
+import random
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import Config
+from db_helper import AuthorStat, Book, CatalogStat, Member
+from metrics import registry
+from .base_repository import BaseRepository
+
+TOTAL_BOOKS = 'total_books'
+BORROWED_BOOKS = 'borrowed_books'
+ACTIVE_BORROWERS = 'active_borrowers'
+COUNTERS = (TOTAL_BOOKS, BORROWED_BOOKS, ACTIVE_BORROWERS)
+
+stats_drift_total = registry.counter(
+    'library_catalog_stats_drift_total', 'Catalog statistics found wrong and corrected by the repair job')
+
+
+class CatalogStatsRepository(BaseRepository):
+    """Summary counters for the catalog dashboards
+
+    The ``record_*`` methods take the caller's session and run inside the
+    create/update/borrow/return transaction, so the counters commit or roll
+    back with the change they describe. Reads are a handful of primary-key
+    rows regardless of catalog size. ``recompute`` rebuilds everything from
+    the base tables.
+    """
+
+    def record_book_created(self, session: Session, author: str) -> None:
+        self._increment(session, TOTAL_BOOKS, 1)
+        self._add_author_books(session, author, 1)
+
+    def record_author_changed(self, session: Session, old_author: str, new_author: str) -> None:
+        if old_author == new_author:
+            return
+        # Fixed lock order between the two author rows avoids deadlocks
+        for author, delta in sorted([(old_author, -1), (new_author, 1)]):
+            self._add_author_books(session, author, delta)
+
+    def record_borrow(self, session: Session, member_id: int) -> None:
+        """Call after the book row has been marked borrowed"""
+        self._increment(session, BORROWED_BOOKS, 1)
+        if self._member_open_loans(session, member_id) == 1:
+            self._increment(session, ACTIVE_BORROWERS, 1)
+
+    def record_return(self, session: Session, member_id: int) -> None:
+        """Call after the book row has been marked returned"""
+        self._increment(session, BORROWED_BOOKS, -1)
+        if self._member_open_loans(session, member_id) == 0:
+            self._increment(session, ACTIVE_BORROWERS, -1)
+
+    def get_stats(self, author_limit: int) -> Dict[str, Any]:
+        """Return the counters and the ``author_limit`` authors with the most books"""
+        session = self._get_session()
+        try:
+            counters = dict(session.query(CatalogStat.name, func.sum(CatalogStat.value)).group_by(CatalogStat.name).all())
+            authors = session.query(AuthorStat.author, AuthorStat.book_count).filter(
+                AuthorStat.book_count > 0
+            ).order_by(AuthorStat.book_count.desc(), AuthorStat.author).limit(author_limit).all()
+            stats = {name: int(counters.get(name) or 0) for name in COUNTERS}
+            stats['top_authors'] = [{'author': author, 'book_count': count} for author, count in authors]
+            return stats
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def recompute(self, apply: bool = True) -> Dict[str, Tuple[int, int]]:
+        """Recompute every statistic from the base tables and report drift
+
+        Returns {statistic: (stored, actual)} for each statistic that was
+        wrong; author counts are keyed 'author:<name>'. With ``apply`` the
+        stored values are replaced. Writers to the stats tables are blocked
+        while this runs, so transactions in flight are either fully counted
+        in the recomputation or apply their increments after it.
+        """
+        session = self._get_session()
+        try:
+            session.execute(text("LOCK TABLE catalog_stats, author_stats IN SHARE ROW EXCLUSIVE MODE"))
+            stored = self._stored(session)
+            actual = self._actual(session)
+            drift = {key: (stored.get(key, 0), value)
+                     for key, value in actual.items() if stored.get(key, 0) != value}
+            drift.update({key: (value, 0) for key, value in stored.items() if key not in actual and value})
+            if apply and drift:
+                session.query(CatalogStat).delete()
+                session.query(AuthorStat).delete()
+                session.add_all([CatalogStat(name=name, shard=0, value=actual[name]) for name in COUNTERS])
+                session.add_all([AuthorStat(author=key[len('author:'):], book_count=value)
+                                 for key, value in actual.items() if key.startswith('author:')])
+                stats_drift_total.inc(len(drift))
+            session.commit()
+            return drift
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+
+    def _increment(self, session: Session, name: str, delta: int) -> None:
+        statement = insert(CatalogStat).values(name=name, shard=random.randrange(Config.CATALOG_STATS_SHARDS), value=delta)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[CatalogStat.name, CatalogStat.shard],
+            set_={'value': CatalogStat.value + statement.excluded.value}
+        ))
+
+    def _add_author_books(self, session: Session, author: str, delta: int) -> None:
+        statement = insert(AuthorStat).values(author=author, book_count=delta)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=[AuthorStat.author],
+            set_={'book_count': AuthorStat.book_count + statement.excluded.book_count}
+        ))
+
+    @staticmethod
+    def _member_open_loans(session: Session, member_id: int) -> int:
+        """Open loans of a member, including the caller's uncommitted change
+
+        The member row is locked first so two borrows (or returns) by the same
+        member serialize here and each sees the other's committed book update.
+        FOR NO KEY UPDATE does not conflict with foreign-key checks.
+        """
+        session.query(Member.id).filter(Member.id == member_id).with_for_update(key_share=True).first()
+        return session.query(func.count(Book.id)).filter(
+            Book.current_member_id == member_id, Book.is_borrowed == True
+        ).scalar()
+
+    @staticmethod
+    def _stored(session: Session) -> Dict[str, int]:
+        stored = {name: int(value) for name, value in
+                  session.query(CatalogStat.name, func.sum(CatalogStat.value)).group_by(CatalogStat.name)}
+        stored.update({f"author:{author}": int(count) for author, count in
+                       session.query(AuthorStat.author, AuthorStat.book_count)})
+        return stored
+
+    @staticmethod
+    def _actual(session: Session) -> Dict[str, int]:
+        total, borrowed, borrowers = session.query(
+            func.count(Book.id),
+            func.count(Book.id).filter(Book.is_borrowed == True),
+            func.count(func.distinct(Book.current_member_id)).filter(Book.is_borrowed == True)
+        ).one()
+        actual = {TOTAL_BOOKS: total, BORROWED_BOOKS: borrowed, ACTIVE_BORROWERS: borrowers}
+        actual.update({f"author:{author}": count for author, count in
+                       session.query(Book.author, func.count(Book.id)).group_by(Book.author)})
+        return actual
@@ -0,0 +1,222 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db_helper import ChangeLog
+from logger import logger
+from .base_repository import BaseRepository
+
+# Channel notified (on commit) by every transaction that records a change
+CHANNEL = 'change_log'
+
+# Position of the last pruned change, kept in rollup_watermark (as its seq and
+# its txid) so clients further behind can be told to re-list instead of
+# silently missing changes
+PRUNED_WATERMARK = 'change_log_pruned'
+PRUNED_TXID_WATERMARK = 'change_log_pruned_txid'
+
+# Snapshot xmin: every transaction still running, or yet to start, has a txid
+# at or above it
+XMIN_SQL = "pg_snapshot_xmin(pg_current_snapshot())::text::bigint"
+
+# Changes after a (txid, seq) position, in that order, each flagged with
+# whether its transaction is below the snapshot xmin (no change can commit
+# before it any more)
+LIST_SQL = text(f"""
+    SELECT seq, entity, entity_id, operation, data, changed_at, txid,
+           txid < {XMIN_SQL} AS settled
+    FROM change_log
+    WHERE (txid, seq) > (:txid, :seq)
+    ORDER BY txid, seq
+    LIMIT :limit
+""")
+
+Position = Tuple[int, int]
+
+
+def change_position(change: Dict[str, Any]) -> Position:
+    """(txid, seq) of a change returned by list_changes; changes are served in this order"""
+    return change['txid'], change['seq']
+
+
+class ChangeLogExpired(ValueError):
+    """Raised when changes after the requested seq have been pruned"""
+
+
+EXPIRED_MESSAGE = "Changes after this sequence are no longer kept; list again and resume from the latest sequence"
+
+
+class ChangeLogRepository(BaseRepository):
+    """Transactional change log (outbox) of book, member and loan changes
+
+    ``record`` takes the caller's session, so a change row commits or rolls
+    back with the change it describes. Neither seq nor txid follows commit
+    order: a transaction gets its txid at its first write and its seq when
+    the change row is flushed, later. Changes are therefore served in
+    (txid, seq) order and only once their txid is below the snapshot xmin;
+    every change that commits afterwards has a txid at or above that xmin,
+    so it sorts after everything already served and clients never skip a
+    change. A client's seq cursor stands for the position of that change.
+    """
+
+    def record(self, session: Session, entity: str, entity_id: int, operation: str,
+               data: Dict[str, Any]) -> None:
+        """Add a change row for ``entity`` to the caller's transaction"""
+        data = {key: value.strftime('%Y-%m-%dT%H:%M:%SZ') if isinstance(value, datetime) else value
+                for key, value in data.items()}
+        session.add(ChangeLog(entity=entity, entity_id=entity_id, operation=operation, data=data))
+        # NOTIFY is delivered when the transaction commits; once per transaction is enough
+        if not session.info.get('change_log_notified'):
+            session.execute(text("SELECT pg_notify(:channel, '')"), {'channel': CHANNEL})
+            session.info['change_log_notified'] = True
+
+    def head_position(self) -> Position:
+        """Position of the latest change list_changes could return now, or (0, 0)"""
+        session = self._get_session()
+        try:
+            row = session.execute(text(
+                f"SELECT txid, seq FROM change_log WHERE txid < {XMIN_SQL} ORDER BY txid DESC, seq DESC LIMIT 1"
+            )).first()
+            return (row.txid, row.seq) if row else (0, 0)
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def position(self, since_seq: int) -> Position:
+        """Position of the change with seq ``since_seq`` (0 for before the oldest change)
+
+        Raises ChangeLogExpired when that change was pruned, or never existed.
+        """
+        if not since_seq:
+            return 0, 0
+        session = self._get_session()
+        try:
+            return self._position(session, since_seq)
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def list_changes(self, since_seq: int, limit: int) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Return changes after the change with seq ``since_seq``, the seq to resume from, and has_more
+
+        A ``since_seq`` of 0 starts at the oldest change still kept. has_more
+        is only set when more settled changes can be listed right away; a
+        page cut short by a transaction still in flight has it unset. Raises
+        ChangeLogExpired when changes after a non-zero ``since_seq`` were
+        already pruned.
+        """
+        session = self._get_session()
+        try:
+            changes, has_more = self._list(session, self._position(session, since_seq) if since_seq else (0, 0), limit)
+            return changes, changes[-1]['seq'] if changes else since_seq, has_more
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def list_changes_after(self, position: Position, limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return changes after ``position`` (see change_position) and has_more"""
+        session = self._get_session()
+        try:
+            return self._list(session, position, limit)
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def _position(self, session: Session, since_seq: int) -> Position:
+        txid = session.execute(text("SELECT txid FROM change_log WHERE seq = :seq"), {'seq': since_seq}).scalar()
+        if txid is not None:
+            return txid, since_seq
+        pruned = self._pruned_position(session)
+        if pruned and pruned[1] == since_seq:
+            return pruned
+        raise ChangeLogExpired(EXPIRED_MESSAGE)
+
+    def _list(self, session: Session, position: Position, limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+        rows = session.execute(LIST_SQL, {'txid': position[0], 'seq': position[1], 'limit': limit + 1}).all()
+        # Checked after reading: a prune committed before the read is seen here
+        pruned = self._pruned_position(session)
+        if position != (0, 0) and pruned and position < pruned:
+            raise ChangeLogExpired(EXPIRED_MESSAGE)
+        changes = []
+        for row in rows[:limit]:
+            if not row.settled:
+                break
+            changes.append({
+                'seq': row.seq,
+                'entity': row.entity,
+                'entity_id': row.entity_id,
+                'operation': row.operation,
+                'data': row.data,
+                'changed_at': row.changed_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'txid': row.txid,
+            })
+        # Only settled rows count: a change still in flight cannot be listed
+        # yet, so has_more would send the client straight back for nothing
+        return changes, len(changes) == limit and len(rows) > limit and rows[limit].settled
+
+    @staticmethod
+    def _pruned_position(session: Session, for_update: bool = False) -> Optional[Position]:
+        marks = dict(session.execute(text(
+            "SELECT name, last_id FROM rollup_watermark WHERE name IN (:seq_name, :txid_name)"
+            + (" ORDER BY name FOR UPDATE" if for_update else "")
+        ), {'seq_name': PRUNED_WATERMARK, 'txid_name': PRUNED_TXID_WATERMARK}).all())
+        if PRUNED_WATERMARK not in marks or PRUNED_TXID_WATERMARK not in marks:
+            return None
+        return marks[PRUNED_TXID_WATERMARK], marks[PRUNED_WATERMARK]
+
+    def prune(self, older_than: datetime) -> int:
+        """Delete changes made before ``older_than``; returns the number deleted
+
+        Deletes a prefix of the serving order: everything up to the last
+        settled change made before ``older_than``, so a client's cursor is
+        either still in the log, with everything after it, or expired.
+        """
+        session = self._get_session()
+        try:
+            # Serializes concurrent prunes (one per process) on the watermark rows
+            session.execute(text(
+                "INSERT INTO rollup_watermark (name, last_id) VALUES (:seq_name, 0), (:txid_name, 0) "
+                "ON CONFLICT (name) DO NOTHING"
+            ), {'seq_name': PRUNED_WATERMARK, 'txid_name': PRUNED_TXID_WATERMARK})
+            pruned = self._pruned_position(session, for_update=True)
+            last = session.execute(text(
+                f"SELECT txid, seq FROM change_log WHERE changed_at < :cutoff AND txid < {XMIN_SQL} "
+                "ORDER BY txid DESC, seq DESC LIMIT 1"
+            ), {'cutoff': older_than}).first()
+            if last is None or (pruned and (last.txid, last.seq) <= pruned):
+                session.commit()
+                return 0
+            deleted = session.execute(text(
+                "DELETE FROM change_log WHERE (txid, seq) <= (:txid, :seq)"
+            ), {'txid': last.txid, 'seq': last.seq}).rowcount
+            for name, value in ((PRUNED_WATERMARK, last.seq), (PRUNED_TXID_WATERMARK, last.txid)):
+                session.execute(text("UPDATE rollup_watermark SET last_id = :value WHERE name = :name"),
+                                {'name': name, 'value': value})
+            session.commit()
+            return deleted
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+
+    def start_pruning(self, interval_seconds: float, retention_hours: int) -> threading.Event:
+        """Prune changes older than ``retention_hours`` periodically on a daemon thread; set the returned event to stop"""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval_seconds):
+                try:
+                    self.prune(datetime.utcnow() - timedelta(hours=retention_hours))
+                except Exception as e:
+                    logger.error(f"Change log pruning failed: {str(e)}")
+
+        threading.Thread(target=run, name='change-log-pruning', daemon=True).start()
+        return stop
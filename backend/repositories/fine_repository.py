@@ -0,0 +1,85 @@
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, Tuple
+
+from db_helper import engine
+from .base_repository import BaseRepository
+
+# Open loans past due, plus loans returned late since ``since``. Each branch is
+# a range scan on a partial loan index (idx_loan_open_due / idx_loan_returned_at).
+# Timestamps are returned as epoch seconds so rows load straight into int arrays.
+CANDIDATES_SQL = """
+    SELECT id, member_id, extract(epoch FROM due_at)::bigint, extract(epoch FROM %(as_of)s::timestamp)::bigint
+    FROM loan
+    WHERE returned_at IS NULL AND due_at < %(as_of)s
+    UNION ALL
+    SELECT id, member_id, extract(epoch FROM due_at)::bigint, extract(epoch FROM returned_at)::bigint
+    FROM loan
+    WHERE returned_at >= %(since)s AND returned_at > due_at
+"""
+
+UPSERT_SQL = """
+    INSERT INTO fine (loan_id, member_id, days_overdue, amount_cents, computed_at)
+    SELECT loan_id, member_id, days_overdue, amount_cents, %(computed_at)s FROM fine_staging
+    ON CONFLICT (loan_id) DO UPDATE SET
+        days_overdue = EXCLUDED.days_overdue,
+        amount_cents = EXCLUDED.amount_cents,
+        computed_at = EXCLUDED.computed_at
+    WHERE fine.days_overdue <> EXCLUDED.days_overdue OR fine.amount_cents <> EXCLUDED.amount_cents
+"""
+
+
+class FineRepository(BaseRepository):
+    """Bulk reads and writes for the fines job
+
+    Works on raw psycopg2 connections rather than ORM sessions: candidates are
+    streamed through a server-side cursor, and fines are written with COPY
+    into a temporary staging table followed by one upsert per chunk.
+    """
+
+    def stream_fine_candidates(self, as_of: datetime, returned_since: datetime,
+                               chunk_size: int) -> Iterator[List[Tuple[int, int, int, int]]]:
+        """Yield chunks of (loan id, member id, due epoch, end epoch) for loans that may owe a fine
+
+        The end is ``as_of`` for open loans and the return time for returned ones.
+        """
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor(name='fine_candidates')
+            cursor.itersize = chunk_size
+            cursor.execute(CANDIDATES_SQL, {'as_of': as_of, 'since': returned_since})
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+    def upsert_fines(self, rows: BinaryIO, computed_at: datetime) -> int:
+        """COPY (loan id, member id, days overdue, amount cents) rows in binary format and upsert them
+
+        Fines whose amount has not changed are left untouched. Returns the
+        number of fines inserted or updated.
+        """
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS fine_staging "
+                "(loan_id INTEGER, member_id INTEGER, days_overdue INTEGER, amount_cents INTEGER) "
+                "ON COMMIT DELETE ROWS"
+            )
+            cursor.copy_expert(
+                "COPY fine_staging (loan_id, member_id, days_overdue, amount_cents) FROM STDIN WITH (FORMAT binary)", rows
+            )
+            cursor.execute(UPSERT_SQL, {'computed_at': computed_at})
+            upserted = cursor.rowcount
+            connection.commit()
+            return upserted
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
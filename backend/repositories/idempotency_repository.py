@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import Config
+from db_helper import IdempotencyKey
+from logger import logger
+from .base_repository import BaseRepository
+
+# Deletes one batch of expired keys, oldest first (idx_idempotency_key_created_at)
+PURGE_SQL = text("""
+    DELETE FROM idempotency_key WHERE key IN (
+        SELECT key FROM idempotency_key
+        WHERE created_at < :cutoff
+        ORDER BY created_at
+        LIMIT :batch_size
+    )
+""")
+
+
+class IdempotencyCache:
+    """Bounded LRU of recently stored idempotency keys
+
+    Holds the same record as the idempotency_key row, so a retry served by
+    the process that handled the original call needs no query at all.
+    """
+
+    def __init__(self, max_size: int = Config.IDEMPOTENCY_CACHE_SIZE):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._records: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                self._hits += 1
+                self._records.move_to_end(key)
+            else:
+                self._misses += 1
+            return record
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self._max_size:
+                self._records.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Lookups answered from the cache (hits) or not (misses) since start, and current size"""
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'size': len(self._records),
+                    'capacity': max(self._max_size, 0)}
+
+
+# Process-wide cache shared by every IdempotencyRepository
+idempotency_cache = IdempotencyCache()
+
+
+class IdempotencyRepository(BaseRepository):
+    """Idempotency keys of borrow/return calls and the ledger entries they produced
+
+    ``record`` takes the caller's session, so a key is stored if and only if
+    its borrow or return commits. ``lookup`` reads the cache, then the table
+    by primary key; neither takes a lock. Keys older than
+    IDEMPOTENCY_TTL_HOURS are ignored and later deleted by ``purge_expired``.
+    """
+
+    def __init__(self, cache: IdempotencyCache = idempotency_cache):
+        super().__init__()
+        self._cache = cache
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored record for ``key`` (operation, book_id, member_id, ledger_entry, created_at), or None"""
+        cutoff = datetime.utcnow() - timedelta(hours=Config.IDEMPOTENCY_TTL_HOURS)
+        record = self._cache.get(key)
+        if record is not None:
+            return record if record['created_at'] >= cutoff else None
+        session = self._get_session()
+        try:
+            row = session.query(IdempotencyKey).filter(
+                IdempotencyKey.key == key, IdempotencyKey.created_at >= cutoff
+            ).first()
+            if row is None:
+                return None
+            record = {'operation': row.operation, 'book_id': row.book_id, 'member_id': row.member_id,
+                      'ledger_entry': row.ledger_entry, 'created_at': row.created_at}
+            self._cache.put(key, record)
+            return record
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def record(self, session: Session, key: str, operation: str, book_id: int, member_id: int,
+               ledger_entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Store ``key`` in the caller's transaction; returns the record to ``remember`` after commit
+
+        An expired row for ``key`` that the purge has not reached yet is
+        overwritten, as ``lookup`` already ignores it. Raises ValueError when
+        the key is taken by a live row, which rolls back the caller's borrow
+        or return.
+        """
+        record = {'operation': operation, 'book_id': book_id, 'member_id': member_id,
+                  'ledger_entry': ledger_entry, 'created_at': datetime.utcnow()}
+        cutoff = record['created_at'] - timedelta(hours=Config.IDEMPOTENCY_TTL_HOURS)
+        statement = insert(IdempotencyKey).values(key=key, **record)
+        inserted = session.execute(statement.on_conflict_do_update(
+            index_elements=[IdempotencyKey.key],
+            set_={name: statement.excluded[name] for name in record},
+            where=IdempotencyKey.created_at < cutoff
+        )).rowcount
+        if not inserted:
+            raise ValueError("Idempotency key was already used for another request")
+        return record
+
+    def remember(self, key: str, record: Dict[str, Any]) -> None:
+        """Cache a committed key so retries to this process skip the database"""
+        self._cache.put(key, record)
+
+    def purge_expired(self, older_than: datetime, batch_size: int) -> int:
+        """Delete keys created before ``older_than``, ``batch_size`` per transaction; returns the number deleted"""
+        deleted = 0
+        while True:
+            session = self._get_session()
+            try:
+                count = session.execute(PURGE_SQL, {'cutoff': older_than, 'batch_size': batch_size}).rowcount
+                session.commit()
+            except SQLAlchemyError as e:
+                self._rollback_on_error(session, e)
+            finally:
+                session.close()
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    def start_gc(self, interval_seconds: float, ttl_hours: int, batch_size: int) -> threading.Event:
+        """Purge expired keys periodically on a daemon thread; set the returned event to stop"""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval_seconds):
+                try:
+                    self.purge_expired(datetime.utcnow() - timedelta(hours=ttl_hours), batch_size)
+                except Exception as e:
+                    logger.error(f"Idempotency key sweep failed: {str(e)}")
+
+        threading.Thread(target=run, name='idempotency-gc', daemon=True).start()
+        return stop
@@ -0,0 +1,134 @@
+import re
+import threading
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from logger import logger
+from .base_repository import BaseRepository
+
+ARCHIVE_SCHEMA = 'ledger_archive'
+PARTITION_NAME = re.compile(r'ledger_y(\d{4})m(\d{2})')
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"ledger_y{month.year:04d}m{month.month:02d}"
+
+
+class LedgerPartitionRepository(BaseRepository):
+    """Creates, lists and archives the monthly partitions of ``ledger``
+
+    ``ledger`` is range-partitioned on log_date with one partition per
+    calendar month ([first of month, first of next month)). Partitions are
+    created ahead of time so inserts never hit a missing range, and old
+    partitions are detached and moved to the ``ledger_archive`` schema rather
+    than deleted, so they can be dumped or dropped separately.
+    """
+
+    def ensure_partitions(self, months_ahead: int, from_date: Optional[date] = None) -> List[str]:
+        """Create any missing monthly partitions from ``from_date``'s month through ``months_ahead`` months from now
+
+        Returns the names of the partitions created.
+        """
+        first = month_start(from_date or datetime.utcnow().date())
+        last = add_months(month_start(datetime.utcnow().date()), months_ahead)
+        existing = set(self.list_partitions())
+        created = []
+        session = self._get_session()
+        try:
+            month = first
+            while month <= last:
+                name = partition_name(month)
+                if name not in existing:
+                    session.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF ledger "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                    ))
+                    created.append(name)
+                month = add_months(month, 1)
+            session.commit()
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+        if created:
+            logger.info(f"Created ledger partitions: {', '.join(created)}")
+        return created
+
+    def list_partitions(self) -> List[str]:
+        """List attached ledger partitions, oldest first"""
+        session = self._get_session()
+        try:
+            rows = session.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'ledger' ORDER BY c.relname"
+            ))
+            return [row[0] for row in rows]
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def archive_partitions_before(self, cutoff: date) -> List[str]:
+        """Detach partitions that end on or before ``cutoff`` and move them to the archive schema
+
+        Returns the names of the archived partitions.
+        """
+        cutoff_month = month_start(cutoff)
+        archived = []
+        for name in self.list_partitions():
+            match = PARTITION_NAME.fullmatch(name)
+            if not match:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if add_months(month, 1) > cutoff_month:
+                continue
+            session = self._get_session()
+            try:
+                session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                session.execute(text(f"ALTER TABLE ledger DETACH PARTITION {name}"))
+                session.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                session.commit()
+                archived.append(name)
+            except SQLAlchemyError as e:
+                self._rollback_on_error(session, e)
+            finally:
+                session.close()
+        if archived:
+            logger.info(f"Archived ledger partitions to {ARCHIVE_SCHEMA}: {', '.join(archived)}")
+        return archived
+
+    def start_maintenance(self, interval_seconds: float, months_ahead: int,
+                          retention_months: int = 0) -> threading.Event:
+        """Ensure future partitions (and archive expired ones) periodically on a daemon thread
+
+        ``retention_months`` of 0 keeps every partition attached. Set the
+        returned event to stop.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval_seconds):
+                try:
+                    self.ensure_partitions(months_ahead)
+                    if retention_months:
+                        cutoff = add_months(month_start(datetime.utcnow().date()), -retention_months)
+                        self.archive_partitions_before(cutoff)
+                except Exception as e:
+                    logger.error(f"Ledger partition maintenance failed: {str(e)}")
+
+        threading.Thread(target=run, name='ledger-partition-maintenance', daemon=True).start()
+        return stop
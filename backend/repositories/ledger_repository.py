@@ -1,5 +1,6 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
+from sqlalchemy import desc, tuple_
 from sqlalchemy.exc import SQLAlchemyError
 
 from db_helper import Ledger, DatabaseHelper
@@ -9,20 +10,68 @@ from .base_repository import BaseRepository
 class LedgerRepository(BaseRepository):
     """Repository for Ledger entity operations"""
 
-    def create_ledger_entry(self, book_id: int, member_id: int, action_type: str,
-                          due_date_snapshot: datetime = None) -> Dict[str, Any]:
-        """Create a new ledger entry"""
+    def list_entries(self, limit: int = 50, cursor: Optional[str] = None,
+                     member_id: Optional[int] = None, book_id: Optional[int] = None,
+                     action_type: Optional[str] = None, start_date: Optional[datetime] = None,
+                     end_date: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """List ledger entries, newest first, with keyset pagination
+
+        Args:
+            limit: Maximum number of entries to return
+            cursor: Opaque cursor from a previous page ('<log_date ISO>|<id>')
+            member_id: Only entries for this member
+            book_id: Only entries for this book
+            action_type: 'BORROW' or 'RETURN'
+            start_date: Only entries logged at or after this time
+            end_date: Only entries logged before this time
+
+        Pages are ordered by (log_date DESC, id DESC) and continue strictly
+        after the cursor's row, so each page is an index range scan on the
+        member/book history indexes regardless of how deep it is. Date bounds
+        (including the cursor's) prune ledger's monthly partitions, and without
+        them the ordered scan reads partitions newest-first and stops once the
+        page is full.
+        """
         session = self._get_session()
         try:
-            ledger_entry = Ledger(
-                book_id=book_id,
-                member_id=member_id,
-                action_type=action_type,
-                due_date_snapshot=due_date_snapshot
-            )
-            session.add(ledger_entry)
-            return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, ledger_entry))
+            query = session.query(Ledger)
+            if member_id:
+                query = query.filter(Ledger.member_id == member_id)
+            if book_id:
+                query = query.filter(Ledger.book_id == book_id)
+            if action_type:
+                query = query.filter(Ledger.action_type == action_type)
+            if start_date:
+                query = query.filter(Ledger.log_date >= start_date)
+            if end_date:
+                query = query.filter(Ledger.log_date < end_date)
+            if cursor:
+                cursor_date, cursor_id = self._parse_cursor(cursor)
+                query = query.filter(
+                    tuple_(Ledger.log_date, Ledger.id) < tuple_(cursor_date, cursor_id),
+                    # Redundant with the row comparison, but lets the planner prune newer partitions
+                    Ledger.log_date <= cursor_date
+                )
+
+            entries = query.order_by(desc(Ledger.log_date), desc(Ledger.id)).limit(limit + 1).all()
+
+            result = [DatabaseHelper.sqlalchemy_to_dict(entry) for entry in entries[:limit]]
+            has_more = len(entries) > limit
+            next_cursor = self._make_cursor(entries[limit - 1]) if result and has_more else None
+            return result, next_cursor, has_more
         except SQLAlchemyError as e:
-            self._rollback_on_error(session, e)
+            raise e
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    @staticmethod
+    def _make_cursor(entry: Ledger) -> str:
+        return f"{entry.log_date.isoformat()}|{entry.id}"
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> Tuple[datetime, int]:
+        try:
+            log_date, entry_id = cursor.rsplit('|', 1)
+            return datetime.fromisoformat(log_date), int(entry_id)
+        except ValueError:
+            raise ValueError("Invalid cursor")
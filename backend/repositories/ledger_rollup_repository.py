@@ -0,0 +1,113 @@
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from db_helper import LedgerDailyRollup, DatabaseHelper
+from .base_repository import BaseRepository
+
+WATERMARK = 'ledger_daily_rollup'
+DIMENSIONS = ('all', 'author', 'cohort')
+
+# Folds ledger rows with low < id <= high into the daily rollups, adding to
+# existing counts. Must run in the same transaction as the watermark update.
+ROLLUP_SQL = text("""
+    WITH batch AS (
+        SELECT l.log_date::date AS day, l.action_type, b.author,
+               to_char(m.created_at, 'YYYY-MM') AS cohort
+        FROM ledger l
+        JOIN book b ON b.id = l.book_id
+        JOIN member m ON m.id = l.member_id
+        WHERE l.id > :low AND l.id <= :high
+    )
+    INSERT INTO ledger_daily_rollup (dimension, dimension_key, day, borrows, returns)
+    SELECT CASE WHEN GROUPING(author) = 0 THEN 'author'
+                WHEN GROUPING(cohort) = 0 THEN 'cohort'
+                ELSE 'all' END,
+           COALESCE(author, cohort, ''),
+           day,
+           count(*) FILTER (WHERE action_type = 'BORROW'),
+           count(*) FILTER (WHERE action_type = 'RETURN')
+    FROM batch
+    GROUP BY GROUPING SETS ((day), (day, author), (day, cohort))
+    ON CONFLICT (dimension, dimension_key, day) DO UPDATE SET
+        borrows = ledger_daily_rollup.borrows + EXCLUDED.borrows,
+        returns = ledger_daily_rollup.returns + EXCLUDED.returns
+""")
+
+
+class LedgerRollupRepository(BaseRepository):
+    """Daily circulation rollups built incrementally from the ledger
+
+    A watermark row records the highest ledger.id already counted. Each
+    ``fold_next_batch`` call adds the next id range to the rollups and moves
+    the watermark in one transaction, so a crash loses nothing and counts
+    nothing twice: the batch either committed with its watermark or is
+    redone. Only rows older than a safety lag are folded, because ids are
+    assigned before commit and a slow transaction could otherwise commit an
+    id below the watermark.
+    """
+
+    def fold_next_batch(self, batch_size: int, safe_before: datetime) -> Optional[Tuple[int, int]]:
+        """Fold up to ``batch_size`` ledger ids logged before ``safe_before``
+
+        Returns the (low, high] id range folded, an empty range when caught
+        up, or None when another process holds the watermark.
+        """
+        session = self._get_session()
+        try:
+            session.execute(text(
+                "INSERT INTO rollup_watermark (name, last_id) VALUES (:name, 0) ON CONFLICT (name) DO NOTHING"
+            ), {'name': WATERMARK})
+            low = session.execute(text(
+                "SELECT last_id FROM rollup_watermark WHERE name = :name FOR UPDATE SKIP LOCKED"
+            ), {'name': WATERMARK}).scalar()
+            if low is None:
+                session.rollback()
+                return None
+            upper = session.execute(text(
+                "SELECT id FROM ledger WHERE log_date < :safe_before ORDER BY log_date DESC, id DESC LIMIT 1"
+            ), {'safe_before': safe_before}).scalar()
+            high = min(low + batch_size, upper or 0)
+            if high <= low:
+                session.commit()
+                return low, low
+            session.execute(ROLLUP_SQL, {'low': low, 'high': high})
+            session.execute(text("UPDATE rollup_watermark SET last_id = :high WHERE name = :name"),
+                            {'high': high, 'name': WATERMARK})
+            session.commit()
+            return low, high
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+
+    def list_rollups(self, dimension: str, dimension_key: Optional[str], start_date: date,
+                     end_date: date, limit: int) -> List[Dict[str, Any]]:
+        """Rollup rows for ``dimension`` with start_date <= day < end_date, by day then key
+
+        With ``dimension_key`` only that key's rows are returned. Either way
+        the read is a primary-key or (dimension, day) index range scan whose
+        size depends on the number of days and keys, not on ledger rows.
+        """
+        session = self._get_session()
+        try:
+            query = session.query(LedgerDailyRollup).filter(
+                LedgerDailyRollup.dimension == dimension,
+                LedgerDailyRollup.day >= start_date,
+                LedgerDailyRollup.day < end_date
+            )
+            if dimension_key is not None:
+                query = query.filter(LedgerDailyRollup.dimension_key == dimension_key)
+            rows = query.order_by(LedgerDailyRollup.day, LedgerDailyRollup.dimension_key).limit(limit).all()
+            result = []
+            for row in rows:
+                data = DatabaseHelper.sqlalchemy_to_dict(row)
+                data['day'] = row.day.isoformat()
+                result.append(data)
+            return result
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
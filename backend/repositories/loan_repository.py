@@ -0,0 +1,153 @@
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy import desc, func, text, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import Config
+from db_helper import Book, Loan, DatabaseHelper
+from .base_repository import BaseRepository
+
+# Pairs each BORROW in the book range with the book's next ledger event. A
+# loan closes at that event even if it is (anomalously) another BORROW, so only
+# the last borrow per book can be open. ON CONFLICT skips loans that already
+# exist, whether written by the borrow path or an earlier backfill run.
+# Borrows logged before the due-date policy carry a due date at (or just
+# before) the borrow itself; those get the configured loan period instead.
+BACKFILL_SQL = text("""
+    INSERT INTO loan (book_id, member_id, borrowed_at, due_at, returned_at)
+    SELECT book_id, member_id, log_date,
+           CASE WHEN due_date_snapshot > log_date THEN due_date_snapshot
+                ELSE log_date + make_interval(days => :loan_period_days) END,
+           next_date
+    FROM (
+        SELECT book_id, member_id, action_type, log_date, due_date_snapshot,
+               lead(log_date) OVER (PARTITION BY book_id ORDER BY log_date, id) AS next_date
+        FROM ledger
+        WHERE book_id >= :start_id AND book_id < :end_id
+    ) events
+    WHERE action_type = 'BORROW'
+    ON CONFLICT DO NOTHING
+""")
+
+
+class LoanRepository(BaseRepository):
+    """Repository for Loan entity operations
+
+    Loans are written by BookRepository.borrow_book/return_book; this
+    repository reads them and backfills them from the ledger.
+    """
+
+    def list_loans(self, limit: int = 50, cursor: Optional[str] = None,
+                   member_id: Optional[int] = None, book_id: Optional[int] = None,
+                   open_only: bool = False, start_date: Optional[datetime] = None,
+                   end_date: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """List loans, most recently borrowed first, with keyset pagination
+
+        Args:
+            limit: Maximum number of loans to return
+            cursor: Opaque cursor from a previous page ('<borrowed_at ISO>|<id>')
+            member_id: Only loans to this member
+            book_id: Only loans of this book
+            open_only: Only loans not yet returned
+            start_date: Only loans borrowed at or after this time
+            end_date: Only loans borrowed before this time
+
+        Each filter combination is a range scan on one loan index: member
+        history, book history or borrowed_at.
+        """
+        session = self._get_session()
+        try:
+            query = session.query(Loan)
+            if member_id:
+                query = query.filter(Loan.member_id == member_id)
+            if book_id:
+                query = query.filter(Loan.book_id == book_id)
+            if open_only:
+                query = query.filter(Loan.returned_at.is_(None))
+            if start_date:
+                query = query.filter(Loan.borrowed_at >= start_date)
+            if end_date:
+                query = query.filter(Loan.borrowed_at < end_date)
+            if cursor:
+                cursor_date, cursor_id = self._parse_cursor(cursor)
+                query = query.filter(tuple_(Loan.borrowed_at, Loan.id) < tuple_(cursor_date, cursor_id))
+
+            loans = query.order_by(desc(Loan.borrowed_at), desc(Loan.id)).limit(limit + 1).all()
+
+            result = [DatabaseHelper.sqlalchemy_to_dict(loan) for loan in loans[:limit]]
+            has_more = len(loans) > limit
+            next_cursor = self._make_cursor(loans[limit - 1].borrowed_at, loans[limit - 1].id) if result and has_more else None
+            return result, next_cursor, has_more
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def list_overdue_loans(self, limit: int, cursor: Optional[str],
+                           as_of: datetime) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """List open loans due before ``as_of``, longest overdue first, with keyset pagination
+
+        Pages are ordered by (due_at, id) and read from the open-loan due-date
+        partial index, so each page is a range scan over open loans only and
+        its cost does not grow with loan history or page depth.
+        """
+        session = self._get_session()
+        try:
+            query = session.query(Loan).filter(Loan.returned_at.is_(None), Loan.due_at < as_of)
+            if cursor:
+                cursor_date, cursor_id = self._parse_cursor(cursor)
+                query = query.filter(tuple_(Loan.due_at, Loan.id) > tuple_(cursor_date, cursor_id))
+
+            loans = query.order_by(Loan.due_at, Loan.id).limit(limit + 1).all()
+
+            result = [DatabaseHelper.sqlalchemy_to_dict(loan) for loan in loans[:limit]]
+            has_more = len(loans) > limit
+            next_cursor = self._make_cursor(loans[limit - 1].due_at, loans[limit - 1].id) if result and has_more else None
+            return result, next_cursor, has_more
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def get_book_id_range(self) -> Tuple[int, int]:
+        """Return (lowest, highest) book ID, or (0, 0) when there are no books"""
+        session = self._get_session()
+        try:
+            low, high = session.query(func.min(Book.id), func.max(Book.id)).one()
+            return low or 0, high or 0
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
+    def backfill_book_range(self, start_id: int, end_id: int) -> int:
+        """Build loans from the ledger for books with start_id <= id < end_id
+
+        The range's book rows are share-locked first, so no borrow/return of
+        those books can commit between reading the ledger and inserting the
+        loans. Safe to re-run. Returns the number of loans inserted.
+        """
+        session = self._get_session()
+        try:
+            session.query(Book.id).filter(Book.id >= start_id, Book.id < end_id).with_for_update(read=True).all()
+            inserted = session.execute(BACKFILL_SQL, {
+                'start_id': start_id, 'end_id': end_id, 'loan_period_days': Config.LOAN_PERIOD_DAYS
+            }).rowcount
+            session.commit()
+            return inserted
+        except SQLAlchemyError as e:
+            self._rollback_on_error(session, e)
+        finally:
+            session.close()
+
+    @staticmethod
+    def _make_cursor(timestamp: datetime, loan_id: int) -> str:
+        return f"{timestamp.isoformat()}|{loan_id}"
+
+    @staticmethod
+    def _parse_cursor(cursor: str) -> Tuple[datetime, int]:
+        try:
+            timestamp, loan_id = cursor.rsplit('|', 1)
+            return datetime.fromisoformat(timestamp), int(loan_id)
+        except ValueError:
+            raise ValueError("Invalid cursor")
@@ -1,20 +1,28 @@
-from typing import List, Optional, Tuple, Dict, Any
-from sqlalchemy import or_
+from typing import List, Optional, Tuple, Dict, Any, Iterable
+from sqlalchemy import or_, any_, bindparam, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from db_helper import Member, DatabaseHelper
 from .base_repository import BaseRepository
+from .change_log_repository import ChangeLogRepository
 
 
 class MemberRepository(BaseRepository):
     """Repository for Member entity operations"""
 
+    def __init__(self):
+        super().__init__()
+        self._changes = ChangeLogRepository()
+
     def create_member(self, name: str, email: str) -> Dict[str, Any]:
         """Create a new member"""
         session = self._get_session()
         try:
             member = Member(name=name, email=email)
             session.add(member)
+            session.flush()
+            self._changes.record(session, 'member', member.id, 'create', DatabaseHelper.sqlalchemy_to_dict(member))
             return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, member))
         except IntegrityError:
             self._rollback_on_error(session, ValueError("Email already exists"))
@@ -33,6 +41,9 @@ class MemberRepository(BaseRepository):
             member.name = name
             member.email = email
             member.updated_at = member.updated_at  # Trigger onupdate
+            session.flush()
+            self._changes.record(session, 'member', member_id, 'update',
+                                 {'name': name, 'email': email, 'updated_at': member.updated_at})
             return DatabaseHelper.sqlalchemy_to_dict(self._commit_and_refresh(session, member))
         except IntegrityError:
             self._rollback_on_error(session, ValueError("Email already exists"))
@@ -52,6 +63,25 @@ class MemberRepository(BaseRepository):
         finally:
             session.close()
 
+    def get_members_by_ids(self, member_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """Get several members in one query, keyed by member ID
+
+        Missing IDs are simply absent from the returned mapping.
+        """
+        ids = list(dict.fromkeys(member_ids))
+        if not ids:
+            return {}
+        session = self._get_session()
+        try:
+            members = session.query(Member).filter(
+                Member.id == any_(bindparam('ids', value=ids, type_=ARRAY(Integer)))
+            ).all()
+            return {member.id: DatabaseHelper.sqlalchemy_to_dict(member) for member in members}
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
+
     def list_members(self) -> List[Dict[str, Any]]:
         """List all members"""
         session = self._get_session()
@@ -0,0 +1,126 @@
+from datetime import datetime
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from db_helper import RelatedBooks, engine
+from .base_repository import BaseRepository
+
+WATERMARK = 'book_cooccurrence'
+
+NEW_PAIRS_SQL = """
+    SELECT DISTINCT member_id, book_id FROM ledger
+    WHERE action_type = 'BORROW' AND id > %(low)s AND id <= %(high)s
+"""
+
+# Books the batch's members had borrowed before it; an index-only scan on
+# idx_ledger_member_history per member
+OLD_PAIRS_SQL = """
+    SELECT DISTINCT member_id, book_id FROM ledger
+    WHERE member_id = ANY(%(members)s) AND action_type = 'BORROW' AND id <= %(low)s
+"""
+
+UPSERT_SQL = """
+    INSERT INTO book_cooccurrence (book_id, related_book_id, members)
+    SELECT book_id, related_book_id, members FROM cooccurrence_staging
+    ON CONFLICT (book_id, related_book_id) DO UPDATE SET
+        members = book_cooccurrence.members + EXCLUDED.members
+"""
+
+# Re-rank only the books whose co-occurrence row changed in this batch
+TOP_K_SQL = """
+    INSERT INTO related_books (book_id, related_ids, members, computed_at)
+    SELECT book_id,
+           array_agg(related_book_id ORDER BY members DESC, related_book_id),
+           array_agg(members ORDER BY members DESC, related_book_id),
+           %(computed_at)s
+    FROM (
+        SELECT book_id, related_book_id, members,
+               row_number() OVER (PARTITION BY book_id ORDER BY members DESC, related_book_id) AS rank
+        FROM book_cooccurrence
+        WHERE book_id IN (SELECT DISTINCT book_id FROM cooccurrence_staging)
+    ) ranked
+    WHERE rank <= %(top_k)s
+    GROUP BY book_id
+    ON CONFLICT (book_id) DO UPDATE SET
+        related_ids = EXCLUDED.related_ids,
+        members = EXCLUDED.members,
+        computed_at = EXCLUDED.computed_at
+"""
+
+
+class RelatedBooksRepository(BaseRepository):
+    """"Also borrowed" co-occurrence counts and their per-book top K
+
+    ``fold_next_batch`` works like the circulation rollups: a watermark on
+    ledger.id (in rollup_watermark) and the co-occurrence increments for the
+    next id range commit in one transaction, so runs are resumable and never
+    count a borrow twice. Reads are a single primary-key row per book.
+    """
+
+    def fold_next_batch(self, batch_size: int, safe_before: datetime, top_k: int,
+                        count_pairs: Callable[[List[Tuple[int, int]], List[Tuple[int, int]]], Optional[BinaryIO]]
+                        ) -> Optional[Tuple[int, int]]:
+        """Fold the BORROWs in the next ``batch_size`` ledger ids logged before ``safe_before``
+
+        ``count_pairs(new, old)`` gets the batch's distinct (member id, book
+        id) borrows and the same members' earlier ones, and returns a COPY
+        binary payload of (book id, related book id, members) increments, or
+        None when there are none. Returns the (low, high] id range folded, an
+        empty range when caught up, or None when another run holds the
+        watermark.
+        """
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("INSERT INTO rollup_watermark (name, last_id) VALUES (%(name)s, 0) "
+                           "ON CONFLICT (name) DO NOTHING", {'name': WATERMARK})
+            cursor.execute("SELECT last_id FROM rollup_watermark WHERE name = %(name)s FOR UPDATE SKIP LOCKED",
+                           {'name': WATERMARK})
+            row = cursor.fetchone()
+            if row is None:
+                connection.rollback()
+                return None
+            low = row[0]
+            cursor.execute("SELECT id FROM ledger WHERE log_date < %(safe_before)s "
+                           "ORDER BY log_date DESC, id DESC LIMIT 1", {'safe_before': safe_before})
+            upper = cursor.fetchone()
+            high = min(low + batch_size, upper[0] if upper else 0)
+            if high <= low:
+                connection.commit()
+                return low, low
+
+            cursor.execute(NEW_PAIRS_SQL, {'low': low, 'high': high})
+            new_pairs = cursor.fetchall()
+            members = sorted({member_id for member_id, _ in new_pairs})
+            cursor.execute(OLD_PAIRS_SQL, {'members': members, 'low': low})
+            payload = count_pairs(new_pairs, cursor.fetchall())
+            if payload is not None:
+                cursor.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS cooccurrence_staging "
+                    "(book_id INTEGER, related_book_id INTEGER, members INTEGER) ON COMMIT DELETE ROWS"
+                )
+                cursor.copy_expert("COPY cooccurrence_staging (book_id, related_book_id, members) "
+                                   "FROM STDIN WITH (FORMAT binary)", payload)
+                cursor.execute(UPSERT_SQL)
+                cursor.execute(TOP_K_SQL, {'computed_at': datetime.utcnow(), 'top_k': top_k})
+            cursor.execute("UPDATE rollup_watermark SET last_id = %(high)s WHERE name = %(name)s",
+                           {'high': high, 'name': WATERMARK})
+            connection.commit()
+            return low, high
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def get_related(self, book_id: int) -> List[Tuple[int, int]]:
+        """Return (related book id, shared members) for a book, most shared first"""
+        session = self._get_session()
+        try:
+            row = session.query(RelatedBooks).filter(RelatedBooks.book_id == book_id).first()
+            return list(zip(row.related_ids, row.members)) if row else []
+        except SQLAlchemyError as e:
+            raise e
+        finally:
+            session.close()
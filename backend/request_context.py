@@ -0,0 +1,152 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from psycopg2.errors import QueryCanceled
+from sqlalchemy import event
+
+from db_helper import SessionLocal, engine
+from logger import logger
+from metrics import registry
+
+skipped_total = registry.counter(
+    'library_rpc_db_work_skipped_total', 'Database sessions not opened because their RPC had expired or was cancelled')
+statements_cancelled_total = registry.counter(
+    'library_rpc_statements_cancelled_total', 'SQL statements stopped by an RPC deadline or cancellation')
+rpcs_cancelled_total = registry.counter(
+    'library_rpcs_cancelled_total', 'RPCs cancelled by the client while the server was still handling them')
+
+
+class RequestAborted(Exception):
+    """Raised instead of doing (or finishing) database work for an RPC nobody is waiting for"""
+
+
+class DeadlineExceeded(RequestAborted):
+    """The RPC's deadline passed"""
+
+
+class RequestCancelled(RequestAborted):
+    """The client cancelled the RPC"""
+
+
+class RequestScope:
+    """Deadline and cancellation state of the RPC being handled on this thread
+
+    Every transaction begun for the RPC gets ``SET LOCAL statement_timeout``
+    set to the time left, and the connections it uses are tracked so
+    ``cancel`` can stop their in-flight statements.
+    """
+
+    def __init__(self, time_remaining: Optional[float] = None):
+        self.deadline = None if time_remaining is None else time.monotonic() + time_remaining
+        self.cancelled = False
+        self.finished = False
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one"""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self) -> None:
+        """Raise RequestCancelled or DeadlineExceeded if the RPC is no longer wanted"""
+        if self.cancelled:
+            raise RequestCancelled("Request was cancelled by the client")
+        if self.expired():
+            raise DeadlineExceeded("Request deadline exceeded")
+
+    def on_terminated(self) -> None:
+        """gRPC termination callback: cancel the work if the handler is still running"""
+        if not self.finished:
+            rpcs_cancelled_total.inc()
+            self.cancel()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.cancel()
+            except Exception as e:
+                logger.warning(f"Could not cancel statement of a cancelled request: {str(e)}")
+
+    def track(self, connection) -> None:
+        with self._lock:
+            self._connections.add(connection)
+
+    def untrack(self, connection) -> None:
+        with self._lock:
+            self._connections.discard(connection)
+
+
+_current_scope: ContextVar[Optional[RequestScope]] = ContextVar('request_scope', default=None)
+
+
+def current_scope() -> Optional[RequestScope]:
+    return _current_scope.get()
+
+
+@contextmanager
+def request_scope(context) -> Iterator[RequestScope]:
+    """Bind a RequestScope for the gRPC ``context`` to the current thread while the handler runs"""
+    scope = RequestScope(context.time_remaining())
+    context.add_callback(scope.on_terminated)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        scope.finished = True
+        _current_scope.reset(token)
+
+
+def check_deadline(stage: str = 'session') -> None:
+    """Raise RequestAborted if the current RPC expired or was cancelled (no-op outside an RPC)"""
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    try:
+        scope.check()
+    except RequestAborted as e:
+        skipped_total.inc(reason='cancelled' if isinstance(e, RequestCancelled) else 'deadline', stage=stage)
+        raise
+
+
+@event.listens_for(SessionLocal, 'after_begin')
+def _set_statement_timeout(session, transaction, connection) -> None:
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    check_deadline('transaction')
+    scope.track(connection.connection.dbapi_connection)
+    remaining = scope.remaining()
+    if remaining is not None:
+        # 0 would disable the timeout, so always allow at least 1ms
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(remaining * 1000), 1)}")
+
+
+@event.listens_for(engine, 'checkin')
+def _untrack_connection(dbapi_connection, connection_record) -> None:
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.untrack(dbapi_connection)
+
+
+@event.listens_for(engine, 'handle_error')
+def _translate_cancelled_statement(exception_context) -> None:
+    """Report statements stopped for an expired or cancelled RPC as RequestAborted, not a database error"""
+    scope = _current_scope.get()
+    if scope is None or not isinstance(exception_context.original_exception, QueryCanceled):
+        return
+    if scope.cancelled:
+        statements_cancelled_total.inc(reason='cancelled')
+        raise RequestCancelled("Request was cancelled by the client") from exception_context.original_exception
+    if scope.deadline is not None:
+        statements_cancelled_total.inc(reason='deadline')
+        raise DeadlineExceeded("Request deadline exceeded") from exception_context.original_exception
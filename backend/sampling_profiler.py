@@ -0,0 +1,216 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from config import Config
+from logger import logger
+from metrics import registry
+
+samples_total = registry.counter(
+    'library_profiler_samples_total', 'Stacks sampled by the in-process profiler, by RPC method')
+sampling_seconds_total = registry.counter(
+    'library_profiler_seconds_total', 'CPU time the in-process profiler spent taking samples')
+
+# Thread ident -> RPC method it is handling, maintained by ProfilingInterceptor
+_rpc_threads: Dict[int, str] = {}
+
+
+@contextmanager
+def rpc_method(method: str) -> Iterator[None]:
+    """Attribute the current thread's samples to ``method`` while the block runs"""
+    ident = threading.get_ident()
+    _rpc_threads[ident] = method
+    try:
+        yield
+    finally:
+        _rpc_threads.pop(ident, None)
+
+
+def rpc_threads() -> Dict[int, str]:
+    """Thread ident -> RPC method, for the threads handling an RPC right now"""
+    return dict(_rpc_threads)
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Collapsed stacks ('frame;frame;frame count' per line), as read by flamegraph.pl and speedscope"""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()) if count > 0)
+
+
+class SamplingProfiler:
+    """Samples the stacks of threads handling RPCs and aggregates them per method
+
+    A daemon thread reads ``sys._current_frames()`` about ``hz`` times a
+    second and counts each RPC thread's stack as '<method>;<root frame>;...
+    ;<leaf frame>'. To keep the cost bounded in production, the wait between
+    samples stretches so that sampling (measured as the sampler thread's CPU
+    time) never takes more than ``max_overhead`` of one core. Past
+    ``max_stacks`` distinct stacks, new ones are counted as '<method>;(other)'.
+    """
+
+    def __init__(self, hz: float = Config.PROFILER_SAMPLE_HZ, max_depth: int = Config.PROFILER_MAX_DEPTH,
+                 max_overhead: float = Config.PROFILER_MAX_OVERHEAD, max_stacks: int = Config.PROFILER_MAX_STACKS):
+        self.hz = hz
+        self.max_depth = max_depth
+        self.max_overhead = max_overhead
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._stop: Optional[threading.Event] = None
+        self._sample_seconds = 0.0
+        self._started_at: Optional[float] = None
+        # Captures in progress, and whether the first of them started the sampler
+        self._capture_lock = threading.Lock()
+        self._captures = 0
+        self._capture_started = False
+
+    @property
+    def running(self) -> bool:
+        return self._stop is not None and not self._stop.is_set()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # co_qualname is new in Python 3.11
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+        return label
+
+    def _collapse(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        return ';'.join(labels)
+
+    def sample(self) -> int:
+        """Take one sample of every thread handling an RPC; returns the number of threads sampled"""
+        start = time.thread_time()
+        frames = sys._current_frames()
+        sampled = []
+        for ident, method in list(_rpc_threads.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                sampled.append((method, self._collapse(frame)))
+        del frames
+        with self._lock:
+            for method, stack in sampled:
+                key = f"{method};{stack}"
+                if key not in self._stacks and len(self._stacks) >= self.max_stacks:
+                    key = f"{method};(other)"
+                self._stacks[key] += 1
+        elapsed = time.thread_time() - start
+        self._sample_seconds += elapsed
+        sampling_seconds_total.inc(elapsed)
+        for method, _ in sampled:
+            samples_total.inc(method=method)
+        return len(sampled)
+
+    def next_interval(self, sample_seconds: float) -> float:
+        """Wait before the next sample: 1/hz, stretched so sampling stays within max_overhead"""
+        interval = 1.0 / self.hz
+        if self.max_overhead > 0:
+            interval = max(interval, sample_seconds / self.max_overhead - sample_seconds)
+        return interval
+
+    def overhead(self) -> float:
+        """Sampler CPU time as a share of wall time since the profiler was started"""
+        if self._started_at is None:
+            return 0.0
+        return self._sample_seconds / max(time.monotonic() - self._started_at, 1e-9)
+
+    def start(self) -> threading.Event:
+        """Sample from a daemon thread until the returned event is set"""
+        if self.running:
+            return self._stop
+        stop = self._stop = threading.Event()
+        self._started_at = time.monotonic()
+        self._sample_seconds = 0.0
+
+        def run():
+            while not stop.is_set():
+                start = time.thread_time()
+                try:
+                    self.sample()
+                except Exception as e:
+                    logger.error(f"Profiler sample failed: {str(e)}")
+                stop.wait(self.next_interval(time.thread_time() - start))
+
+        threading.Thread(target=run, name='sampling-profiler', daemon=True).start()
+        logger.info(f"Sampling profiler started at {self.hz} Hz (max overhead {self.max_overhead:.1%})")
+        return stop
+
+    def stop(self) -> None:
+        if self._stop is not None:
+            self._stop.set()
+
+    def snapshot(self, method: Optional[str] = None) -> Counter:
+        """Aggregated stack counts since start, optionally for one RPC method only"""
+        with self._lock:
+            stacks = Counter(self._stacks)
+        if method is not None:
+            prefix = f"{method};"
+            stacks = Counter({stack: count for stack, count in stacks.items() if stack.startswith(prefix)})
+        return stacks
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+
+    def capture(self, duration: float, method: Optional[str] = None) -> str:
+        """Collapsed stacks sampled over the next ``duration`` seconds
+
+        Uses the running sampler when the profiler is enabled, otherwise
+        samples until the last of the overlapping captures ends.
+        """
+        with self._capture_lock:
+            if self._captures == 0:
+                self._capture_started = not self.running
+                if self._capture_started:
+                    self.start()
+            self._captures += 1
+        before = self.snapshot(method)
+        try:
+            time.sleep(duration)
+        finally:
+            with self._capture_lock:
+                self._captures -= 1
+                if self._captures == 0 and self._capture_started:
+                    self._capture_started = False
+                    self.stop()
+        stacks = self.snapshot(method)
+        stacks.subtract(before)
+        return render_collapsed(stacks)
+
+    def capture_to_file(self, duration: float = Config.PROFILER_CAPTURE_SECONDS,
+                        directory: str = Config.PROFILER_DIR) -> str:
+        """Capture for ``duration`` seconds into '<directory>/profile-<UTC time>.collapsed'; returns the path"""
+        collapsed = self.capture(duration)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"profile-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}.collapsed")
+        with open(path, 'w') as file:
+            file.write(collapsed)
+        logger.info(f"Profile of {duration}s written to {path} ({len(collapsed.splitlines())} stacks, "
+                    f"sampling overhead {self.overhead():.2%})")
+        return path
+
+    def capture_in_background(self, duration: float = Config.PROFILER_CAPTURE_SECONDS) -> threading.Thread:
+        """capture_to_file from a daemon thread (for signal handlers, which must not block)"""
+        def run():
+            try:
+                self.capture_to_file(duration)
+            except Exception as e:
+                logger.error(f"Profile capture failed: {str(e)}")
+
+        thread = threading.Thread(target=run, name='profile-capture', daemon=True)
+        thread.start()
+        return thread
+
+
+# Process-wide profiler; sampling continuously only when PROFILER_ENABLED
+profiler = SamplingProfiler()
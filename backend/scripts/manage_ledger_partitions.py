@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Ledger partition maintenance.
+
+The backend creates partitions ahead of time on startup and hourly, so this
+is for operators: inspecting partitions, pre-creating a longer window, or
+archiving old months on demand.
+
+Usage:
+  python scripts/manage_ledger_partitions.py list
+  python scripts/manage_ledger_partitions.py ensure [--months-ahead 3] [--from 2023-01-01]
+  python scripts/manage_ledger_partitions.py archive --before 2024-01-01
+Run from backend/ with the DB environment variables set (or a .env file).
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from repositories import LedgerPartitionRepository  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='List attached partitions')
+    ensure = commands.add_parser('ensure', help='Create missing monthly partitions')
+    ensure.add_argument('--months-ahead', type=int, default=Config.LEDGER_PARTITION_MONTHS_AHEAD)
+    ensure.add_argument('--from', dest='from_date', type=date.fromisoformat, default=None)
+    archive = commands.add_parser('archive', help='Detach partitions ending on or before a date')
+    archive.add_argument('--before', type=date.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    repository = LedgerPartitionRepository()
+    if args.command == 'list':
+        for name in repository.list_partitions():
+            print(name)
+    elif args.command == 'ensure':
+        created = repository.ensure_partitions(args.months_ahead, from_date=args.from_date)
+        print(f"Created {len(created)} partitions: {', '.join(created) or '-'}")
+    elif args.command == 'archive':
+        archived = repository.archive_partitions_before(args.before)
+        print(f"Archived {len(archived)} partitions: {', '.join(archived) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
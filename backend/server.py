@@ -1,21 +1,48 @@
 import json
+import signal
+import time
 from concurrent import futures
 from datetime import datetime
 
 import grpc
 from dotenv import load_dotenv
-from google.protobuf.json_format import ParseDict
+from google.protobuf import json_format
 from google.protobuf.timestamp_pb2 import Timestamp
 
 import book_pb2
+import change_pb2
 import ledger_pb2
+import health_pb2_grpc
 import library_pb2_grpc
 import member_pb2
 from services import BookService, MemberService, LibraryService
+from repositories import (ChangeLogExpired, ChangeLogRepository, ConcurrencyConflict, IdempotencyRepository,
+                          LedgerPartitionRepository, TooManyWatchers, availability_index)
 from error_codes import ErrorCodes
 from messages import Messages
 from logger import logger
 from config import Config
+from diagnostics import start_admin_server
+from health import HealthGrpcService, HealthMonitor, start_drain
+from metrics import start_http_exporter
+from jobs import LedgerRollupJob
+from interceptors import (DeadlineInterceptor, ProfilingInterceptor, QueryBudgetInterceptor, RateLimitInterceptor,
+                          TracingInterceptor)
+from rate_limiter import rate_limiter
+from request_context import RequestAborted
+from sampling_profiler import profiler
+from startup import check_schema_version, prewarm_pool, readiness
+from tracing import timed_calls
+
+# Time spent converting rows to protobuf is accumulated on the RPC's span when traced
+ParseDict = timed_calls('parse_dict')(json_format.ParseDict)
+
+ROLLUP_DIMENSIONS = {
+    ledger_pb2.RollupDimension.ROLLUP_DIMENSION_UNSPECIFIED: 'all',
+    ledger_pb2.RollupDimension.ROLLUP_ALL: 'all',
+    ledger_pb2.RollupDimension.ROLLUP_AUTHOR: 'author',
+    ledger_pb2.RollupDimension.ROLLUP_MEMBER_COHORT: 'cohort',
+}
 
 load_dotenv()
 
@@ -41,6 +68,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
             return book_pb2.CreateBookResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} CreateBook operation failed: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -65,6 +94,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
             return book_pb2.UpdateBookResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} UpdateBook operation failed for ID {request.id}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -91,6 +122,13 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 books_proto.append(book)
             logger.info(f"ListBooks operation successful, returned {len(books_proto)} books, has_more: {has_more}")
             return book_pb2.ListBooksResponse(books=books_proto, next_cursor=next_cursor or '', has_more=has_more)
+        except ValueError as e:
+            logger.warning(f"ListBooks validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return book_pb2.ListBooksResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} ListBooks operation failed: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -113,6 +151,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
             # Convert ListBooksResponse to ListRecentBooksResponse
             logger.info(f"ListRecentBooks operation successful, returned {len(list_response.books)} books")
             return book_pb2.ListRecentBooksResponse(books=list_response.books)
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} ListRecentBooks operation failed: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -138,12 +178,147 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
             # Convert ListBooksResponse to SearchBooksResponse
             logger.info(f"SearchBooks operation successful, found {len(list_response.books)} books")
             return book_pb2.SearchBooksResponse(books=list_response.books)
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} SearchBooks operation failed for query '{request.query}': {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return book_pb2.SearchBooksResponse()
 
+    def BatchGetBooks(self, request, context):
+        """Get several books by ID with a single query"""
+        logger.info(f"BatchGetBooks operation started for {len(request.ids)} ids")
+        try:
+            ids = list(request.ids)
+            books = self._book_service.get_books_by_ids(ids)
+            results = []
+            for book_id, row in zip(ids, books):
+                result = book_pb2.BookResult(id=book_id, found=row is not None)
+                if row is not None:
+                    ParseDict(row, result.book, ignore_unknown_fields=True)
+                results.append(result)
+            logger.info(f"BatchGetBooks operation successful, found {sum(1 for r in results if r.found)} of {len(ids)} books")
+            return book_pb2.BatchGetBooksResponse(results=results)
+        except ValueError as e:
+            logger.warning(f"BatchGetBooks validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return book_pb2.BatchGetBooksResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} BatchGetBooks operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return book_pb2.BatchGetBooksResponse()
+
+    def GetBookCounts(self, request, context):
+        """Get total, available and borrowed book counts"""
+        logger.info("GetBookCounts operation started")
+        try:
+            counts = self._book_service.get_book_counts()
+            logger.info(f"GetBookCounts operation successful: {counts}")
+            return book_pb2.GetBookCountsResponse(**counts)
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} GetBookCounts operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return book_pb2.GetBookCountsResponse()
+
+    def GetCatalogStats(self, request, context):
+        """Get catalog-wide statistics from the maintained summary counters"""
+        logger.info(f"GetCatalogStats operation started with author_limit: {request.author_limit}")
+        try:
+            stats = self._book_service.get_catalog_stats(request.author_limit if request.author_limit > 0 else 20)
+            response = book_pb2.GetCatalogStatsResponse()
+            ParseDict(stats, response)
+            logger.info(f"GetCatalogStats operation successful: {stats['total_books']} books, "
+                        f"{stats['active_borrowers']} active borrowers")
+            return response
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} GetCatalogStats operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            return book_pb2.GetCatalogStatsResponse()
+
+    def GetRelatedBooks(self, request, context):
+        """Get books also borrowed by members who borrowed this one"""
+        logger.info(f"GetRelatedBooks operation started for book ID: {request.book_id}, limit: {request.limit}")
+        try:
+            related = self._book_service.get_related_books(request.book_id, request.limit if request.limit > 0 else 10)
+            response = book_pb2.GetRelatedBooksResponse()
+            ParseDict({'books': related}, response, ignore_unknown_fields=True)
+            logger.info(f"GetRelatedBooks operation successful, returned {len(response.books)} books")
+            return response
+        except ValueError as e:
+            logger.warning(f"GetRelatedBooks validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return book_pb2.GetRelatedBooksResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} GetRelatedBooks operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return book_pb2.GetRelatedBooksResponse()
+
+    def WatchBooks(self, request, context):
+        """Stream book availability changes as they commit, resumable from a change log seq"""
+        logger.info(f"WatchBooks stream started with since_seq: {request.since_seq}")
+        try:
+            subscription = self._book_service.watch_books(request.since_seq)
+        except ChangeLogExpired as e:
+            logger.warning(f"WatchBooks expired since_seq {request.since_seq}: {str(e)}")
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(json.dumps({"code": ErrorCodes.CHANGES_EXPIRED, "message": str(e)}))
+            return
+        except TooManyWatchers as e:
+            logger.warning(f"WatchBooks rejected: {str(e)}")
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(json.dumps({"code": ErrorCodes.TOO_MANY_WATCHERS, "message": str(e)}))
+            return
+        except ValueError as e:
+            logger.warning(f"WatchBooks validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} WatchBooks operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return
+
+        context.add_callback(subscription.close)
+        sent = 0
+        try:
+            for row in subscription:
+                event = book_pb2.BookAvailabilityEvent()
+                ParseDict(row, event, ignore_unknown_fields=True)
+                sent += 1
+                yield event
+            if subscription.dropped:
+                logger.warning(f"WatchBooks stream dropped after {sent} events: consumer too slow")
+                context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+                context.set_details(json.dumps({"code": ErrorCodes.WATCH_TOO_SLOW,
+                                                "message": "Stream fell too far behind; reconnect with the last seq received"}))
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} WatchBooks stream failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+        finally:
+            subscription.close()
+            logger.info(f"WatchBooks stream ended after {sent} events")
+
     def CreateMember(self, request, context):
         """Create a new member"""
         logger.info(f"CreateMember operation started for name: {request.name}, email: {request.email}")
@@ -163,6 +338,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                 context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
             return member_pb2.CreateMemberResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} CreateMember operation failed for {request.name}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -186,6 +363,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 members_proto.append(member)
             logger.info(f"ListMembers operation successful, returned {len(members_proto)} members, has_more: {has_more}")
             return member_pb2.ListMembersResponse(members=members_proto, next_cursor=next_cursor or '', has_more=has_more)
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} ListMembers operation failed: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -204,12 +383,41 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 members.append(member)
             logger.info(f"SearchMembers operation successful, found {len(members)} members")
             return member_pb2.SearchMembersResponse(members=members)
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} SearchMembers operation failed for query '{request.query}': {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return member_pb2.SearchMembersResponse()
 
+    def BatchGetMembers(self, request, context):
+        """Get several members by ID with a single query"""
+        logger.info(f"BatchGetMembers operation started for {len(request.ids)} ids")
+        try:
+            ids = list(request.ids)
+            members = self._member_service.get_members_by_ids(ids)
+            results = []
+            for member_id, row in zip(ids, members):
+                result = member_pb2.MemberResult(id=member_id, found=row is not None)
+                if row is not None:
+                    ParseDict(row, result.member, ignore_unknown_fields=True)
+                results.append(result)
+            logger.info(f"BatchGetMembers operation successful, found {sum(1 for r in results if r.found)} of {len(ids)} members")
+            return member_pb2.BatchGetMembersResponse(results=results)
+        except ValueError as e:
+            logger.warning(f"BatchGetMembers validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return member_pb2.BatchGetMembersResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} BatchGetMembers operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return member_pb2.BatchGetMembersResponse()
+
     def UpdateMember(self, request, context):
         """Update an existing member"""
         logger.info(f"UpdateMember operation started for member ID: {request.id}, name: {request.name}, email: {request.email}")
@@ -234,6 +442,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                 context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
             return member_pb2.UpdateMemberResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} UpdateMember operation failed for ID {request.id}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -245,7 +455,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
         logger.info(f"BorrowBook operation started for book ID: {request.book_id}, member ID: {request.member_id}")
         try:
             # Borrow the book using the library service
-            result = self._library_service.borrow_book(request.book_id, request.member_id)
+            result = self._library_service.borrow_book(request.book_id, request.member_id,
+                                                       idempotency_key=request.idempotency_key or None)
 
             # Convert result to protobuf format
             ledger_entry = ledger_pb2.LedgerEntry()
@@ -270,10 +481,19 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 ledger_entry=ledger_entry,
                 message=Messages.BOOK_BORROWED
             )
+        except ConcurrencyConflict as e:
+            logger.warning(f"BorrowBook: Book {request.book_id} is contended, giving up after retries: {str(e)}")
+            context.set_code(grpc.StatusCode.ABORTED)
+            context.set_details(json.dumps({"code": ErrorCodes.CONCURRENT_MODIFICATION, "message": "Book is being modified concurrently, please retry"}))
+            return ledger_pb2.BorrowBookResponse()
         except ValueError as e:
             error_msg = str(e)
             # Handle specific business logic errors
-            if "already borrowed" in error_msg.lower() or "not available" in error_msg.lower():
+            if "idempotency key was already used" in error_msg.lower():
+                logger.warning("BorrowBook: Idempotency key reused for a different request")
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(json.dumps({"code": ErrorCodes.IDEMPOTENCY_KEY_REUSED, "message": error_msg}))
+            elif "already borrowed" in error_msg.lower() or "not available" in error_msg.lower():
                 logger.warning(f"BorrowBook: Book {request.book_id} is not available")
                 context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
                 context.set_details(json.dumps({"code": ErrorCodes.BOOK_ALREADY_BORROWED, "message": error_msg}))
@@ -295,6 +515,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                 context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": error_msg}))
             return ledger_pb2.BorrowBookResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} BorrowBook operation failed for book {request.book_id}, member {request.member_id}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -306,7 +528,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
         logger.info(f"ReturnBook operation started for book ID: {request.book_id}, member ID: {request.member_id}")
         try:
             # Return the book using the library service
-            result = self._library_service.return_book(request.book_id, request.member_id)
+            result = self._library_service.return_book(request.book_id, request.member_id,
+                                                       idempotency_key=request.idempotency_key or None)
 
             # Convert result to protobuf format
             ledger_entry = ledger_pb2.LedgerEntry()
@@ -332,10 +555,19 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 ledger_entry=ledger_entry,
                 message=Messages.BOOK_RETURNED
             )
+        except ConcurrencyConflict as e:
+            logger.warning(f"ReturnBook: Book {request.book_id} is contended, giving up after retries: {str(e)}")
+            context.set_code(grpc.StatusCode.ABORTED)
+            context.set_details(json.dumps({"code": ErrorCodes.CONCURRENT_MODIFICATION, "message": "Book is being modified concurrently, please retry"}))
+            return ledger_pb2.ReturnBookResponse()
         except ValueError as e:
             error_msg = str(e)
             # Handle specific business logic errors
-            if "not currently borrowed" in error_msg.lower() or "not borrowed" in error_msg.lower():
+            if "idempotency key was already used" in error_msg.lower():
+                logger.warning("ReturnBook: Idempotency key reused for a different request")
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(json.dumps({"code": ErrorCodes.IDEMPOTENCY_KEY_REUSED, "message": error_msg}))
+            elif "not currently borrowed" in error_msg.lower() or "not borrowed" in error_msg.lower():
                 logger.warning(f"ReturnBook: Book {request.book_id} is not currently borrowed")
                 context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
                 context.set_details(json.dumps({"code": ErrorCodes.BOOK_NOT_BORROWED, "message": error_msg}))
@@ -357,6 +589,8 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
                 context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": error_msg}))
             return ledger_pb2.ReturnBookResponse()
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} ReturnBook operation failed for book {request.book_id}, member {request.member_id}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
@@ -375,32 +609,219 @@ class LibraryGrpcService(library_pb2_grpc.LibraryServiceServicer):
                 books.append(book)
             logger.info(f"ListBorrowedBooks operation successful, returned {len(books)} books for member {request.member_id}")
             return ledger_pb2.ListBorrowedBooksResponse(books=books)
+        except RequestAborted:
+            raise
         except Exception as e:
             logger.error(f"{Config.ERROR_KEYWORD} ListBorrowedBooks operation failed for member {request.member_id}: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             return ledger_pb2.ListBorrowedBooksResponse()
 
+    def ListLedger(self, request, context):
+        """List ledger history with filters and keyset pagination"""
+        logger.info(f"ListLedger operation started with limit: {request.limit}, cursor: {request.cursor}, member_id: {request.member_id}, book_id: {request.book_id}, action_type: {request.action_type}")
+        try:
+            action_type = ledger_pb2.ActionType.Name(request.action_type) if request.action_type else None
+            entries, next_cursor, has_more = self._library_service.list_ledger_entries(
+                limit=request.limit if request.limit > 0 else 50,
+                cursor=request.cursor or None,
+                member_id=request.member_id or None,
+                book_id=request.book_id or None,
+                action_type=action_type,
+                start_date=request.start_date.ToDatetime() if request.HasField('start_date') else None,
+                end_date=request.end_date.ToDatetime() if request.HasField('end_date') else None
+            )
+            entries_proto = []
+            for row in entries:
+                entry = ledger_pb2.LedgerEntry()
+                ParseDict(row, entry, ignore_unknown_fields=True)
+                entries_proto.append(entry)
+            logger.info(f"ListLedger operation successful, returned {len(entries_proto)} entries, has_more: {has_more}")
+            return ledger_pb2.ListLedgerResponse(entries=entries_proto, next_cursor=next_cursor or '', has_more=has_more)
+        except ValueError as e:
+            logger.warning(f"ListLedger validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return ledger_pb2.ListLedgerResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} ListLedger operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return ledger_pb2.ListLedgerResponse()
+
+    def ListOverdueLoans(self, request, context):
+        """List open loans past their due date with keyset pagination"""
+        logger.info(f"ListOverdueLoans operation started with limit: {request.limit}, cursor: {request.cursor}")
+        try:
+            loans, next_cursor, has_more = self._library_service.list_overdue_loans(
+                limit=request.limit if request.limit > 0 else 50,
+                cursor=request.cursor or None,
+                as_of=request.as_of.ToDatetime() if request.HasField('as_of') else None
+            )
+            loans_proto = []
+            for row in loans:
+                loan = ledger_pb2.Loan()
+                ParseDict(row, loan, ignore_unknown_fields=True)
+                loans_proto.append(loan)
+            logger.info(f"ListOverdueLoans operation successful, returned {len(loans_proto)} loans, has_more: {has_more}")
+            return ledger_pb2.ListOverdueLoansResponse(loans=loans_proto, next_cursor=next_cursor or '', has_more=has_more)
+        except ValueError as e:
+            logger.warning(f"ListOverdueLoans validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return ledger_pb2.ListOverdueLoansResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} ListOverdueLoans operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return ledger_pb2.ListOverdueLoansResponse()
+
+    def GetCirculationRollup(self, request, context):
+        """Daily borrows/returns from the ledger rollups, per library, author or member cohort"""
+        logger.info(f"GetCirculationRollup operation started with dimension: {request.dimension}, dimension_key: {request.dimension_key}")
+        try:
+            dimension = ROLLUP_DIMENSIONS.get(request.dimension)
+            if dimension is None:
+                raise ValueError("Unknown rollup dimension")
+            days, truncated = self._library_service.get_circulation_rollup(
+                dimension=dimension,
+                dimension_key=request.dimension_key or None,
+                start_date=request.start_date.ToDatetime().date() if request.HasField('start_date') else None,
+                end_date=request.end_date.ToDatetime().date() if request.HasField('end_date') else None
+            )
+            days_proto = []
+            for row in days:
+                day = ledger_pb2.DailyCirculation()
+                ParseDict(row, day, ignore_unknown_fields=True)
+                days_proto.append(day)
+            logger.info(f"GetCirculationRollup operation successful, returned {len(days_proto)} days, truncated: {truncated}")
+            return ledger_pb2.GetCirculationRollupResponse(days=days_proto, truncated=truncated)
+        except ValueError as e:
+            logger.warning(f"GetCirculationRollup validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return ledger_pb2.GetCirculationRollupResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} GetCirculationRollup operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return ledger_pb2.GetCirculationRollupResponse()
+
+    def ListChanges(self, request, context):
+        """List book, member and loan changes after a sequence number for incremental sync"""
+        logger.info(f"ListChanges operation started with since_seq: {request.since_seq}, limit: {request.limit}")
+        try:
+            changes, next_seq, has_more = self._library_service.list_changes(
+                since_seq=request.since_seq,
+                limit=request.limit if request.limit > 0 else 100
+            )
+            changes_proto = []
+            for row in changes:
+                change = change_pb2.Change()
+                ParseDict(dict(row, data=json.dumps(row['data'])), change, ignore_unknown_fields=True)
+                changes_proto.append(change)
+            logger.info(f"ListChanges operation successful, returned {len(changes_proto)} changes, next_seq: {next_seq}")
+            return change_pb2.ListChangesResponse(changes=changes_proto, next_seq=next_seq, has_more=has_more)
+        except ChangeLogExpired as e:
+            logger.warning(f"ListChanges expired since_seq {request.since_seq}: {str(e)}")
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details(json.dumps({"code": ErrorCodes.CHANGES_EXPIRED, "message": str(e)}))
+            return change_pb2.ListChangesResponse()
+        except ValueError as e:
+            logger.warning(f"ListChanges validation error: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(json.dumps({"code": ErrorCodes.INVALID_INPUT, "message": str(e)}))
+            return change_pb2.ListChangesResponse()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            logger.error(f"{Config.ERROR_KEYWORD} ListChanges operation failed: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(json.dumps({"code": "INTERNAL_ERROR", "message": "An internal error occurred"}))
+            return change_pb2.ListChangesResponse()
+
 
 def serve():
     """Start the gRPC server"""
-    # Create tables if not exist
+    readiness.record('imports', time.monotonic() - readiness.started_at)
+    Config.validate()
     from db_helper import engine, Base
-    Base.metadata.create_all(bind=engine)
-
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    with readiness.phase('schema'):
+        if Config.SCHEMA_CHECK == 'create_all':
+            Base.metadata.create_all(bind=engine)
+        else:
+            check_schema_version(engine)
+
+    with readiness.phase('pool_prewarm'):
+        prewarm_pool(Config.POOL_PREWARM_CONNECTIONS, engine)
+
+    partitions = LedgerPartitionRepository()
+    with readiness.phase('partitions'):
+        partitions.ensure_partitions(Config.LEDGER_PARTITION_MONTHS_AHEAD)
+    partitions.start_maintenance(Config.LEDGER_PARTITION_CHECK_SECONDS, Config.LEDGER_PARTITION_MONTHS_AHEAD,
+                                 Config.LEDGER_RETENTION_MONTHS)
+
+    ChangeLogRepository().start_pruning(Config.CHANGE_LOG_PRUNE_SECONDS, Config.CHANGE_LOG_RETENTION_HOURS)
+
+    if Config.IDEMPOTENCY_GC_SECONDS:
+        IdempotencyRepository().start_gc(Config.IDEMPOTENCY_GC_SECONDS, Config.IDEMPOTENCY_TTL_HOURS,
+                                         Config.IDEMPOTENCY_GC_BATCH_SIZE)
+
+    if Config.ROLLUP_INTERVAL_SECONDS:
+        LedgerRollupJob().start(Config.ROLLUP_INTERVAL_SECONDS)
+
+    if Config.AVAILABILITY_INDEX_ENABLED:
+        # Loaded in the background: lookups fall back to the database until it is
+        availability_index.start_reconciler(Config.AVAILABILITY_RECONCILE_SECONDS, load_first=True)
+
+    if Config.METRICS_PORT:
+        start_http_exporter(Config.METRICS_PORT)
+
+    # Rate limits are hot-reloadable: edit .env (or the environment) and send SIGHUP. A value
+    # that does not parse is logged and the current limits are kept
+    signal.signal(signal.SIGHUP, lambda signum, frame: rate_limiter.reload())
+
+    if Config.PROFILER_ENABLED:
+        profiler.start()
+    # SIGUSR2 writes PROFILER_CAPTURE_SECONDS of collapsed stacks to PROFILER_DIR
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.capture_in_background())
+
+    executor = futures.ThreadPoolExecutor(max_workers=Config.SERVER_MAX_WORKERS)
+    server = grpc.server(executor,
+                         interceptors=[TracingInterceptor(), RateLimitInterceptor(), ProfilingInterceptor(),
+                                       QueryBudgetInterceptor(), DeadlineInterceptor()])
     library_pb2_grpc.add_LibraryServiceServicer_to_server(LibraryGrpcService(), server)
+    health = HealthMonitor(executor)
+    health_pb2_grpc.add_HealthServicer_to_server(HealthGrpcService(health), server)
+    health.start()
 
     port = Config.SERVER_PORT
     server.add_insecure_port('[::]:' + port)
     server.start()
     logger.info(f"Library gRPC server started, listening on port {port}")
 
+    # Kept referenced for the life of the process: a grpc.Server that is garbage collected stops serving
+    admin_server = start_admin_server(Config.ADMIN_PORT, executor) if Config.ADMIN_PORT else None
+
+    readiness.mark_ready()
+    health.refresh()
+
+    # SIGTERM (rolling restarts): report NOT_SERVING, let load balancers move away, then stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: start_drain(health, server, admin_server=admin_server))
+
     try:
         server.wait_for_termination()
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
         server.stop(0)
+        if admin_server is not None:
+            admin_server.stop(0)
 
 
 if __name__ == '__main__':
@@ -2,10 +2,12 @@ from .base_service import BaseService
 from .book_service import BookService
 from .member_service import MemberService
 from .library_service import LibraryService
+from .due_date_policy import DueDatePolicy
 
 __all__ = [
     'BaseService',
     'BookService',
     'MemberService',
-    'LibraryService'
+    'LibraryService',
+    'DueDatePolicy'
 ]
\ No newline at end of file
@@ -1,11 +1,20 @@
 from abc import ABC
-from typing import Optional
+from typing import List, Optional
 
+from config import Config
 from db_helper import Book, Member
+from tracing import trace_public_methods
 
 
 class BaseService(ABC):
-    """Base service class providing common validation methods"""
+    """Base service class providing common validation methods
+
+    Public methods of subclasses are traced as '<class>.<method>' spans.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        trace_public_methods(cls)
 
     @staticmethod
     def validate_book_data(title: str, author: str) -> None:
@@ -15,4 +24,10 @@ class BaseService(ABC):
     @staticmethod
     def validate_member_data(name: str, email: str) -> None:
         """Validate member data"""
-        Member.validate_data(name, email)
\ No newline at end of file
+        Member.validate_data(name, email)
+
+    @staticmethod
+    def validate_batch_ids(ids: List[int]) -> None:
+        """Validate the size of a batch lookup"""
+        if len(ids) > Config.BATCH_GET_MAX_IDS:
+            raise ValueError(f"At most {Config.BATCH_GET_MAX_IDS} ids can be requested at once")
\ No newline at end of file
@@ -1,6 +1,8 @@
 from typing import List, Optional, Tuple, Dict, Any
 
-from repositories import BookRepository
+from config import Config
+from repositories import (BookRepository, CatalogStatsRepository, RelatedBooksRepository, WatchSubscription,
+                          book_watch_hub)
 from .base_service import BaseService
 
 
@@ -9,6 +11,8 @@ class BookService(BaseService):
 
     def __init__(self):
         self._book_repository = BookRepository()
+        self._stats_repository = CatalogStatsRepository()
+        self._related_repository = RelatedBooksRepository()
 
     def create_book(self, title: str, author: str) -> Dict[str, Any]:
         """Create a new book with validation"""
@@ -24,6 +28,12 @@ class BookService(BaseService):
         """Get a book by ID"""
         return self._book_repository.get_book_by_id(book_id)
 
+    def get_books_by_ids(self, book_ids: List[int]) -> List[Optional[Dict[str, Any]]]:
+        """Get books in request order, with None for IDs that do not exist"""
+        self.validate_batch_ids(book_ids)
+        found = self._book_repository.get_books_by_ids(list(dict.fromkeys(book_ids)))
+        return [found.get(book_id) for book_id in book_ids]
+
     def list_books(self) -> List[Dict[str, Any]]:
         """List all books"""
         return self._book_repository.list_books()
@@ -46,6 +56,46 @@ class BookService(BaseService):
         """Check if a book is available"""
         return self._book_repository.is_book_available(book_id)
 
+    def get_book_counts(self) -> Dict[str, int]:
+        """Get total, available and borrowed book counts"""
+        total, borrowed = self._book_repository.count_books_by_status()
+        return {'total': total, 'available': total - borrowed, 'borrowed': borrowed}
+
+    def get_catalog_stats(self, author_limit: int = 20) -> Dict[str, Any]:
+        """Get catalog-wide counts and the authors with the most books"""
+        author_limit = min(max(author_limit, 0), Config.CATALOG_STATS_AUTHORS_MAX)
+        stats = self._stats_repository.get_stats(author_limit)
+        return {
+            'total_books': stats['total_books'],
+            'available_books': stats['total_books'] - stats['borrowed_books'],
+            'borrowed_books': stats['borrowed_books'],
+            'active_borrowers': stats['active_borrowers'],
+            'top_authors': stats['top_authors'],
+        }
+
+    def get_related_books(self, book_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get books most often borrowed by members who also borrowed this one
+
+        Reads the precomputed top K (see jobs.related_books), so the cost does
+        not depend on how often the book was borrowed.
+        """
+        if book_id <= 0:
+            raise ValueError("Book ID is required")
+        related = self._related_repository.get_related(book_id)[:min(max(limit, 1), Config.RELATED_BOOKS_TOP_K)]
+        books = self._book_repository.get_books_by_ids([related_id for related_id, _ in related])
+        return [{'book': books[related_id], 'members': members}
+                for related_id, members in related if related_id in books]
+
+    def watch_books(self, since_seq: int = 0) -> WatchSubscription:
+        """Subscribe to book availability changes after ``since_seq`` (0 for changes from now on)
+
+        Iterate the returned subscription for events and close it when the
+        client goes away.
+        """
+        if since_seq < 0:
+            raise ValueError("Since sequence cannot be negative")
+        return book_watch_hub.subscribe(since_seq)
+
     def list_borrowed_books(self, member_id: int) -> List[Dict[str, Any]]:
         """List books borrowed by a member"""
         return self._book_repository.list_borrowed_books(member_id)
\ No newline at end of file
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from config import Config
+
+
+class DueDatePolicy:
+    """Computes when a new loan is due
+
+    A loan runs ``loan_period_days`` from the moment it is borrowed. With
+    ``due_end_of_day`` the due date is pushed to the last second of that UTC
+    day, so a book never becomes overdue partway through the day it is due.
+    """
+
+    def __init__(self, loan_period_days: int = Config.LOAN_PERIOD_DAYS,
+                 due_end_of_day: bool = Config.LOAN_DUE_END_OF_DAY):
+        if loan_period_days < 1:
+            raise ValueError("Loan period must be at least one day")
+        self.loan_period_days = loan_period_days
+        self.due_end_of_day = due_end_of_day
+
+    def due_date(self, borrowed_at: datetime) -> datetime:
+        """Due date for a loan borrowed at ``borrowed_at`` (naive UTC)"""
+        due = borrowed_at + timedelta(days=self.loan_period_days)
+        if self.due_end_of_day:
+            due = due.replace(hour=23, minute=59, second=59, microsecond=0)
+        return due
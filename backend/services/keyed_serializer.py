@@ -0,0 +1,67 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterator, Optional
+
+from repositories import ConcurrencyConflict
+
+
+class KeySlot:
+    """Per-key queue state shared by every caller waiting on the same key"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = 0
+        # Set by a successful borrow, cleared by a return. Only lives while
+        # callers are queued on the key, so it never outlasts the contention.
+        self.borrowed = False
+
+
+class KeyedSerializer:
+    """Serializes operations on the same key within this process
+
+    Callers for different keys never block each other. Callers for the same key
+    run one at a time, in lock-acquisition order, and can inspect the state the
+    previous holder left on the shared ``KeySlot``. Slots are dropped as soon as
+    the last caller leaves, so memory is bounded by the number of keys with
+    in-flight operations.
+    """
+
+    def __init__(self, max_waiters: int = 0):
+        self._max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._slots: Dict[Hashable, KeySlot] = {}
+
+    @contextmanager
+    def hold(self, key: Hashable, check: Optional[Callable[[KeySlot], None]] = None) -> Iterator[KeySlot]:
+        """Run the body exclusively for ``key``
+
+        ``check`` is called with the slot before waiting and again once the
+        slot is held; it may raise to reject the caller without waiting or
+        touching the database. Raises ConcurrencyConflict when ``max_waiters``
+        callers are already queued on the key.
+        """
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = KeySlot()
+            elif self._max_waiters and slot.waiters >= self._max_waiters:
+                raise ConcurrencyConflict(f"Too many pending operations for {key}")
+            slot.waiters += 1
+        try:
+            if check:
+                check(slot)
+            with slot.lock:
+                if check:
+                    check(slot)
+                yield slot
+        finally:
+            with self._lock:
+                slot.waiters -= 1
+                if slot.waiters == 0:
+                    del self._slots[key]
+
+    def pending(self, key: Hashable) -> int:
+        """Number of callers holding or waiting on ``key``"""
+        with self._lock:
+            slot = self._slots.get(key)
+            return slot.waiters if slot else 0
@@ -1,56 +1,173 @@
-from typing import Dict, Any
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 
-from repositories import BookRepository, MemberRepository, LedgerRepository
+from repositories import (BookRepository, MemberRepository, LedgerRepository, LoanRepository,
+                          LedgerRollupRepository, ChangeLogRepository, IdempotencyRepository)
 from error_codes import ErrorCodes
+from config import Config
+from metrics import registry
+from .keyed_serializer import KeyedSerializer, KeySlot
+from .base_service import BaseService
+from .due_date_policy import DueDatePolicy
 
+hot_key_rejections_total = registry.counter(
+    'library_hot_key_rejections_total', 'Borrows rejected in-process because a queued borrow of the book just succeeded')
+idempotent_replays_total = registry.counter(
+    'library_idempotent_replays_total', 'Borrow/return retries answered with the ledger entry of the original call')
 
-class LibraryService:
+
+class LibraryService(BaseService):
     """Service for library operations (borrowing/returning books)"""
 
     def __init__(self):
         self._book_repository = BookRepository()
         self._member_repository = MemberRepository()
         self._ledger_repository = LedgerRepository()
+        self._loan_repository = LoanRepository()
+        self._rollup_repository = LedgerRollupRepository()
+        self._change_log_repository = ChangeLogRepository()
+        self._idempotency_repository = IdempotencyRepository()
+        self._due_date_policy = DueDatePolicy()
+        # Borrow/return calls for the same book run one at a time in this
+        # process, so a rush on one title queues here instead of on the row lock
+        self._book_queue = KeyedSerializer(max_waiters=Config.HOT_KEY_MAX_WAITERS)
 
-    def borrow_book(self, book_id: int, member_id: int) -> Dict[str, Any]:
-        """Borrow a book for a member"""
-        # Validate that the book exists and is available
-        if not self._book_repository.is_book_available(book_id):
-            raise ValueError("Book is not available")
-
-        # Validate that the member exists
-        if not self._member_repository.member_exists(member_id):
-            raise ValueError("Member not found")
-
-        # Perform the borrow operation
-        self._book_repository.borrow_book(book_id, member_id)
-
-        # Create ledger entry
-        ledger_entry = self._ledger_repository.create_ledger_entry(
-            book_id=book_id,
-            member_id=member_id,
-            action_type='BORROW',
-            due_date_snapshot=datetime.utcnow()  # You can add logic for due date calculation
-        )
+    @staticmethod
+    def _reject_if_just_borrowed(slot: KeySlot) -> None:
+        if slot.borrowed:
+            hot_key_rejections_total.inc()
+            raise ValueError("Book is already borrowed")
+
+    def _replay(self, idempotency_key: Optional[str], operation: str, book_id: int,
+                member_id: int) -> Optional[Dict[str, Any]]:
+        """Ledger entry already produced for ``idempotency_key``, or None to run the call
+
+        Raises ValueError when the key belongs to a different call.
+        """
+        if not idempotency_key:
+            return None
+        stored = self._idempotency_repository.lookup(idempotency_key)
+        if stored is None:
+            return None
+        if (stored['operation'], stored['book_id'], stored['member_id']) != (operation, book_id, member_id):
+            raise ValueError("Idempotency key was already used for another request")
+        idempotent_replays_total.inc()
+        return stored['ledger_entry']
+
+    @staticmethod
+    def _validate_idempotency_key(idempotency_key: Optional[str]) -> None:
+        if idempotency_key and len(idempotency_key) > Config.IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValueError(f"Idempotency key must be at most {Config.IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    def borrow_book(self, book_id: int, member_id: int, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Borrow a book for a member
+
+        A retry carrying the ``idempotency_key`` of a committed borrow returns
+        that borrow's ledger entry without queueing or locking the book.
+        """
+        self._validate_idempotency_key(idempotency_key)
+        replayed = self._replay(idempotency_key, 'borrow', book_id, member_id)
+        if replayed is not None:
+            return replayed
+
+        try:
+            with self._book_queue.hold(book_id, check=self._reject_if_just_borrowed) as slot:
+                # Validate that the book exists and is available
+                if not self._book_repository.is_book_available(book_id):
+                    raise ValueError("Book is not available")
+
+                # Validate that the member exists
+                if not self._member_repository.member_exists(member_id):
+                    raise ValueError("Member not found")
+
+                # Perform the borrow; the ledger entry, loan and key are written in the same transaction
+                ledger_entry = self._book_repository.borrow_book(
+                    book_id, member_id,
+                    due_date=self._due_date_policy.due_date(datetime.utcnow()),
+                    idempotency_key=idempotency_key
+                )
+                slot.borrowed = True
+        except ValueError:
+            # A concurrent retry of the same call may have committed first
+            replayed = self._replay(idempotency_key, 'borrow', book_id, member_id)
+            if replayed is not None:
+                return replayed
+            raise
 
         return ledger_entry
 
-    def return_book(self, book_id: int, member_id: int) -> Dict[str, Any]:
-        """Return a book from a member"""
-        # Validate that the book is borrowed by this member
-        if not self._book_repository.is_book_borrowed_by_member(book_id, member_id):
-            raise ValueError("Book is not borrowed by this member")
-
-        # Perform the return operation
-        self._book_repository.return_book(book_id, member_id)
-
-        # Create ledger entry
-        ledger_entry = self._ledger_repository.create_ledger_entry(
-            book_id=book_id,
-            member_id=member_id,
-            action_type='RETURN',
-            due_date_snapshot=None
+    def return_book(self, book_id: int, member_id: int, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Return a book from a member
+
+        A retry carrying the ``idempotency_key`` of a committed return returns
+        that return's ledger entry without queueing or locking the book.
+        """
+        self._validate_idempotency_key(idempotency_key)
+        replayed = self._replay(idempotency_key, 'return', book_id, member_id)
+        if replayed is not None:
+            return replayed
+
+        try:
+            with self._book_queue.hold(book_id) as slot:
+                # Validate that the book is borrowed by this member
+                if not self._book_repository.is_book_borrowed_by_member(book_id, member_id):
+                    raise ValueError("Book is not borrowed by this member")
+
+                # Perform the return; the ledger entry, loan and key are written in the same transaction
+                ledger_entry = self._book_repository.return_book(book_id, member_id, idempotency_key=idempotency_key)
+                slot.borrowed = False
+        except ValueError:
+            # A concurrent retry of the same call may have committed first
+            replayed = self._replay(idempotency_key, 'return', book_id, member_id)
+            if replayed is not None:
+                return replayed
+            raise
+
+        return ledger_entry
+
+    def list_ledger_entries(self, limit: int = 50, cursor: Optional[str] = None,
+                            member_id: Optional[int] = None, book_id: Optional[int] = None,
+                            action_type: Optional[str] = None, start_date: Optional[datetime] = None,
+                            end_date: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """List ledger history with filters and keyset pagination"""
+        if action_type and action_type not in ('BORROW', 'RETURN'):
+            raise ValueError("Action type must be BORROW or RETURN")
+        if start_date and end_date and start_date >= end_date:
+            raise ValueError("Start date must be before end date")
+        limit = min(max(limit, 1), Config.LEDGER_PAGE_MAX)
+        return self._ledger_repository.list_entries(
+            limit, cursor, member_id, book_id, action_type, start_date, end_date
         )
 
-        return ledger_entry
\ No newline at end of file
+    def list_overdue_loans(self, limit: int = 50, cursor: Optional[str] = None,
+                           as_of: Optional[datetime] = None) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """List open loans past their due date, longest overdue first"""
+        limit = min(max(limit, 1), Config.LEDGER_PAGE_MAX)
+        return self._loan_repository.list_overdue_loans(limit, cursor, as_of or datetime.utcnow())
+
+    def get_circulation_rollup(self, dimension: str = 'all', dimension_key: Optional[str] = None,
+                               start_date: Optional[date] = None,
+                               end_date: Optional[date] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """Daily borrows/returns for start_date <= day < end_date from the rollups
+
+        Defaults to the 30 days up to and including today. Returns the rows
+        and whether more than ROLLUP_QUERY_MAX_ROWS matched.
+        """
+        if dimension not in ('all', 'author', 'cohort'):
+            raise ValueError("Dimension must be all, author or cohort")
+        end_date = end_date or datetime.utcnow().date() + timedelta(days=1)
+        start_date = start_date or end_date - timedelta(days=30)
+        if start_date >= end_date:
+            raise ValueError("Start date must be before end date")
+        if dimension == 'all':
+            dimension_key = ''
+        limit = Config.ROLLUP_QUERY_MAX_ROWS
+        rows = self._rollup_repository.list_rollups(dimension, dimension_key, start_date, end_date, limit + 1)
+        return rows[:limit], len(rows) > limit
+
+    def list_changes(self, since_seq: int = 0, limit: int = 100) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """List book, member and loan changes after ``since_seq`` for incremental sync"""
+        if since_seq < 0:
+            raise ValueError("Since sequence cannot be negative")
+        limit = min(max(limit, 1), Config.CHANGE_LOG_PAGE_MAX)
+        return self._change_log_repository.list_changes(since_seq, limit)
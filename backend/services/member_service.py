@@ -24,6 +24,12 @@ class MemberService(BaseService):
         """Get a member by ID"""
         return self._member_repository.get_member_by_id(member_id)
 
+    def get_members_by_ids(self, member_ids: List[int]) -> List[Optional[Dict[str, Any]]]:
+        """Get members in request order, with None for IDs that do not exist"""
+        self.validate_batch_ids(member_ids)
+        found = self._member_repository.get_members_by_ids(list(dict.fromkeys(member_ids)))
+        return [found.get(member_id) for member_id in member_ids]
+
     def list_members(self) -> List[Dict[str, Any]]:
         """List all members"""
         return self._member_repository.list_members()
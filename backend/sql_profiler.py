@@ -0,0 +1,179 @@
+import json
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from config import Config
+from logger import logger, slow_query_logger
+from metrics import registry
+
+statements_total = registry.counter(
+    'library_rpc_sql_statements_total', 'SQL statements executed, by RPC method')
+statement_seconds_total = registry.counter(
+    'library_rpc_sql_seconds_total', 'Time spent executing SQL statements, by RPC method')
+slow_queries_total = registry.counter(
+    'library_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS')
+budget_exceeded_total = registry.counter(
+    'library_rpc_query_budget_exceeded_total', 'RPCs that issued more SQL statements than their query budget')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = r"\s*(?:%\(\w+\)s|%s|\?)\s*"
+_PARAMETER_LIST = re.compile(rf"\((?:{_PARAMETER},)+{_PARAMETER}\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """Statement with literals replaced by ? and parameter lists collapsed, on one line
+
+    Statements that differ only in their values (or in the length of an IN
+    list) normalize to the same text, so they can be counted together.
+    """
+    sql = _STRING.sub('?', statement)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PARAMETER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _value_shape(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def bind_shape(parameters: Any, executemany: bool = False) -> Any:
+    """Types (and list lengths) of a statement's bind parameters, without their values"""
+    if executemany and isinstance(parameters, (list, tuple)):
+        return {'rows': len(parameters), 'row': bind_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: _value_shape(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_value_shape(value) for value in parameters]
+    return None
+
+
+class QueryStats:
+    """SQL statements issued on behalf of one RPC (or one profiled block)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.statements = 0
+        self.transactions = 0
+        self.seconds = 0.0
+        self.by_statement: Counter = Counter()
+
+    def most_repeated(self, n: int = 3) -> List[Tuple[str, int]]:
+        return self.by_statement.most_common(n)
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+@contextmanager
+def profile_queries(name: str) -> Iterator[QueryStats]:
+    """Count the statements, transactions and SQL time of the block (on this thread)"""
+    stats = QueryStats(name)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def parse_query_budgets(spec: str) -> Dict[str, int]:
+    """Parse '<method>:<statements>' pairs, e.g. 'BorrowBook:20,ListBooks:3'"""
+    budgets = {}
+    for pair in filter(None, (part.strip() for part in spec.split(','))):
+        method, _, statements = pair.partition(':')
+        try:
+            budgets[method.strip()] = int(statements)
+        except ValueError:
+            raise ValueError(f"Invalid query budget: {pair!r}")
+    return budgets
+
+
+# QUERY_BUDGETS and its parsed form; parsed on import, so a bad value stops the server from
+# starting, and again only if the setting is replaced
+_budgets: Tuple[str, Dict[str, int]] = (Config.QUERY_BUDGETS, parse_query_budgets(Config.QUERY_BUDGETS))
+
+
+def query_budget(method: str) -> int:
+    global _budgets
+    spec, budgets = _budgets
+    if spec != Config.QUERY_BUDGETS:
+        budgets = parse_query_budgets(Config.QUERY_BUDGETS)
+        _budgets = (Config.QUERY_BUDGETS, budgets)
+    return budgets.get(method, Config.QUERY_BUDGET_DEFAULT)
+
+
+def check_budget(stats: QueryStats) -> bool:
+    """Record an RPC's statements in the metrics; log and count it if it went over budget"""
+    statements_total.inc(stats.statements, method=stats.name)
+    statement_seconds_total.inc(stats.seconds, method=stats.name)
+    budget = query_budget(stats.name)
+    if stats.statements <= budget:
+        return True
+    budget_exceeded_total.inc(method=stats.name)
+    repeated = '; '.join(f"{count}x {sql[:120]}" for sql, count in stats.most_repeated())
+    logger.warning(f"{stats.name} issued {stats.statements} SQL statements in {stats.transactions} transactions "
+                   f"(budget {budget}, {stats.seconds * 1000:.1f}ms); most repeated: {repeated}")
+    return False
+
+
+@contextmanager
+def assert_max_queries(limit: int, name: str = 'block') -> Iterator[QueryStats]:
+    """Test helper: fail if the block issues more than ``limit`` SQL statements"""
+    with profile_queries(name) as stats:
+        yield stats
+    assert stats.statements <= limit, (
+        f"{name} issued {stats.statements} SQL statements (limit {limit}); most repeated: {stats.most_repeated()}"
+    )
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._profile_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    start = getattr(context, '_profile_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = _current_stats.get()
+    normalized = None
+    if stats is not None:
+        normalized = normalize_sql(statement)
+        stats.statements += 1
+        stats.seconds += elapsed
+        stats.by_statement[normalized] += 1
+    if Config.SLOW_QUERY_MS and elapsed * 1000 >= Config.SLOW_QUERY_MS:
+        slow_queries_total.inc()
+        slow_query_logger.info(json.dumps({
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'rpc': stats.name if stats else None,
+            'duration_ms': round(elapsed * 1000, 1),
+            'sql': normalized or normalize_sql(statement),
+            'binds': bind_shape(parameters, executemany),
+            'rows': cursor.rowcount,
+        }))
+
+
+@event.listens_for(Session, 'after_begin')
+def _count_transaction(session, transaction, connection) -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.transactions += 1
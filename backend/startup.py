@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from concurrent import futures
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from db_helper import SCHEMA_VERSION, engine as default_engine
+from logger import logger
+
+
+class SchemaVersionMismatch(RuntimeError):
+    """The database has not been migrated as far as this server needs"""
+
+
+def check_schema_version(engine=default_engine, expected: int = SCHEMA_VERSION) -> int:
+    """Verify the database is migrated to ``expected`` with one query; returns its version
+
+    A newer database is accepted (migrations are additive, so a rolling
+    deploy may briefly run old servers against it).
+    """
+    with engine.connect() as connection:
+        try:
+            version = connection.execute(text("SELECT max(version) FROM schema_version")).scalar()
+        except ProgrammingError:
+            raise SchemaVersionMismatch(
+                f"Table schema_version is missing; apply migrations/ up to {expected:03d} "
+                f"(or start with SCHEMA_CHECK=create_all on a throwaway database)"
+            )
+    if version is None or version < expected:
+        raise SchemaVersionMismatch(f"Database schema is at version {version}, this server needs {expected}; "
+                                    f"apply the missing migrations/")
+    if version > expected:
+        logger.info(f"Database schema is at version {version}, ahead of this server's {expected}")
+    return version
+
+
+def prewarm_pool(count: int, engine=default_engine) -> int:
+    """Open up to ``count`` pool connections in parallel and return them to the pool
+
+    Connections are held until all are open so each one is new rather than
+    the same connection checked out again. Returns the number opened; a
+    failed connection is logged and skipped.
+    """
+    if hasattr(engine.pool, 'size'):
+        count = min(count, engine.pool.size())
+    if count <= 0:
+        return 0
+    with futures.ThreadPoolExecutor(max_workers=count, thread_name_prefix='pool-prewarm') as executor:
+        pending = [executor.submit(engine.connect) for _ in range(count)]
+    connections = []
+    for future in pending:
+        try:
+            connections.append(future.result())
+        except Exception as e:
+            logger.warning(f"Pool prewarm connection failed: {str(e)}")
+    for connection in connections:
+        connection.close()
+    return len(connections)
+
+
+def process_started_at() -> float:
+    """time.monotonic() reading for when this process started, so startup time includes imports
+
+    Read from /proc (Linux); elsewhere it falls back to now.
+    """
+    try:
+        with open('/proc/self/stat') as file:
+            # Fields after the parenthesised command name; starttime is field 22
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+        return time.monotonic() - age
+    except (AttributeError, OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+class Readiness:
+    """Startup phase timings and whether the server is warm enough to take traffic"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = process_started_at() if started_at is None else started_at
+        self.phases: Dict[str, float] = {}
+        self._ready = threading.Event()
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a startup step under ``name``"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def mark_ready(self) -> float:
+        """Flag the server ready and log how long startup took; returns the seconds since start"""
+        elapsed = time.monotonic() - self.started_at
+        self._ready.set()
+        phases = ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        logger.info(f"Ready to serve {elapsed:.2f}s after start ({phases})")
+        return elapsed
+
+
+# Process-wide startup state
+readiness = Readiness()
@@ -1,12 +1,16 @@
 import pytest
 from sqlalchemy.orm import sessionmaker
-from db_helper import engine, Base, SessionLocal, Ledger, Book, Member
+from datetime import datetime, timedelta
+from db_helper import engine, Base, SessionLocal, Ledger, Loan, Fine, Book, Member, CatalogStat, AuthorStat, LedgerDailyRollup, RollupWatermark, BookCooccurrence, RelatedBooks, ChangeLog, IdempotencyKey
+from repositories import LedgerPartitionRepository, idempotency_cache
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_database():
     """Setup test database"""
     # Create tables
     Base.metadata.create_all(bind=engine)
+    # ledger is partitioned by month; cover the last year so seeded history fits
+    LedgerPartitionRepository().ensure_partitions(1, from_date=datetime.utcnow().date() - timedelta(days=365))
     yield
     # Drop tables after all tests
     Base.metadata.drop_all(bind=engine)
@@ -24,7 +28,18 @@ def db_session():
 def clean_database(db_session):
     """Clean all tables before each test"""
     # Delete in order to respect foreign key constraints
+    db_session.query(Fine).delete()
+    db_session.query(Loan).delete()
     db_session.query(Ledger).delete()
     db_session.query(Book).delete()
     db_session.query(Member).delete()
-    db_session.commit()
\ No newline at end of file
+    db_session.query(CatalogStat).delete()
+    db_session.query(AuthorStat).delete()
+    db_session.query(LedgerDailyRollup).delete()
+    db_session.query(RollupWatermark).delete()
+    db_session.query(BookCooccurrence).delete()
+    db_session.query(RelatedBooks).delete()
+    db_session.query(ChangeLog).delete()
+    db_session.query(IdempotencyKey).delete()
+    db_session.commit()
+    idempotency_cache.clear()
\ No newline at end of file
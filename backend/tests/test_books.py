@@ -1,7 +1,15 @@
 import pytest
 from server import LibraryGrpcService
 import book_pb2
+import member_pb2
+import ledger_pb2
 import grpc
+import threading
+import change_pb2
+from sqlalchemy import text
+from db_helper import SessionLocal
+from jobs import CatalogStatsRepairJob, BorrowCountBackfillJob, RelatedBooksJob
+from sql_profiler import assert_max_queries
 
 class MockContext:
     def __init__(self):
@@ -14,6 +22,14 @@ class MockContext:
     def set_details(self, details):
         self.details = details
 
+class StreamContext(MockContext):
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
 class TestBooks:
     def test_create_book_success(self, clean_database):
         """Test creating a book successfully"""
@@ -107,4 +123,213 @@ class TestBooks:
         assert len(search_response.books) == 2
         titles = [book.title for book in search_response.books]
         assert "Python Guide" in titles
-        assert "Advanced Python" in titles
\ No newline at end of file
+        assert "Advanced Python" in titles
+
+    def test_batch_get_books(self, clean_database):
+        """Test fetching several books by ID in request order"""
+        service = LibraryGrpcService()
+
+        book_ids = []
+        for title, author in [("Book 1", "Author 1"), ("Book 2", "Author 2")]:
+            request = book_pb2.CreateBookRequest(title=title, author=author)
+            book_ids.append(service.CreateBook(request, MockContext()).book.id)
+
+        missing_id = max(book_ids) + 1000
+        request = book_pb2.BatchGetBooksRequest(ids=[book_ids[1], missing_id, book_ids[0]])
+        context = MockContext()
+        response = service.BatchGetBooks(request, context)
+
+        assert context.code is None
+        assert [result.id for result in response.results] == [book_ids[1], missing_id, book_ids[0]]
+        assert [result.found for result in response.results] == [True, False, True]
+        assert response.results[0].book.title == "Book 2"
+        assert response.results[2].book.title == "Book 1"
+
+    def test_get_book_counts(self, clean_database):
+        """Test total/available/borrowed book counts"""
+        service = LibraryGrpcService()
+
+        for title in ["Book 1", "Book 2", "Book 3"]:
+            service.CreateBook(book_pb2.CreateBookRequest(title=title, author="Author"), MockContext())
+
+        context = MockContext()
+        response = service.GetBookCounts(book_pb2.GetBookCountsRequest(), context)
+
+        assert context.code is None
+        assert response.total == 3
+        assert response.available == 3
+        assert response.borrowed == 0
+
+    def test_get_catalog_stats(self, clean_database):
+        """Test catalog stats follow creates, author changes, borrows and returns"""
+        service = LibraryGrpcService()
+        book_ids = [service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author=author), MockContext()).book.id
+                    for i, author in enumerate(["Author A", "Author A", "Author B"])]
+        service.UpdateBook(book_pb2.UpdateBookRequest(id=book_ids[1], title="Book 1", author="Author C"), MockContext())
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        for book_id in book_ids[:2]:
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        context = MockContext()
+        response = service.GetCatalogStats(book_pb2.GetCatalogStatsRequest(), context)
+
+        assert context.code is None
+        assert (response.total_books, response.available_books, response.borrowed_books) == (3, 1, 2)
+        assert response.active_borrowers == 1
+        assert sorted((a.author, a.book_count) for a in response.top_authors) == [
+            ("Author A", 1), ("Author B", 1), ("Author C", 1)]
+
+        for book_id in book_ids[:2]:
+            service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        response = service.GetCatalogStats(book_pb2.GetCatalogStatsRequest(author_limit=1), MockContext())
+        assert (response.borrowed_books, response.active_borrowers) == (0, 0)
+        assert len(response.top_authors) == 1
+
+    def test_catalog_stats_repair_reports_drift(self, clean_database):
+        """Test the repair job finds and corrects stats changed behind the repositories' back"""
+        service = LibraryGrpcService()
+        for title in ["Book 1", "Book 2"]:
+            service.CreateBook(book_pb2.CreateBookRequest(title=title, author="Author"), MockContext())
+        session = SessionLocal()
+        try:
+            session.execute(text("INSERT INTO book (title, author, is_borrowed) VALUES ('Imported', 'Author', FALSE)"))
+            session.commit()
+        finally:
+            session.close()
+
+        assert CatalogStatsRepairJob().run(apply=False) == {'total_books': (2, 3), 'author:Author': (2, 3)}
+        assert len(CatalogStatsRepairJob().run()) == 2
+        assert CatalogStatsRepairJob().run() == {}
+        response = service.GetCatalogStats(book_pb2.GetCatalogStatsRequest(), MockContext())
+        assert response.total_books == 3
+
+    def test_list_books_popular_order(self, clean_database):
+        """Test borrows count towards the 'popular' order, paged with keyset cursors"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        book_ids = [service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Author"), MockContext()).book.id
+                    for i in range(3)]
+        for book_id, borrows in zip(book_ids, [1, 2, 0]):
+            for _ in range(borrows):
+                service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+                service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        first = service.ListBooks(book_pb2.ListBooksRequest(limit=2, order_by='popular'), MockContext())
+        assert [(b.id, b.borrow_count) for b in first.books] == [(book_ids[1], 2), (book_ids[0], 1)]
+        assert first.has_more
+        second = service.ListBooks(book_pb2.ListBooksRequest(limit=2, order_by='popular', cursor=first.next_cursor), MockContext())
+        assert [b.id for b in second.books] == [book_ids[2]]
+        assert not second.has_more
+
+        context = MockContext()
+        service.ListBooks(book_pb2.ListBooksRequest(order_by='popular', cursor='not-a-cursor'), context)
+        assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+
+    def test_borrow_count_backfill_from_ledger(self, clean_database):
+        """Test the backfill sets borrow counts from ledger history and is idempotent"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        book_ids = [service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Author"), MockContext()).book.id
+                    for i in range(2)]
+        for _ in range(2):
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_ids[0], member_id=member_id), MockContext())
+            service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_ids[0], member_id=member_id), MockContext())
+        session = SessionLocal()
+        try:
+            # Counts as they were before the column existed
+            session.execute(text("UPDATE book SET borrow_count = 0"))
+            session.commit()
+        finally:
+            session.close()
+
+        job = BorrowCountBackfillJob(workers=2, batch_size=1)
+        assert job.run()['books'] == 1
+        assert job.run()['books'] == 0
+        response = service.ListBooks(book_pb2.ListBooksRequest(order_by='popular'), MockContext())
+        assert [(b.id, b.borrow_count) for b in response.books] == [(book_ids[0], 2), (book_ids[1], 0)]
+
+        session = SessionLocal()
+        try:
+            # Borrows whose ledger partitions were detached by retention
+            session.execute(text("UPDATE book SET borrow_count = 5 WHERE id = :id"), {'id': book_ids[0]})
+            session.commit()
+        finally:
+            session.close()
+        assert job.run()['books'] == 0
+        response = service.ListBooks(book_pb2.ListBooksRequest(order_by='popular'), MockContext())
+        assert response.books[0].borrow_count == 5
+
+    def test_related_books_built_incrementally(self, clean_database):
+        """Test the related books job ranks co-borrowed books and folds only new borrows"""
+        service = LibraryGrpcService()
+        member_ids = [service.CreateMember(member_pb2.CreateMemberRequest(name=f"Member {i}", email=f"m{i}@example.com"),
+                                           MockContext()).member.id for i in range(2)]
+        book_ids = [service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Author"), MockContext()).book.id
+                    for i in range(3)]
+
+        def borrow(member_id, book_id):
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+            service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        for member_id in member_ids:
+            borrow(member_id, book_ids[0])
+            borrow(member_id, book_ids[1])
+        borrow(member_ids[0], book_ids[0])
+
+        job = RelatedBooksJob(batch_size=2, safety_seconds=0)
+        assert job.run()['batches'] >= 1
+        response = service.GetRelatedBooks(book_pb2.GetRelatedBooksRequest(book_id=book_ids[0]), MockContext())
+        assert [(r.book.id, r.members) for r in response.books] == [(book_ids[1], 2)]
+
+        # Only the new borrow is folded on the next run
+        borrow(member_ids[1], book_ids[2])
+        job.run()
+        response = service.GetRelatedBooks(book_pb2.GetRelatedBooksRequest(book_id=book_ids[0]), MockContext())
+        assert [(r.book.id, r.members) for r in response.books] == [(book_ids[1], 2), (book_ids[2], 1)]
+        response = service.GetRelatedBooks(book_pb2.GetRelatedBooksRequest(book_id=book_ids[2], limit=1), MockContext())
+        assert [r.book.title for r in response.books] == ["Book 0"]
+
+    def test_watch_books_streams_availability(self, clean_database):
+        """Test WatchBooks pushes committed borrows/returns and resumes from a seq"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Author"), MockContext()).book.id
+        since_seq = service.ListChanges(change_pb2.ListChangesRequest(), MockContext()).next_seq
+
+        stream = service.WatchBooks(book_pb2.WatchBooksRequest(since_seq=since_seq), StreamContext())
+        events = []
+
+        def consume():
+            for event in stream:
+                events.append(event)
+                if len(events) == 2:
+                    break
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        consumer.join(timeout=15)
+        stream.close()
+
+        assert [(e.book_id, e.operation, e.is_borrowed, e.current_member_id) for e in events] == [
+            (book_id, 'borrow', True, member_id), (book_id, 'return', False, 0)
+        ]
+
+        # Reconnecting after the first event replays only the second
+        resumed = service.WatchBooks(book_pb2.WatchBooksRequest(since_seq=events[0].seq), StreamContext())
+        assert next(resumed).seq == events[1].seq
+        resumed.close()
+
+    def test_list_books_query_budget(self, clean_database):
+        """Test a ListBooks page is one statement however many books it returns"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        for i in range(25):
+            book_id = service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Author"), MockContext()).book.id
+            if i % 2:
+                service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        with assert_max_queries(1, 'ListBooks'):
+            response = service.ListBooks(book_pb2.ListBooksRequest(limit=20), MockContext())
+        assert len(response.books) == 20
@@ -1,10 +1,21 @@
+import json
 import pytest
 from server import LibraryGrpcService
 import book_pb2
 import member_pb2
 import ledger_pb2
+import change_pb2
 import grpc
 import threading
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from config import Config
+from db_helper import SessionLocal
+from repositories import LedgerPartitionRepository, LoanRepository, ChangeLogRepository, IdempotencyRepository, idempotency_cache
+from request_context import DeadlineExceeded, RequestCancelled, request_scope
+from sql_profiler import assert_max_queries, query_budget
+from jobs import LoanBackfillJob, FinesJob, FineSchedule, LedgerRollupJob
+from repositories.ledger_partition_repository import month_start, partition_name
 
 class MockContext:
     def __init__(self):
@@ -17,6 +28,18 @@ class MockContext:
     def set_details(self, details):
         self.details = details
 
+class RpcContext(MockContext):
+    def __init__(self, time_remaining=None):
+        super().__init__()
+        self._time_remaining = time_remaining
+        self.callbacks = []
+
+    def time_remaining(self):
+        return self._time_remaining
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
 class TestLedger:
     def test_borrow_book_success(self, clean_database):
         """Test borrowing a book successfully"""
@@ -410,4 +433,431 @@ class TestLedger:
 
         assert len(successful_returns) == 1, "Only one return should succeed"
         assert len(failed_returns) == 1, "One return should fail with FAILED_PRECONDITION"
-        assert len(results) == 2, "Both threads should complete"
\ No newline at end of file
+        assert len(results) == 2, "Both threads should complete"
+
+    @pytest.mark.parametrize('mode', ['pessimistic', 'optimistic', 'nowait'])
+    def test_concurrent_borrow_hot_book_each_mode(self, clean_database, monkeypatch, mode):
+        """Test many concurrent borrows of one book - exactly one wins in every concurrency mode"""
+        monkeypatch.setattr(Config, 'BORROW_CONCURRENCY_MODE', mode)
+        service = LibraryGrpcService()
+
+        book_request = book_pb2.CreateBookRequest(title="Hot Book", author="Test Author")
+        book_id = service.CreateBook(book_request, MockContext()).book.id
+
+        member_ids = []
+        for i in range(8):
+            member_request = member_pb2.CreateMemberRequest(name=f"Member {i}", email=f"member{i}@example.com")
+            member_ids.append(service.CreateMember(member_request, MockContext()).member.id)
+
+        results = []
+        barrier = threading.Barrier(len(member_ids))
+
+        def borrow_book_thread(member_id):
+            barrier.wait()
+            context = MockContext()
+            response = service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), context)
+            results.append((response.success, context.code))
+
+        threads = [threading.Thread(target=borrow_book_thread, args=(member_id,)) for member_id in member_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == len(member_ids)
+        assert sum(1 for success, _ in results if success) == 1
+        assert all(code in (grpc.StatusCode.FAILED_PRECONDITION, grpc.StatusCode.ABORTED)
+                   for success, code in results if not success)
+
+    def test_list_ledger_pages_and_filters(self, clean_database):
+        """Test ledger history is newest first, keyset-paged and filterable"""
+        service = LibraryGrpcService()
+
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        other_id = service.CreateMember(member_pb2.CreateMemberRequest(name="Jane Smith", email="jane@example.com"), MockContext()).member.id
+
+        for borrower in [member_id, other_id, member_id]:
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=borrower), MockContext())
+            service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=borrower), MockContext())
+
+        # Page through everything two entries at a time
+        seen = []
+        cursor = ''
+        while True:
+            context = MockContext()
+            response = service.ListLedger(ledger_pb2.ListLedgerRequest(limit=2, cursor=cursor), context)
+            assert context.code is None
+            seen.extend(response.entries)
+            if not response.has_more:
+                break
+            cursor = response.next_cursor
+
+        assert len(seen) == 6
+        assert [entry.id for entry in seen] == sorted((entry.id for entry in seen), reverse=True)
+        assert seen[0].action_type == ledger_pb2.ActionType.RETURN
+
+        # Filter by member and action
+        response = service.ListLedger(ledger_pb2.ListLedgerRequest(
+            member_id=member_id, action_type=ledger_pb2.ActionType.BORROW), MockContext())
+        assert len(response.entries) == 2
+        assert all(entry.member_id == member_id and entry.action_type == ledger_pb2.ActionType.BORROW
+                   for entry in response.entries)
+
+    def test_list_ledger_invalid_cursor(self, clean_database):
+        """Test a malformed cursor is rejected"""
+        service = LibraryGrpcService()
+        context = MockContext()
+
+        service.ListLedger(ledger_pb2.ListLedgerRequest(cursor="not-a-cursor"), context)
+
+        assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+
+    def test_ledger_entries_land_in_monthly_partition(self, clean_database):
+        """Test new ledger entries are routed to the current month's partition"""
+        service = LibraryGrpcService()
+        repository = LedgerPartitionRepository()
+
+        partitions = repository.list_partitions()
+        current = partition_name(month_start(datetime.utcnow().date()))
+        assert current in partitions
+        assert partitions.index(current) < len(partitions) - 1  # at least one month created ahead
+
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        session = SessionLocal()
+        try:
+            assert session.execute(text(f"SELECT COUNT(*) FROM {current}")).scalar() == 1
+        finally:
+            session.close()
+
+    def test_archive_old_ledger_partitions(self, clean_database):
+        """Test partitions past retention are detached into the archive schema"""
+        repository = LedgerPartitionRepository()
+        session = SessionLocal()
+        try:
+            session.execute(text(
+                "CREATE TABLE ledger_y2001m01 PARTITION OF ledger FOR VALUES FROM ('2001-01-01') TO ('2001-02-01')"))
+            session.commit()
+
+            archived = repository.archive_partitions_before(date(2001, 2, 1))
+
+            assert archived == ['ledger_y2001m01']
+            assert 'ledger_y2001m01' not in repository.list_partitions()
+        finally:
+            session.execute(text("DROP TABLE IF EXISTS ledger_archive.ledger_y2001m01"))
+            session.execute(text("DROP TABLE IF EXISTS ledger_y2001m01"))
+            session.commit()
+            session.close()
+
+    def test_borrow_and_return_maintain_loan(self, clean_database):
+        """Test borrow opens a loan and return closes it, matching the ledger timestamps"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+
+        borrow = service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        loans, _, _ = LoanRepository().list_loans(book_id=book_id, open_only=True)
+        assert len(loans) == 1
+        assert loans[0]['member_id'] == member_id
+        assert loans[0]['borrowed_at'] == borrow.ledger_entry.log_date.ToJsonString()
+
+        ret = service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        assert LoanRepository().list_loans(book_id=book_id, open_only=True)[0] == []
+        loans, _, _ = LoanRepository().list_loans(member_id=member_id)
+        assert len(loans) == 1
+        assert loans[0]['returned_at'] == ret.ledger_entry.log_date.ToJsonString()
+
+    def test_loan_backfill_from_ledger(self, clean_database):
+        """Test the backfill pairs ledger history into loans and is safe to re-run"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+
+        # History written before the loan table existed
+        session = SessionLocal()
+        try:
+            session.execute(text(
+                "INSERT INTO ledger (book_id, member_id, action_type, log_date) VALUES "
+                "(:book, :member, 'BORROW', NOW() - INTERVAL '10 days'), "
+                "(:book, :member, 'RETURN', NOW() - INTERVAL '8 days'), "
+                "(:book, :member, 'BORROW', NOW() - INTERVAL '5 days')"
+            ), {'book': book_id, 'member': member_id})
+            session.commit()
+        finally:
+            session.close()
+
+        totals = LoanBackfillJob(workers=2, batch_size=1).run()
+        assert totals['failed'] == 0
+        assert totals['loans'] == 2
+        assert LoanBackfillJob(workers=2, batch_size=1).run()['loans'] == 0
+
+        loans, _, _ = LoanRepository().list_loans(book_id=book_id)
+        assert [loan['returned_at'] is None for loan in loans] == [True, False]
+
+    def test_list_overdue_loans(self, clean_database):
+        """Test overdue loans are listed by due date with keyset pagination"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        for i in range(3):
+            book_id = service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Test Author"), MockContext()).book.id
+            borrow = service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+            assert borrow.ledger_entry.due_date_snapshot.ToDatetime() - borrow.ledger_entry.log_date.ToDatetime() \
+                >= timedelta(days=Config.LOAN_PERIOD_DAYS)
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        # Nothing is overdue yet
+        response = service.ListOverdueLoans(ledger_pb2.ListOverdueLoansRequest(), MockContext())
+        assert len(response.loans) == 0
+
+        as_of = ledger_pb2.ListOverdueLoansRequest().as_of
+        as_of.FromDatetime(datetime.utcnow() + timedelta(days=Config.LOAN_PERIOD_DAYS + 2))
+        first = service.ListOverdueLoans(ledger_pb2.ListOverdueLoansRequest(limit=1, as_of=as_of), MockContext())
+        assert len(first.loans) == 1 and first.has_more
+        second = service.ListOverdueLoans(ledger_pb2.ListOverdueLoansRequest(
+            limit=1, as_of=as_of, cursor=first.next_cursor), MockContext())
+        assert len(second.loans) == 1 and not second.has_more
+        assert first.loans[0].id < second.loans[0].id
+        assert not second.loans[0].HasField('returned_at')
+
+    def test_fines_job_prices_overdue_loans(self, clean_database):
+        """Test the fines job bulk-writes tiered fees for overdue loans and is idempotent"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        as_of = datetime.utcnow()
+        session = SessionLocal()
+        try:
+            session.execute(text("UPDATE loan SET due_at = :due WHERE book_id = :book"),
+                            {'due': as_of - timedelta(days=10), 'book': book_id})
+            session.commit()
+
+            job = FinesJob(schedule=FineSchedule([(1, 25), (8, 50)]), chunk_size=1)
+            totals = job.run(as_of)
+            assert totals['fined'] == 1 and totals['upserted'] == 1
+            assert job.run(as_of)['upserted'] == 0
+
+            fine = session.execute(text("SELECT member_id, days_overdue, amount_cents FROM fine")).one()
+            assert tuple(fine) == (member_id, 10, 7 * 25 + 3 * 50)
+        finally:
+            session.close()
+
+    def test_circulation_rollup_is_incremental_and_idempotent(self, clean_database):
+        """Test the rollup job folds only new ledger rows, per day, author and member cohort"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        book_ids = [service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author=f"Author {i % 2}"), MockContext()).book.id
+                    for i in range(3)]
+        for book_id in book_ids:
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_ids[0], member_id=member_id), MockContext())
+
+        # Small batches exercise resuming from the watermark
+        job = LedgerRollupJob(batch_size=1, safety_seconds=0)
+        assert job.run()['batches'] >= 1
+        assert job.run()['batches'] == 0
+
+        today = datetime.utcnow().date().isoformat()
+        response = service.GetCirculationRollup(ledger_pb2.GetCirculationRollupRequest(), MockContext())
+        assert [(d.day, d.dimension_key, d.borrows, d.returns) for d in response.days] == [(today, '', 3, 1)]
+        assert not response.truncated
+
+        response = service.GetCirculationRollup(ledger_pb2.GetCirculationRollupRequest(
+            dimension=ledger_pb2.RollupDimension.ROLLUP_AUTHOR), MockContext())
+        assert [(d.dimension_key, d.borrows, d.returns) for d in response.days] == [('Author 0', 2, 1), ('Author 1', 1, 0)]
+
+        response = service.GetCirculationRollup(ledger_pb2.GetCirculationRollupRequest(
+            dimension=ledger_pb2.RollupDimension.ROLLUP_MEMBER_COHORT), MockContext())
+        assert [(d.dimension_key, d.borrows) for d in response.days] == [(datetime.utcnow().strftime('%Y-%m'), 3)]
+
+        # New activity is added to the existing counts
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_ids[1], member_id=member_id), MockContext())
+        job.run()
+        response = service.GetCirculationRollup(ledger_pb2.GetCirculationRollupRequest(), MockContext())
+        assert [(d.borrows, d.returns) for d in response.days] == [(3, 2)]
+
+    def test_circulation_rollup_invalid_range(self, clean_database):
+        """Test a start date after the end date is rejected"""
+        service = LibraryGrpcService()
+        request = ledger_pb2.GetCirculationRollupRequest()
+        request.start_date.FromDatetime(datetime.utcnow())
+        request.end_date.FromDatetime(datetime.utcnow() - timedelta(days=2))
+        context = MockContext()
+        service.GetCirculationRollup(request, context)
+        assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+
+    def test_list_changes_in_sequence(self, clean_database):
+        """Test every book, member and loan change is listed in commit order and paged by next_seq"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        service.UpdateBook(book_pb2.UpdateBookRequest(id=book_id, title="New Title", author="Test Author"), MockContext())
+        service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+
+        response = service.ListChanges(change_pb2.ListChangesRequest(), MockContext())
+        assert [(c.entity, c.operation) for c in response.changes] == [
+            ('member', 'create'), ('book', 'create'), ('book', 'update'),
+            ('book', 'borrow'), ('loan', 'create'), ('book', 'return'), ('loan', 'return')
+        ]
+        assert [c.seq for c in response.changes] == sorted(c.seq for c in response.changes)
+        assert json.loads(response.changes[2].data)['title'] == "New Title"
+        assert json.loads(response.changes[3].data)['current_member_id'] == member_id
+        assert response.next_seq == response.changes[-1].seq and not response.has_more
+
+        first = service.ListChanges(change_pb2.ListChangesRequest(limit=4), MockContext())
+        second = service.ListChanges(change_pb2.ListChangesRequest(since_seq=first.next_seq), MockContext())
+        assert first.has_more
+        assert [c.seq for c in first.changes] + [c.seq for c in second.changes] == [c.seq for c in response.changes]
+        caught_up = service.ListChanges(change_pb2.ListChangesRequest(since_seq=second.next_seq), MockContext())
+        assert len(caught_up.changes) == 0 and caught_up.next_seq == second.next_seq
+
+    def test_list_changes_after_pruning(self, clean_database):
+        """Test clients behind the pruned part of the change log are told to re-list"""
+        service = LibraryGrpcService()
+        service.CreateBook(book_pb2.CreateBookRequest(title="Book 1", author="Author"), MockContext())
+        service.CreateBook(book_pb2.CreateBookRequest(title="Book 2", author="Author"), MockContext())
+        first = service.ListChanges(change_pb2.ListChangesRequest(limit=1), MockContext())
+
+        assert ChangeLogRepository().prune(datetime.utcnow() + timedelta(minutes=1)) == 2
+        context = MockContext()
+        service.ListChanges(change_pb2.ListChangesRequest(since_seq=first.next_seq), context)
+        assert context.code == grpc.StatusCode.FAILED_PRECONDITION
+        assert 'CHANGES_EXPIRED' in context.details
+
+        service.CreateBook(book_pb2.CreateBookRequest(title="Book 3", author="Author"), MockContext())
+        response = service.ListChanges(change_pb2.ListChangesRequest(), MockContext())
+        assert [json.loads(c.data)['title'] for c in response.changes] == ["Book 3"]
+
+    def test_list_changes_never_skips_a_lower_seq_committed_later(self, clean_database):
+        """Test a change with a lower seq whose transaction commits later is listed after, not skipped"""
+        service = LibraryGrpcService()
+        repository = ChangeLogRepository()
+        first, second = SessionLocal(), SessionLocal()
+        try:
+            # first takes its txid before second, but second flushes its change (the lower seq) first
+            first.execute(text("SELECT pg_current_xact_id()"))
+            second.execute(text("SELECT pg_current_xact_id()"))
+            repository.record(second, 'book', 2, 'update', {'title': "Second"})
+            second.flush()
+            repository.record(first, 'book', 1, 'update', {'title': "First"})
+            first.commit()
+
+            listed = service.ListChanges(change_pb2.ListChangesRequest(), MockContext())
+            assert [c.entity_id for c in listed.changes] == [1]
+            second.commit()
+            rest = service.ListChanges(change_pb2.ListChangesRequest(since_seq=listed.next_seq), MockContext())
+            assert [c.entity_id for c in rest.changes] == [2]
+            assert rest.changes[0].seq < listed.changes[0].seq
+        finally:
+            first.close()
+            second.close()
+
+    def test_retried_borrow_and_return_with_idempotency_key(self, clean_database):
+        """Test retries with the same idempotency key return the original ledger entry once"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+
+        borrow = ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id, idempotency_key="borrow-1")
+        first = service.BorrowBook(borrow, MockContext())
+        retry_context = MockContext()
+        retry = service.BorrowBook(borrow, retry_context)
+        assert retry_context.code is None
+        assert retry.ledger_entry == first.ledger_entry
+
+        # Served from the table once the process cache is gone
+        idempotency_cache.clear()
+        assert service.BorrowBook(borrow, MockContext()).ledger_entry == first.ledger_entry
+
+        give_back = ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id, idempotency_key="return-1")
+        returned = service.ReturnBook(give_back, MockContext())
+        assert service.ReturnBook(give_back, MockContext()).ledger_entry == returned.ledger_entry
+
+        reused_context = MockContext()
+        service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id, idempotency_key="borrow-1"), reused_context)
+        assert reused_context.code == grpc.StatusCode.INVALID_ARGUMENT
+        assert 'IDEMPOTENCY_KEY_REUSED' in reused_context.details
+
+        session = SessionLocal()
+        try:
+            assert session.execute(text("SELECT count(*) FROM ledger WHERE book_id = :id"), {'id': book_id}).scalar() == 2
+        finally:
+            session.close()
+
+    def test_expired_idempotency_keys_are_purged_in_batches(self, clean_database):
+        """Test the expired-key sweep deletes every expired key across batches"""
+        service = LibraryGrpcService()
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        for i in range(3):
+            book_id = service.CreateBook(book_pb2.CreateBookRequest(title=f"Book {i}", author="Author"), MockContext()).book.id
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id, idempotency_key=f"key-{i}"), MockContext())
+
+        repository = IdempotencyRepository()
+        assert repository.purge_expired(datetime.utcnow() + timedelta(minutes=1), batch_size=2) == 3
+        idempotency_cache.clear()
+        assert repository.lookup("key-0") is None
+
+    def test_expired_idempotency_key_is_reused_before_the_sweep(self, clean_database):
+        """Test a key past its TTL but not yet purged is taken by a new request"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+        service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id, idempotency_key="key-1"), MockContext())
+
+        session = SessionLocal()
+        try:
+            session.execute(text("UPDATE idempotency_key SET created_at = created_at - :ttl WHERE key = 'key-1'"),
+                            {'ttl': timedelta(hours=Config.IDEMPOTENCY_TTL_HOURS + 1)})
+            session.commit()
+        finally:
+            session.close()
+        idempotency_cache.clear()
+
+        context = MockContext()
+        returned = service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id, idempotency_key="key-1"), context)
+        assert context.code is None
+        stored = IdempotencyRepository().lookup("key-1")
+        assert stored['operation'] == 'return'
+        assert stored['ledger_entry']['id'] == returned.ledger_entry.id
+
+    def test_rpc_deadline_becomes_statement_timeout(self, clean_database):
+        """Test a statement outliving its RPC deadline is stopped by Postgres"""
+        repository = LoanRepository()
+        with request_scope(RpcContext(time_remaining=0.3)):
+            session = repository._get_session()
+            try:
+                with pytest.raises(DeadlineExceeded):
+                    session.execute(text("SELECT pg_sleep(5)"))
+            finally:
+                session.close()
+
+    def test_rpc_cancellation_cancels_running_statement(self, clean_database):
+        """Test cancelling an RPC cancels its in-flight statement"""
+        repository = LoanRepository()
+        context = RpcContext(time_remaining=30)
+        with request_scope(context):
+            session = repository._get_session()
+            try:
+                session.execute(text("SELECT 1"))
+                threading.Timer(0.3, context.callbacks[0]).start()
+                with pytest.raises(RequestCancelled):
+                    session.execute(text("SELECT pg_sleep(5)"))
+            finally:
+                session.close()
+
+    def test_borrow_and_return_query_budget(self, clean_database):
+        """Test borrow and return stay within their SQL statement budgets"""
+        service = LibraryGrpcService()
+        book_id = service.CreateBook(book_pb2.CreateBookRequest(title="Test Book", author="Test Author"), MockContext()).book.id
+        member_id = service.CreateMember(member_pb2.CreateMemberRequest(name="John Doe", email="john@example.com"), MockContext()).member.id
+
+        with assert_max_queries(query_budget('BorrowBook'), 'BorrowBook') as borrow:
+            service.BorrowBook(ledger_pb2.BorrowBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        with assert_max_queries(query_budget('ReturnBook'), 'ReturnBook'):
+            service.ReturnBook(ledger_pb2.ReturnBookRequest(book_id=book_id, member_id=member_id), MockContext())
+        assert borrow.transactions <= 4
@@ -141,4 +141,23 @@ class TestMembers:
         assert len(search_response.members) == 2
         names = [member.name for member in search_response.members]
         assert "John Doe" in names
-        assert "Bob Johnson" in names  # "Johnson" contains "John"
\ No newline at end of file
+        assert "Bob Johnson" in names  # "Johnson" contains "John"
+
+    def test_batch_get_members(self, clean_database):
+        """Test fetching several members by ID in request order"""
+        service = LibraryGrpcService()
+
+        member_ids = []
+        for name, email in [("John Doe", "john@example.com"), ("Jane Smith", "jane@example.com")]:
+            request = member_pb2.CreateMemberRequest(name=name, email=email)
+            member_ids.append(service.CreateMember(request, MockContext()).member.id)
+
+        missing_id = max(member_ids) + 1000
+        request = member_pb2.BatchGetMembersRequest(ids=[missing_id, member_ids[1], member_ids[0]])
+        context = MockContext()
+        response = service.BatchGetMembers(request, context)
+
+        assert context.code is None
+        assert [result.found for result in response.results] == [False, True, True]
+        assert response.results[1].member.name == "Jane Smith"
+        assert response.results[2].member.name == "John Doe"
\ No newline at end of file
@@ -0,0 +1,239 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, text
+
+from db_helper import engine, Ledger, Loan, Fine, Book, Member
+from repositories import BookRepository, MemberRepository, LedgerRepository, LoanRepository
+
+# Sequential scans over tables this small are fine; anything above it means a
+# query is not using an index.
+SEQ_SCAN_ROW_THRESHOLD = 1000
+
+NUM_MEMBERS = 5000
+NUM_BOOKS = 20000
+NUM_LEDGER_ROWS = 50000
+
+# Queries that read a whole table by design, or filter with a leading-wildcard
+# ILIKE that no btree index can serve.
+FULL_SCAN_ALLOWED = {
+    'list_books',
+    'list_members',
+    'count_books_by_status',
+    'search_books',
+    'search_members',
+    'list_books_paginated_search',
+    'list_members_paginated_search',
+}
+
+
+@pytest.fixture(scope="module")
+def seeded_database():
+    """Seed enough rows for the planner to prefer indexes, then clean up"""
+    with engine.begin() as conn:
+        conn.execute(Fine.__table__.delete())
+        conn.execute(Loan.__table__.delete())
+        conn.execute(Ledger.__table__.delete())
+        conn.execute(Book.__table__.delete())
+        conn.execute(Member.__table__.delete())
+        conn.execute(text(
+            "INSERT INTO member (name, email, created_at, updated_at) "
+            "SELECT 'Member ' || g, 'member' || g || '@example.com', NOW(), NOW() "
+            "FROM generate_series(1, :n) g"
+        ), {'n': NUM_MEMBERS})
+        conn.execute(text(
+            "INSERT INTO book (title, author, is_borrowed, created_at, updated_at) "
+            "SELECT 'Book ' || g, 'Author ' || (g % 500), FALSE, NOW() - g * INTERVAL '1 minute', NOW() - g * INTERVAL '1 minute' "
+            "FROM generate_series(1, :n) g"
+        ), {'n': NUM_BOOKS})
+        # Roughly 10% of books are out on loan
+        conn.execute(text(
+            "UPDATE book SET is_borrowed = TRUE, "
+            "current_member_id = (SELECT min(id) FROM member) + (book.id % :members) "
+            "WHERE book.id % 10 = 0"
+        ), {'members': NUM_MEMBERS})
+        conn.execute(text(
+            "INSERT INTO ledger (book_id, member_id, action_type, log_date) "
+            "SELECT b.min_id + (g % :books), m.min_id + (g % :members), "
+            "CASE WHEN g % 2 = 0 THEN 'BORROW' ELSE 'RETURN' END, NOW() - g * INTERVAL '1 minute' "
+            "FROM generate_series(1, :n) g, "
+            "(SELECT min(id) AS min_id FROM book) b, (SELECT min(id) AS min_id FROM member) m"
+        ), {'n': NUM_LEDGER_ROWS, 'books': NUM_BOOKS, 'members': NUM_MEMBERS})
+    # Derive loans from the seeded ledger, as the backfill job does
+    LoanRepository().backfill_book_range(0, 2 ** 31 - 1)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE member"))
+        conn.execute(text("ANALYZE book"))
+        conn.execute(text("ANALYZE ledger"))
+        conn.execute(text("ANALYZE loan"))
+
+    with engine.connect() as conn:
+        book_ids = [row[0] for row in conn.execute(text("SELECT id FROM book ORDER BY id LIMIT 5"))]
+        borrowed = conn.execute(text(
+            "SELECT id, current_member_id FROM book WHERE is_borrowed ORDER BY id LIMIT 1"
+        )).first()
+        member_ids = [row[0] for row in conn.execute(text("SELECT id FROM member ORDER BY id LIMIT 5"))]
+    yield {
+        'book_ids': book_ids,
+        'member_ids': member_ids,
+        'borrowed_book_id': borrowed[0],
+        'borrowing_member_id': borrowed[1],
+    }
+
+    with engine.begin() as conn:
+        conn.execute(Fine.__table__.delete())
+        conn.execute(Loan.__table__.delete())
+        conn.execute(Ledger.__table__.delete())
+        conn.execute(Book.__table__.delete())
+        conn.execute(Member.__table__.delete())
+
+
+def _repository_queries():
+    """Every repository read, keyed by a name used in test ids"""
+    books = BookRepository()
+    members = MemberRepository()
+    ledger = LedgerRepository()
+    loans = LoanRepository()
+    return {
+        'get_book_by_id': lambda d: books.get_book_by_id(d['book_ids'][0]),
+        'get_books_by_ids': lambda d: books.get_books_by_ids(d['book_ids']),
+        'list_books': lambda d: books.list_books(),
+        'list_recent_books': lambda d: books.list_recent_books(20),
+        'list_books_paginated_id': lambda d: books.list_books_paginated(20, str(d['book_ids'][2])),
+        'list_books_paginated_available': lambda d: books.list_books_paginated(20, None, 'available'),
+        'list_books_paginated_borrowed': lambda d: books.list_books_paginated(20, None, 'borrowed'),
+        'list_books_paginated_updated_at': lambda d: books.list_books_paginated(20, None, 'all', None, 'updated_at'),
+        'list_books_paginated_popular': lambda d: books.list_books_paginated(20, '3|100', 'all', None, 'popular'),
+        'list_books_paginated_search': lambda d: books.list_books_paginated(20, None, 'all', 'Book 1'),
+        'search_books': lambda d: books.search_books('Book 1'),
+        'is_book_available': lambda d: books.is_book_available(d['book_ids'][0]),
+        'is_book_borrowed_by_member': lambda d: books.is_book_borrowed_by_member(
+            d['borrowed_book_id'], d['borrowing_member_id']),
+        'list_borrowed_books': lambda d: books.list_borrowed_books(d['borrowing_member_id']),
+        'count_books_by_status': lambda d: books.count_books_by_status(),
+        'get_member_by_id': lambda d: members.get_member_by_id(d['member_ids'][0]),
+        'get_members_by_ids': lambda d: members.get_members_by_ids(d['member_ids']),
+        'list_members': lambda d: members.list_members(),
+        'list_members_paginated': lambda d: members.list_members_paginated(20, str(d['member_ids'][2])),
+        'list_members_paginated_search': lambda d: members.list_members_paginated(20, None, 'Member 1'),
+        'search_members': lambda d: members.search_members('Member 1'),
+        'member_exists': lambda d: members.member_exists(d['member_ids'][0]),
+        'list_ledger': lambda d: ledger.list_entries(50),
+        'list_ledger_page_2': lambda d: ledger.list_entries(50, ledger.list_entries(50)[1]),
+        'list_ledger_member': lambda d: ledger.list_entries(50, None, d['member_ids'][0]),
+        'list_ledger_book': lambda d: ledger.list_entries(50, None, None, d['book_ids'][0]),
+        'list_ledger_member_date_range': lambda d: ledger.list_entries(
+            50, None, d['member_ids'][0], None, 'BORROW',
+            datetime.utcnow() - timedelta(days=30), datetime.utcnow()),
+        'list_loans_member': lambda d: loans.list_loans(50, None, d['member_ids'][0]),
+        'list_loans_book': lambda d: loans.list_loans(50, None, None, d['book_ids'][0]),
+        'list_loans_date_range': lambda d: loans.list_loans(
+            50, None, None, None, False, datetime.utcnow() - timedelta(days=2), datetime.utcnow() - timedelta(days=1)),
+        'list_overdue_loans': lambda d: loans.list_overdue_loans(50, None, datetime.utcnow()),
+    }
+
+
+def _capture_statements(fn, data):
+    """Run a repository call and return the SQL statements it executed"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        fn(data)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return [(s, p) for s, p in statements if s.lstrip().upper().startswith('SELECT')]
+
+
+def _explain(statement, parameters):
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        plan = cursor.fetchone()[0]
+        return plan if isinstance(plan, list) else json.loads(plan)
+    finally:
+        raw.close()
+
+
+def _table_rows():
+    """Planner row estimates per table, i.e. how many rows a sequential scan reads"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind IN ('r', 'p') "
+            "AND relnamespace = 'public'::regnamespace"
+        ))
+        return {relname: reltuples for relname, reltuples in rows}
+
+
+def _large_seq_scans(node, table_rows):
+    """Yield (relation, table rows) for sequential scans over tables above the threshold"""
+    if node.get('Node Type') == 'Seq Scan':
+        relation = node.get('Relation Name')
+        if table_rows.get(relation, 0) > SEQ_SCAN_ROW_THRESHOLD:
+            yield relation, table_rows[relation]
+    for child in node.get('Plans', []):
+        yield from _large_seq_scans(child, table_rows)
+
+
+QUERIES = _repository_queries()
+
+
+class TestQueryPlans:
+    @pytest.mark.parametrize('name', sorted(set(QUERIES) - FULL_SCAN_ALLOWED))
+    def test_no_large_sequential_scans(self, seeded_database, name):
+        """Test repository queries are served by indexes on a seeded database"""
+        statements = _capture_statements(QUERIES[name], seeded_database)
+        assert statements, f"{name} did not execute any SELECT"
+
+        table_rows = _table_rows()
+        for statement, parameters in statements:
+            plan = _explain(statement, parameters)[0]['Plan']
+            scans = list(_large_seq_scans(plan, table_rows))
+            assert not scans, f"{name} plans a sequential scan over {scans}:\n{statement}"
+
+    def test_open_loan_lookup_uses_partial_index(self, seeded_database):
+        """Test a member's borrowed books are read from the open-loan partial index"""
+        statements = _capture_statements(QUERIES['list_borrowed_books'], seeded_database)
+        plan = json.dumps(_explain(*statements[0]))
+
+        assert 'idx_book_open_loans_member' in plan
+
+    def test_member_foreign_key_lookup_uses_index(self, seeded_database):
+        """Test the books referencing a member, as checked on member delete, are found by index"""
+        plan = json.dumps(_explain("SELECT 1 FROM ONLY book x WHERE current_member_id = %(id)s FOR KEY SHARE OF x",
+                                   {'id': seeded_database['borrowing_member_id']}))
+
+        assert 'idx_book_current_member_fk' in plan
+
+    def test_popular_books_use_borrow_count_index(self, seeded_database):
+        """Test the 'popular' order is a range scan on the borrow count index"""
+        statements = _capture_statements(QUERIES['list_books_paginated_popular'], seeded_database)
+        plan = json.dumps(_explain(*statements[0]))
+
+        assert 'idx_book_borrow_count' in plan
+
+    def test_member_history_is_index_only(self, seeded_database):
+        """Test a member's ledger history page is served by the covering index"""
+        statements = _capture_statements(QUERIES['list_ledger_member'], seeded_database)
+        plan = json.dumps(_explain(*statements[0]))
+
+        assert 'idx_ledger_member_history' in plan
+
+    def test_member_loans_use_history_index(self, seeded_database):
+        """Test a member's loans are one range scan on the loan history index"""
+        statements = _capture_statements(QUERIES['list_loans_member'], seeded_database)
+        plan = json.dumps(_explain(*statements[0]))
+
+        assert 'idx_loan_member_history' in plan
+
+    def test_overdue_loans_use_open_due_index(self, seeded_database):
+        """Test the overdue report is a range scan on the open-loan due-date index"""
+        statements = _capture_statements(QUERIES['list_overdue_loans'], seeded_database)
+        plan = json.dumps(_explain(*statements[0]))
+
+        assert 'idx_loan_open_due' in plan
\ No newline at end of file
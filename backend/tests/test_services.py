@@ -1,6 +1,36 @@
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime
+
+import numpy as np
 import pytest
-from unittest.mock import Mock, patch
-from services import BookService, MemberService, LibraryService
+from unittest.mock import ANY, Mock, patch
+from config import Config
+from services import BookService, MemberService, LibraryService, DueDatePolicy
+from repositories import (BaseRepository, BookRepository, ConcurrencyConflict, AvailabilityIndex, ChangeLogRepository,
+                          BookWatchHub, TooManyWatchers, IdempotencyCache)
+from services.keyed_serializer import KeyedSerializer
+import grpc
+import json
+from interceptors import DeadlineInterceptor, ProfilingInterceptor, RateLimitInterceptor, TracingInterceptor
+import tracing
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool, StaticPool
+from sql_profiler import (QueryStats, assert_max_queries, bind_shape, budget_exceeded_total, check_budget,
+                          normalize_sql, parse_query_budgets, profile_queries)
+from services.base_service import BaseService
+from rate_limiter import RateLimiter, parse_method_costs
+from sampling_profiler import SamplingProfiler, render_collapsed, rpc_method
+import diagnostics
+from concurrent import futures
+import startup
+import health
+from request_context import DeadlineExceeded, RequestCancelled, RequestScope, check_deadline, request_scope, skipped_total
+from jobs.fines import FinesJob, FineSchedule, to_copy_binary
+from jobs.related_books import cooccurrence_deltas
+from repositories.ledger_partition_repository import add_months, month_start, partition_name
 
 
 class TestBookService:
@@ -95,6 +125,918 @@ class TestBookService:
             assert has_more is False
 
 
+    def test_get_books_by_ids_preserves_order(self):
+        """Test batch lookup returns request order with None for missing books"""
+        with patch('services.book_service.BookRepository') as mock_repo_class:
+            mock_repo = Mock()
+            mock_repo_class.return_value = mock_repo
+            mock_repo.get_books_by_ids.return_value = {
+                1: {'id': 1, 'title': 'Book 1'},
+                3: {'id': 3, 'title': 'Book 3'}
+            }
+
+            service = BookService()
+            result = service.get_books_by_ids([3, 2, 1, 3])
+
+            mock_repo.get_books_by_ids.assert_called_once_with([3, 2, 1])
+            assert result == [
+                {'id': 3, 'title': 'Book 3'},
+                None,
+                {'id': 1, 'title': 'Book 1'},
+                {'id': 3, 'title': 'Book 3'}
+            ]
+
+    def test_get_books_by_ids_too_many(self):
+        """Test batch lookup rejects oversized requests"""
+        service = BookService()
+
+        with pytest.raises(ValueError, match="ids can be requested"):
+            service.get_books_by_ids(list(range(100000)))
+
+
+class TestCatalogStats:
+    """Unit tests for BookService.get_catalog_stats"""
+
+    def test_get_catalog_stats(self):
+        """Test available books are derived and the author limit is capped"""
+        with patch('services.book_service.BookRepository'), \
+             patch('services.book_service.CatalogStatsRepository') as mock_stats_class:
+            mock_stats = Mock()
+            mock_stats_class.return_value = mock_stats
+            mock_stats.get_stats.return_value = {
+                'total_books': 10, 'borrowed_books': 4, 'active_borrowers': 3,
+                'top_authors': [{'author': 'Author', 'book_count': 10}]
+            }
+
+            service = BookService()
+            result = service.get_catalog_stats(author_limit=10 ** 6)
+
+            mock_stats.get_stats.assert_called_once_with(Config.CATALOG_STATS_AUTHORS_MAX)
+            assert result['available_books'] == 6
+            assert result['active_borrowers'] == 3
+
+
+class TestRelatedBooks:
+    """Unit tests for the "also borrowed" co-occurrence counts"""
+
+    def test_deltas_pair_new_borrows_with_history(self):
+        """Test a first borrow pairs with the member's other books both ways; re-borrows add nothing"""
+        new = np.array([[1, 10], [1, 11], [2, 10], [2, 10]])
+        old = np.array([[1, 12], [2, 11], [2, 10]])
+
+        deltas = cooccurrence_deltas(new, old)
+
+        assert deltas.tolist() == [[10, 11, 1], [10, 12, 1], [11, 10, 1], [11, 12, 1], [12, 10, 1], [12, 11, 1]]
+
+    def test_deltas_count_distinct_members(self):
+        """Test each pair counts the members who borrowed both, and heavy members are skipped"""
+        new = np.array([[1, 10], [2, 10], [3, 10], [3, 12]])
+        old = np.array([[1, 11], [2, 11], [3, 11]])
+
+        assert cooccurrence_deltas(new, old)[:2].tolist() == [[10, 11, 3], [10, 12, 1]]
+        assert cooccurrence_deltas(new, old, max_member_books=2)[:2].tolist() == [[10, 11, 2], [11, 10, 2]]
+
+    def test_get_related_books_keeps_rank_order(self):
+        """Test related books come back in precomputed order, limited, skipping missing books"""
+        with patch('services.book_service.BookRepository') as mock_book_repo_class, \
+             patch('services.book_service.RelatedBooksRepository') as mock_related_repo_class:
+            mock_book_repo = Mock()
+            mock_book_repo_class.return_value = mock_book_repo
+            mock_related_repo = Mock()
+            mock_related_repo_class.return_value = mock_related_repo
+            mock_related_repo.get_related.return_value = [(3, 9), (2, 5), (4, 1)]
+            mock_book_repo.get_books_by_ids.return_value = {2: {'id': 2}, 3: {'id': 3}}
+
+            service = BookService()
+
+            assert service.get_related_books(1, limit=2) == [{'book': {'id': 3}, 'members': 9},
+                                                             {'book': {'id': 2}, 'members': 5}]
+            mock_book_repo.get_books_by_ids.assert_called_once_with([3, 2])
+            with pytest.raises(ValueError, match="Book ID"):
+                service.get_related_books(0)
+
+
+class TestRepositoryRetries:
+    """Unit tests for BaseRepository conflict retries"""
+
+    def test_retries_until_success(self):
+        """Test conflicts are retried with backoff until the attempt succeeds"""
+        attempt = Mock(side_effect=[ConcurrencyConflict(), ConcurrencyConflict(), 'ok'])
+
+        with patch('repositories.base_repository.time.sleep') as mock_sleep:
+            result = BaseRepository()._retry_on_conflict('borrow', attempt)
+
+        assert result == 'ok'
+        assert attempt.call_count == 3
+        assert mock_sleep.call_count == 2
+
+    def test_gives_up_after_max_retries(self):
+        """Test the conflict is raised once retries are exhausted"""
+        attempt = Mock(side_effect=ConcurrencyConflict())
+
+        with patch('repositories.base_repository.time.sleep'), \
+             patch('repositories.base_repository.Config.BORROW_MAX_RETRIES', 2):
+            with pytest.raises(ConcurrencyConflict):
+                BaseRepository()._retry_on_conflict('borrow', attempt)
+
+        assert attempt.call_count == 3
+
+    def test_unknown_concurrency_mode_is_rejected(self, monkeypatch):
+        """Test a misspelt BORROW_CONCURRENCY_MODE fails startup instead of running optimistic"""
+        monkeypatch.setattr(Config, 'BORROW_CONCURRENCY_MODE', 'pesimistic')
+
+        with pytest.raises(ValueError, match='BORROW_CONCURRENCY_MODE'):
+            Config.validate()
+
+    def test_watch_streams_must_leave_workers_for_unary_calls(self, monkeypatch):
+        """Test startup fails when open streams could hold more than half of the server workers"""
+        Config.validate()
+        monkeypatch.setattr(Config, 'SERVER_MAX_WORKERS', 6)
+        monkeypatch.setattr(Config, 'WATCH_MAX_SUBSCRIBERS', 2)
+        monkeypatch.setattr(Config, 'HEALTH_MAX_WATCHERS', 1)
+        Config.validate()
+
+        monkeypatch.setattr(Config, 'HEALTH_MAX_WATCHERS', 2)
+        with pytest.raises(ValueError, match='HEALTH_MAX_WATCHERS'):
+            Config.validate()
+
+
+class FakeRpcContext:
+    """Minimal grpc.ServicerContext for interceptor and deadline tests"""
+
+    def __init__(self, time_remaining=None, metadata=(), peer='ipv4:10.0.0.1:50123'):
+        self._time_remaining = time_remaining
+        self._metadata = metadata
+        self._peer = peer
+        self.callbacks = []
+        self.aborted = None
+        self.trailing_metadata = None
+
+    def invocation_metadata(self):
+        return self._metadata
+
+    def peer(self):
+        return self._peer
+
+    def set_trailing_metadata(self, metadata):
+        self.trailing_metadata = metadata
+
+    def time_remaining(self):
+        return self._time_remaining
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def abort(self, code, details):
+        self.aborted = (code, details)
+        raise grpc.RpcError(details)
+
+
+class TestDeadlinePropagation:
+    """Unit tests for RPC deadline and cancellation propagation"""
+
+    def test_expired_rpc_skips_database_work(self):
+        """Test no session is opened once the RPC deadline has passed"""
+        check_deadline()  # No RPC bound: nothing to check
+        repository = BaseRepository()
+        repository._session_factory = Mock()
+        before = skipped_total.value(reason='deadline', stage='session')
+
+        with request_scope(FakeRpcContext(time_remaining=0)):
+            with pytest.raises(DeadlineExceeded):
+                repository._get_session()
+
+        repository._session_factory.assert_not_called()
+        assert skipped_total.value(reason='deadline', stage='session') == before + 1
+
+    def test_cancellation_cancels_tracked_statements(self):
+        """Test a client cancellation cancels in-flight statements, but completion does not"""
+        context = FakeRpcContext(time_remaining=5)
+        connection = Mock()
+        with request_scope(context) as scope:
+            scope.track(connection)
+            context.callbacks[0]()
+            assert scope.cancelled
+            with pytest.raises(RequestCancelled):
+                scope.check()
+        connection.cancel.assert_called_once()
+
+        finished = RequestScope(5)
+        finished.track(connection)
+        finished.finished = True
+        finished.on_terminated()
+        assert not finished.cancelled
+        assert connection.cancel.call_count == 1
+
+    def test_interceptor_answers_deadline_exceeded(self):
+        """Test handlers that run past their deadline are answered with DEADLINE_EXCEEDED"""
+        repository = BaseRepository()
+        repository._session_factory = Mock()
+
+        def handler(request, context):
+            repository._get_session()
+            return 'response'
+
+        details = Mock(method='/library.LibraryService/GetBook')
+        intercepted = DeadlineInterceptor().intercept_service(
+            lambda _: grpc.unary_unary_rpc_method_handler(handler), details)
+
+        assert intercepted.unary_unary(None, FakeRpcContext(time_remaining=5)) == 'response'
+        context = FakeRpcContext(time_remaining=-1)
+        with pytest.raises(grpc.RpcError):
+            intercepted.unary_unary(None, context)
+        assert context.aborted[0] == grpc.StatusCode.DEADLINE_EXCEEDED
+
+
+class TestRateLimiter:
+    """Unit tests for per-client token bucket rate limiting"""
+
+    @staticmethod
+    def _limiter(**settings):
+        defaults = {'RATE_LIMIT_TOKENS_PER_SECOND': 2.0, 'RATE_LIMIT_BURST': 4.0,
+                    'RATE_LIMIT_METHOD_COSTS': 'SearchBooks:3', 'RATE_LIMIT_MAX_CLIENTS': 10}
+        defaults.update(settings)
+        with patch.multiple(Config, **defaults):
+            return RateLimiter()
+
+    def test_method_costs_and_refill(self):
+        """Test expensive methods drain the bucket faster and tokens refill over time"""
+        limiter = self._limiter()
+
+        assert limiter.acquire('a', 'SearchBooks', now=0) == 0
+        assert limiter.acquire('a', 'SearchBooks', now=0) == pytest.approx(1.0)
+        assert limiter.acquire('a', 'GetBook', now=0) == 0
+        assert limiter.acquire('b', 'SearchBooks', now=0) == 0  # Buckets are per client
+        assert limiter.acquire('a', 'SearchBooks', now=1.5) == 0
+
+    def test_client_key_and_eviction(self):
+        """Test clients are keyed on the client id header, else the peer host, and old ones are forgotten"""
+        limiter = self._limiter(RATE_LIMIT_MAX_CLIENTS=1)
+
+        assert limiter.client_key((('x-client-id', 'gateway'),), 'ipv4:10.0.0.1:1') == 'id:gateway'
+        assert limiter.client_key((), 'ipv4:10.0.0.1:50123') == 'peer:ipv4:10.0.0.1'
+        assert limiter.client_key((), 'ipv6:[::1]:50123') == 'peer:ipv6:[::1]'
+        limiter.acquire('a', 'SearchBooks', now=0)
+        limiter.acquire('b', 'SearchBooks', now=0)
+        assert limiter.acquire('a', 'SearchBooks', now=0) == 0  # Evicted, so full again
+        with pytest.raises(ValueError):
+            parse_method_costs('SearchBooks:lots')
+
+    def test_reload_reads_new_limits(self, monkeypatch):
+        """Test limits are re-read from the environment without a restart"""
+        limiter = self._limiter()
+        monkeypatch.setenv('RATE_LIMIT_TOKENS_PER_SECOND', '0')
+        monkeypatch.setenv('RATE_LIMIT_METHOD_COSTS', 'SearchBooks:1')
+
+        with patch.multiple(Config, RATE_LIMIT_TOKENS_PER_SECOND=2.0, RATE_LIMIT_METHOD_COSTS='SearchBooks:3'):
+            limiter.reload()
+            assert Config.RATE_LIMIT_TOKENS_PER_SECOND == 0.0
+
+        assert not limiter.enabled
+        assert limiter.costs == {'SearchBooks': 1.0}
+
+    def test_reload_keeps_limits_when_a_value_is_invalid(self, monkeypatch):
+        """Test a reload with any unparseable setting changes nothing and does not raise"""
+        limiter = self._limiter()
+        monkeypatch.setenv('RATE_LIMIT_TOKENS_PER_SECOND', '0')
+        monkeypatch.setenv('RATE_LIMIT_METHOD_COSTS', 'SearchBooks:lots')
+
+        with patch.multiple(Config, RATE_LIMIT_TOKENS_PER_SECOND=2.0, RATE_LIMIT_METHOD_COSTS='SearchBooks:3'):
+            assert not limiter.reload()
+            assert Config.RATE_LIMIT_TOKENS_PER_SECOND == 2.0
+
+            monkeypatch.setenv('RATE_LIMIT_METHOD_COSTS', 'SearchBooks:1')
+            monkeypatch.setenv('RATE_LIMIT_BURST', 'plenty')
+            assert not limiter.reload()
+            assert Config.RATE_LIMIT_TOKENS_PER_SECOND == 2.0
+
+        assert limiter.enabled
+        assert limiter.costs == {'SearchBooks': 3.0}
+
+    def test_interceptor_rejects_with_retry_after(self):
+        """Test calls over the limit get RESOURCE_EXHAUSTED with a retry-after trailer"""
+        handler = grpc.unary_unary_rpc_method_handler(lambda request, context: 'response')
+        details = Mock(method='/library.LibraryService/SearchBooks')
+        intercepted = RateLimitInterceptor(self._limiter()).intercept_service(lambda _: handler, details)
+
+        assert intercepted.unary_unary(None, FakeRpcContext()) == 'response'
+        context = FakeRpcContext()
+        with pytest.raises(grpc.RpcError):
+            intercepted.unary_unary(None, context)
+        assert context.aborted[0] == grpc.StatusCode.RESOURCE_EXHAUSTED
+        assert context.trailing_metadata == (('retry-after', '1'),)
+        assert intercepted.unary_unary(None, FakeRpcContext(peer='ipv4:10.0.0.2:1')) == 'response'
+
+
+class TestTracing:
+    """Unit tests for head-sampled tracing and its OTLP JSON-lines export"""
+
+    @staticmethod
+    def _exported(path):
+        with open(path) as file:
+            return [span for line in file
+                    for resource in json.loads(line)['resourceSpans']
+                    for scope in resource['scopeSpans'] for span in scope['spans']]
+
+    def test_sampling_follows_traceparent_then_rate(self):
+        """Test an incoming traceparent decides sampling and otherwise the sample rate does"""
+        trace_id, parent_id = 'a' * 32, 'b' * 16
+        assert tracing.parse_traceparent(f"00-{trace_id}-{parent_id}-01") == (trace_id, parent_id, True)
+        assert tracing.parse_traceparent('00-nothex-b-01') is None
+
+        with patch.object(Config, 'TRACE_SAMPLE_RATE', 0.0):
+            assert tracing.start_trace('root') is None
+            assert tracing.start_trace('root', f"00-{trace_id}-{parent_id}-00") is None
+            root = tracing.start_trace('root', f"00-{trace_id}-{parent_id}-01")
+        assert (root.trace_id, root.parent_id) == (trace_id, parent_id)
+        with patch.object(Config, 'TRACE_SAMPLE_RATE', 1.0):
+            assert tracing.start_trace('root').parent_id is None
+
+    def test_service_spans_nest_and_export(self, tmp_path):
+        """Test service methods become child spans written as OTLP JSON lines"""
+        class CatalogService(BaseService):
+            def lookup(self):
+                with tracing.timed('sqlalchemy_to_dict'):
+                    return tracing.current_span().name
+
+        path = tmp_path / 'traces.jsonl'
+        exporter = tracing.JsonLinesExporter(str(path), flush_seconds=3600)
+        with patch('tracing.exporter', exporter), patch.object(Config, 'TRACE_SAMPLE_RATE', 1.0):
+            root = tracing.start_trace('LibraryService/GetBook')
+            with tracing.activate(root):
+                assert CatalogService().lookup() == 'CatalogService.lookup'
+            root.end()
+            assert exporter.flush() == 2
+
+        child, parent = self._exported(path)
+        assert child['parentSpanId'] == parent['spanId'] == root.span_id
+        assert child['traceId'] == parent['traceId']
+        attributes = {a['key']: a['value'] for a in child['attributes']}
+        assert attributes['sqlalchemy_to_dict.calls'] == {'intValue': '1'}
+        assert parent['kind'] == tracing.KIND_SERVER and parent['status'] == {'code': tracing.STATUS_OK}
+
+    def test_interceptor_traces_handler_and_serialization(self, tmp_path):
+        """Test the interceptor continues the caller's trace and records serialization"""
+        handler = grpc.unary_unary_rpc_method_handler(
+            lambda request, context: tracing.current_span().name, response_serializer=str.encode)
+        details = Mock(method='/library.LibraryService/ListBooks')
+        intercepted = TracingInterceptor().intercept_service(lambda _: handler, details)
+        path = tmp_path / 'traces.jsonl'
+        exporter = tracing.JsonLinesExporter(str(path), flush_seconds=3600)
+        context = FakeRpcContext(metadata=(('traceparent', f"00-{'c' * 32}-{'d' * 16}-01"),))
+
+        with patch('tracing.exporter', exporter):
+            response = intercepted.unary_unary(None, context)
+            intercepted.response_serializer(response)
+            exporter.flush()
+
+        assert response == 'library.LibraryService/ListBooks'
+        root, serialize = self._exported(path)
+        assert root['traceId'] == 'c' * 32 and root['parentSpanId'] == 'd' * 16
+        assert serialize['name'] == 'grpc.serialize' and serialize['parentSpanId'] == root['spanId']
+
+
+class TestSqlProfiler:
+    """Unit tests for per-RPC statement profiling, query budgets and the slow-query log"""
+
+    def test_normalize_sql_and_bind_shapes(self):
+        """Test statements differing only in values normalize alike and binds keep only their types"""
+        assert normalize_sql("SELECT * FROM book\n  WHERE id IN (%(id_1)s, %(id_2)s) AND title = 'x' LIMIT 20") == \
+            "SELECT * FROM book WHERE id IN (...) AND title = ? LIMIT ?"
+        assert bind_shape({'id': 1, 'ids': [1, 2, 3], 'title': 'x'}) == {'id': 'int', 'ids': 'list[3]', 'title': 'str'}
+        assert bind_shape([{'id': 1}, {'id': 2}], executemany=True) == {'rows': 2, 'row': {'id': 'int'}}
+
+    def test_counts_statements_and_flags_budget(self):
+        """Test statements are counted per profiled block and over-budget RPCs are flagged"""
+        engine = create_engine('sqlite://')
+        with profile_queries('ListBooks') as stats:
+            with engine.connect() as connection:
+                for i in range(3):
+                    connection.execute(text(f"SELECT {i}"))
+
+        assert stats.statements == 3
+        assert stats.most_repeated(1) == [('SELECT ?', 3)]
+        before = budget_exceeded_total.value(method='ListBooks')
+        with patch.multiple(Config, QUERY_BUDGETS='ListBooks:2', QUERY_BUDGET_DEFAULT=10):
+            assert not check_budget(stats)
+            assert check_budget(QueryStats('GetBook'))
+        assert budget_exceeded_total.value(method='ListBooks') == before + 1
+        with pytest.raises(ValueError, match="Invalid query budget: 'ListBooks:2.5'"):
+            parse_query_budgets('GetBook:3, ListBooks:2.5')
+
+        with pytest.raises(AssertionError, match="issued 2 SQL statements"):
+            with assert_max_queries(1):
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                    connection.execute(text("SELECT 2"))
+
+    def test_slow_query_log(self):
+        """Test statements over the threshold are logged normalized with their bind shapes"""
+        engine = create_engine('sqlite://')
+        with patch.object(Config, 'SLOW_QUERY_MS', 1e-9), patch('sql_profiler.slow_query_logger') as slow_log:
+            with profile_queries('GetBook'), engine.connect() as connection:
+                connection.execute(text("SELECT :id + 1"), {'id': 41})
+
+        entry = json.loads(slow_log.info.call_args.args[0])
+        assert (entry['rpc'], entry['sql'], entry['binds']) == ('GetBook', 'SELECT ? + ?', ['int'])
+
+
+class TestSamplingProfiler:
+    """Unit tests for the in-process sampling profiler"""
+
+    @staticmethod
+    def _busy_rpc(started, stop):
+        with rpc_method('SearchBooks'):
+            started.set()
+            while not stop.is_set():
+                sum(range(1000))
+
+    def _with_busy_rpc(self, fn):
+        started, stop = threading.Event(), threading.Event()
+        worker = threading.Thread(target=self._busy_rpc, args=(started, stop))
+        worker.start()
+        started.wait(1)
+        try:
+            return fn()
+        finally:
+            stop.set()
+            worker.join()
+
+    def test_samples_rpc_threads_as_collapsed_stacks(self):
+        """Test only threads inside an RPC are sampled, rooted at their method"""
+        profiler = SamplingProfiler(hz=100)
+
+        sampled = self._with_busy_rpc(lambda: [profiler.sample() for _ in range(5)])
+
+        stacks = profiler.snapshot()
+        assert sampled == [1] * 5
+        assert sum(stacks.values()) == 5
+        assert all(stack.startswith('SearchBooks;') for stack in stacks)
+        assert any('TestSamplingProfiler._busy_rpc' in stack for stack in stacks)
+        assert profiler.snapshot('ListBooks') == {}
+        assert render_collapsed(stacks).splitlines()[0].rsplit(' ', 1)[1].isdigit()
+
+    def test_capture_samples_for_duration(self):
+        """Test a capture without the background sampler samples just for its duration"""
+        profiler = SamplingProfiler(hz=200)
+
+        collapsed = self._with_busy_rpc(lambda: profiler.capture(0.2))
+
+        assert not profiler.running
+        assert 'SearchBooks;' in collapsed
+        assert sum(int(line.rsplit(' ', 1)[1]) for line in collapsed.splitlines()) > 1
+
+    def test_overlapping_captures_share_the_sampler(self):
+        """Test a capture ending does not stop sampling for one still running"""
+        profiler = SamplingProfiler(hz=200)
+        long_capture = threading.Thread(target=profiler.capture, args=(0.4,))
+        long_capture.start()
+        time.sleep(0.05)
+
+        profiler.capture(0.05)
+        assert profiler.running
+        long_capture.join()
+        assert not profiler.running
+
+    def test_interval_stretches_to_cap_overhead(self):
+        """Test slow samples lengthen the wait so sampling stays within max_overhead"""
+        profiler = SamplingProfiler(hz=100, max_overhead=0.02)
+
+        assert profiler.next_interval(0.0001) == pytest.approx(0.01)
+        assert profiler.next_interval(0.001) == pytest.approx(0.049)
+
+    def test_distinct_stacks_are_bounded(self):
+        """Test stacks beyond max_stacks are folded into '<method>;(other)'"""
+        profiler = SamplingProfiler(max_stacks=1)
+        profiler._stacks['SearchBooks;a'] = 1
+
+        self._with_busy_rpc(profiler.sample)
+
+        assert profiler.snapshot() == {'SearchBooks;a': 1, 'SearchBooks;(other)': 1}
+
+    def test_interceptor_registers_handler_thread(self):
+        """Test the interceptor attributes the handler's thread to its method only while it runs"""
+        import sampling_profiler
+        seen = []
+        handler = grpc.unary_unary_rpc_method_handler(
+            lambda request, context: seen.append(sampling_profiler._rpc_threads.get(threading.get_ident())))
+        details = Mock(method='/library.LibraryService/GetBook')
+
+        wrapped = ProfilingInterceptor().intercept_service(lambda d: handler, details)
+        wrapped.unary_unary(None, Mock())
+
+        assert seen == ['GetBook']
+        assert threading.get_ident() not in sampling_profiler._rpc_threads
+
+
+class TestDiagnostics:
+    """Unit tests for the Diagnostics admin service"""
+
+    def test_pool_status_reports_pool_and_executor(self):
+        """Test pool occupancy and the executor's backlog are reported"""
+        engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=3, max_overflow=2)
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        executor.submit(release.wait, 1)
+        executor.submit(release.wait, 1)
+        try:
+            with engine.connect():
+                status = diagnostics.pool_status(engine, executor)
+        finally:
+            release.set()
+            executor.shutdown()
+
+        assert (status['pool_size'], status['checked_out'], status['max_overflow']) == (3, 1, 2)
+        assert (status['executor_max_workers'], status['executor_workers'], status['executor_queue_depth']) == (1, 1, 1)
+
+    def test_thread_stacks_include_rpc_method(self):
+        """Test every thread is listed and RPC threads carry their method"""
+        with rpc_method('GetBook'):
+            threads = {thread['thread_id']: thread for thread in diagnostics.thread_stacks()}
+
+        current = threads[threading.get_ident()]
+        assert current['rpc_method'] == 'GetBook'
+        assert 'test_thread_stacks_include_rpc_method' in current['stack']
+
+    def test_memory_top_reports_growth(self):
+        """Test allocations made between the snapshots show up as growth, and tracing is stopped again"""
+        retained = []
+        allocate = threading.Timer(0.05, lambda: retained.append([bytearray(1024) for _ in range(1000)]))
+        allocate.start()
+
+        result = diagnostics.memory_top(top_n=5, interval_seconds=0.2)
+
+        assert not result['tracing_was_enabled']
+        assert not diagnostics.tracemalloc.is_tracing()
+        assert result['allocations'][0]['size_diff_bytes'] >= 1024 * 1000
+        assert 'test_services.py' in result['allocations'][0]['location']
+
+    def test_cache_stats_hit_rate(self):
+        """Test cache hit rates come from the idempotency cache counters"""
+        stats = {'hits': 3, 'misses': 1, 'size': 2, 'capacity': 10}
+        with patch.object(diagnostics.idempotency_cache, 'stats', return_value=stats):
+            caches = {cache['name']: cache for cache in diagnostics.cache_stats()}
+
+        assert caches['idempotency_cache']['hit_rate'] == 0.75
+        assert 'availability_index' in caches
+
+    def test_handlers_build_responses(self):
+        """Test the servicer answers GC stats and rejects over-long captures"""
+        service = diagnostics.DiagnosticsGrpcService()
+        context = Mock()
+
+        gc_response = service.GetGcStats(diagnostics.diagnostics_pb2.GetGcStatsRequest(), context)
+        capture = service.CaptureProfile(diagnostics.diagnostics_pb2.CaptureProfileRequest(
+            duration_seconds=Config.DIAGNOSTICS_MAX_WAIT_SECONDS + 1), context)
+
+        assert [generation.generation for generation in gc_response.generations] == [0, 1, 2]
+        assert capture.collapsed_stacks == ''
+        context.set_code.assert_called_once_with(grpc.StatusCode.INVALID_ARGUMENT)
+
+
+class TestStartup:
+    """Unit tests for the fast startup path"""
+
+    def test_schema_version_check(self):
+        """Test the server refuses a database behind its schema version and accepts a newer one"""
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE schema_version (version INTEGER PRIMARY KEY)"))
+            connection.execute(text("INSERT INTO schema_version VALUES (13)"))
+
+        with pytest.raises(startup.SchemaVersionMismatch, match="at version 13, this server needs 14"):
+            startup.check_schema_version(engine, expected=14)
+        assert startup.check_schema_version(engine, expected=12) == 13
+
+    def test_prewarm_opens_distinct_connections_up_to_pool_size(self, tmp_path):
+        """Test prewarm leaves pool_size new connections idle in the pool"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'prewarm.db'}", poolclass=QueuePool, pool_size=3)
+
+        assert startup.prewarm_pool(5, engine) == 3
+        assert (engine.pool.checkedin(), engine.pool.checkedout()) == (3, 0)
+
+    def test_readiness_records_phases(self):
+        """Test readiness is only flagged once marked, with time counted from process start"""
+        readiness = startup.Readiness()
+        with readiness.phase('schema'):
+            pass
+
+        assert not readiness.ready
+        assert readiness.mark_ready() > 0
+        assert readiness.ready and readiness.wait(0)
+        assert set(readiness.phases) == {'schema'}
+        assert startup.process_started_at() <= time.monotonic()
+
+    def test_server_import_skips_numpy_jobs(self):
+        """Test importing the server does not load the numpy-based jobs"""
+        import subprocess
+        import sys
+        result = subprocess.run(
+            [sys.executable, '-c', "import server, sys; print('numpy' in sys.modules, 'jobs.fines' in sys.modules)"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        assert result.stdout.split() == ['False', 'False']
+
+
+class TestHealth:
+    """Unit tests for the grpc.health.v1 service and its monitor"""
+
+    def _monitor(self, probe=lambda: None, pool=None, ready=True):
+        readiness = startup.Readiness()
+        if ready:
+            readiness.mark_ready()
+        status = {'pool_size': 5, 'max_overflow': 5, 'checked_out': 0, 'executor_queue_depth': 0}
+        status.update(pool or {})
+        monitor = health.HealthMonitor(readiness=readiness, probe=probe)
+        return monitor, patch.object(health, 'pool_status', return_value=status)
+
+    def test_serving_once_ready_and_database_reachable(self):
+        """Test the status is NOT_SERVING until the server is ready and a probe succeeded"""
+        monitor, pool = self._monitor(ready=False)
+        with pool:
+            assert monitor.refresh() == health.NOT_SERVING
+            monitor.probe()
+            assert monitor.evaluate() == (health.NOT_SERVING, 'starting')
+            monitor._readiness.mark_ready()
+            assert monitor.refresh() == health.SERVING
+
+    def test_database_probe_failure_goes_stale(self):
+        """Test a failing probe flips to NOT_SERVING once the last success is too old"""
+        outcomes = [None, RuntimeError('connection refused')]
+
+        def probe():
+            outcome = outcomes.pop(0)
+            if outcome:
+                raise outcome
+
+        monitor, pool = self._monitor(probe=probe)
+        with pool, patch.object(Config, 'HEALTH_DB_STALE_SECONDS', 0.05):
+            assert monitor.probe() and monitor.status == health.SERVING
+            time.sleep(0.1)
+            assert not monitor.probe()
+            assert monitor.evaluate() == (health.NOT_SERVING, 'database unreachable')
+
+    def test_saturation_and_drain(self):
+        """Test a saturated pool or executor backlog reports NOT_SERVING, and drain is final"""
+        monitor, pool = self._monitor(pool={'checked_out': 9})
+        with pool:
+            monitor.probe()
+            assert monitor.evaluate()[1].startswith('pool saturated (9/10')
+        monitor, pool = self._monitor(pool={'executor_queue_depth': Config.HEALTH_MAX_QUEUE_DEPTH + 1})
+        with pool:
+            monitor.probe()
+            assert monitor.evaluate()[1].startswith('executor backlog')
+        monitor, pool = self._monitor()
+        with pool:
+            monitor.probe()
+            assert monitor.status == health.SERVING
+            monitor.drain()
+            monitor.probe()
+            assert (monitor.status, monitor.evaluate()[1]) == (health.NOT_SERVING, 'draining')
+
+    def test_drain_stops_the_admin_server_last(self):
+        """Test a drain stops the client-facing server, then the admin server"""
+        monitor, pool = self._monitor()
+        stopped = Mock()
+        with pool:
+            health.start_drain(monitor, stopped.server, drain_seconds=0, grace_seconds=1,
+                               admin_server=stopped.admin).join(1)
+
+        assert monitor.status == health.NOT_SERVING
+        assert [call[0] for call in stopped.method_calls if call[0].endswith('.stop')] == ['server.stop', 'admin.stop']
+
+    def test_repeated_drain_is_ignored(self):
+        """Test a second SIGTERM does not start a second drain"""
+        monitor, pool = self._monitor()
+        server = Mock()
+        with pool:
+            first = health.start_drain(monitor, server, drain_seconds=0, grace_seconds=1)
+            second = health.start_drain(monitor, server, drain_seconds=0, grace_seconds=1)
+            first.join(1)
+
+        assert second is None
+        server.stop.assert_called_once_with(1)
+
+    def test_watch_streams_are_capped(self):
+        """Test Watch streams beyond max_watchers get RESOURCE_EXHAUSTED, and closed ones free their slot"""
+        monitor, pool = self._monitor()
+        service = health.HealthGrpcService(monitor, max_watchers=1)
+        request = health.health_pb2.HealthCheckRequest()
+        with pool:
+            monitor.probe()
+            open_stream = service.Watch(request, Mock())
+            assert next(open_stream).status == health.SERVING
+
+            rejected = Mock()
+            assert list(service.Watch(request, rejected)) == []
+            rejected.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+            open_stream.close()
+            assert next(service.Watch(request, Mock())).status == health.SERVING
+
+    def test_check_and_watch(self):
+        """Test Check answers known services, NOT_FOUND otherwise, and Watch streams changes"""
+        monitor, pool = self._monitor()
+        service = health.HealthGrpcService(monitor)
+        context = Mock()
+        context.is_active.side_effect = [True, False]
+        with pool:
+            monitor.probe()
+            response = service.Check(health.health_pb2.HealthCheckRequest(service='library.LibraryService'), context)
+            missing = service.Check(health.health_pb2.HealthCheckRequest(service='nope'), context)
+            threading.Timer(0.05, monitor.drain).start()
+            watched = [r.status for r in service.Watch(health.health_pb2.HealthCheckRequest(), context)]
+
+        assert response.status == health.SERVING
+        assert missing.status == health.health_pb2.HealthCheckResponse.UNKNOWN
+        context.set_code.assert_called_once_with(grpc.StatusCode.NOT_FOUND)
+        assert watched == [health.SERVING, health.NOT_SERVING]
+
+    def test_health_checks_are_not_rate_limited(self):
+        """Test the rate limit interceptor passes health checks through untouched"""
+        handler = grpc.unary_unary_rpc_method_handler(lambda request, context: 'ok')
+        limiter = Mock(enabled=True)
+        details = Mock(method='/grpc.health.v1.Health/Check')
+
+        wrapped = RateLimitInterceptor(limiter).intercept_service(lambda d: handler, details)
+
+        assert wrapped is handler
+        limiter.acquire.assert_not_called()
+
+
+class TestAvailabilityIndex:
+    """Unit tests for AvailabilityIndex"""
+
+    def _loaded_index(self, borrowed=()):
+        index = AvailabilityIndex()
+        exists, bits, members = array('Q', [0] * 4), array('Q', [0] * 4), array('i', [0] * 256)
+        exists[0] = 0b1110
+        for book_id, member_id in borrowed:
+            bits[0] |= 1 << book_id
+            members[book_id] = member_id
+        with patch.object(index, '_read_all', return_value=(exists, bits, members, 3)):
+            index.load()
+        return index
+
+    def test_lookups_and_counts(self):
+        """Test availability lookups and popcount totals track borrow/return"""
+        index = self._loaded_index(borrowed=[(2, 7)])
+
+        assert index.is_available(1)
+        assert not index.is_available(2)
+        assert not index.is_available(99)
+        assert index.is_borrowed_by_member(2, 7)
+        assert not index.is_borrowed_by_member(2, 8)
+        assert index.counts() == (3, 1)
+
+        index.mark_borrowed(1, 9)
+        index.mark_returned(2)
+        index.mark_created(1000)
+
+        assert index.is_borrowed_by_member(1, 9)
+        assert index.is_available(2)
+        assert index.is_available(1000)
+        assert index.counts() == (4, 1)
+
+    def test_reconcile_reports_drift(self):
+        """Test reconcile replaces cached state and counts corrected books"""
+        index = self._loaded_index()
+        index.mark_borrowed(3, 5)
+
+        exists, bits, members = array('Q', [0b1110]), array('Q', [0]), array('i', [0] * 64)
+        with patch.object(index, '_read_all', return_value=(exists, bits, members, 3)), \
+             patch('repositories.availability_index.reconcile_drift_total') as mock_drift:
+            index.reconcile()
+
+        assert index.is_available(3)
+        mock_drift.inc.assert_called_once_with(1)
+
+    def test_reconcile_counts_member_drift(self):
+        """Test a book still borrowed, but by another member, counts as drift"""
+        index = self._loaded_index(borrowed=[(2, 7)])
+        index.mark_borrowed(2, 8)
+
+        exists, bits, members = array('Q', [0b1110]), array('Q', [0b100]), array('i', [0] * 64)
+        members[2] = 7
+        with patch.object(index, '_read_all', return_value=(exists, bits, members, 3)), \
+             patch('repositories.availability_index.reconcile_drift_total') as mock_drift:
+            index.reconcile()
+
+        assert index.is_borrowed_by_member(2, 7)
+        mock_drift.inc.assert_called_once_with(1)
+
+    def test_repository_confirms_negative_answers_in_database(self):
+        """Test a stale 'borrowed' entry does not reject a borrow another process' return made valid"""
+        index = self._loaded_index(borrowed=[(2, 7)])
+        session = Mock()
+        with patch('repositories.book_repository.availability_index', index), \
+             patch.object(BookRepository, '_get_session', return_value=session), \
+             patch('repositories.book_repository.Book.is_available', return_value=True) as mock_available, \
+             patch('repositories.book_repository.Book.is_borrowed_by_member',
+                   return_value=False) as mock_borrowed_by:
+            repository = BookRepository()
+            assert repository.is_book_available(1)
+            mock_available.assert_not_called()
+            assert repository.is_book_available(2)
+            mock_available.assert_called_once_with(session, 2)
+
+            assert repository.is_book_borrowed_by_member(2, 7)
+            mock_borrowed_by.assert_not_called()
+            assert not repository.is_book_borrowed_by_member(2, 8)
+            mock_borrowed_by.assert_called_once_with(session, 2, 8)
+
+
+class FakeChangeLog:
+    """In-memory stand-in for ChangeLogRepository reads (changes in serving order)"""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def head_position(self):
+        return (self.changes[-1]['txid'], self.changes[-1]['seq']) if self.changes else (0, 0)
+
+    def position(self, since_seq):
+        return next((change['txid'], change['seq']) for change in self.changes if change['seq'] == since_seq)
+
+    def list_changes_after(self, position, limit):
+        rows = [change for change in self.changes if (change['txid'], change['seq']) > position][:limit]
+        return rows, False
+
+
+def _change(seq, entity='book', operation='borrow', txid=None, **data):
+    return {'seq': seq, 'entity': entity, 'entity_id': seq * 10, 'operation': operation,
+            'data': data, 'changed_at': '2024-01-01T00:00:00Z', 'txid': seq if txid is None else txid}
+
+
+class TestBookWatchHub:
+    """Unit tests for the WatchBooks fan-out hub"""
+
+    def _hub(self, changes, queue_size=2):
+        log = FakeChangeLog(changes)
+        with patch('repositories.book_watch_hub.ChangeLogRepository', return_value=log):
+            hub = BookWatchHub(poll_seconds=0.1, queue_size=queue_size, max_subscribers=2)
+        return hub, log
+
+    def test_fans_out_availability_events_and_drops_slow_streams(self):
+        """Test one change log read feeds every stream, and a full queue drops only that stream"""
+        hub, log = self._hub([_change(1)])
+        with patch('repositories.book_watch_hub.threading.Thread'):
+            fast, slow = hub.subscribe(), hub.subscribe()
+
+        log.changes += [_change(2, is_borrowed=True, current_member_id=5), _change(3, 'member', 'update'),
+                        _change(4, operation='return', is_borrowed=False)]
+        hub._dispatch()
+        events = iter(fast)
+        assert [next(events)['seq'], next(events)['seq']] == [2, 4]
+
+        log.changes.append(_change(5, operation='create', is_borrowed=False))
+        hub._dispatch()
+        assert next(events) == {'seq': 5, 'book_id': 50, 'operation': 'create', 'is_borrowed': False,
+                                'current_member_id': None, 'changed_at': '2024-01-01T00:00:00Z', 'txid': 5}
+        assert slow.dropped and list(slow) == []
+        assert not fast.dropped
+
+    def test_resume_replays_then_streams_live(self):
+        """Test a stream resuming from a seq replays missed events once, then continues live"""
+        hub, log = self._hub([_change(6, 'member', 'update'), _change(7), _change(8, 'member', 'update'),
+                              _change(9, operation='return')])
+        with patch('repositories.book_watch_hub.threading.Thread'):
+            subscription = hub.subscribe(since_seq=6)
+        events = iter(subscription)
+        assert [next(events)['seq'], next(events)['seq']] == [7, 9]
+
+        log.changes.append(_change(11, operation='return'))
+        hub._dispatch()
+        assert next(events)['seq'] == 11
+
+    def test_streams_in_commit_order_when_seq_does_not_ascend(self):
+        """Test a change with a lower seq but a later txid is streamed after, not skipped"""
+        hub, log = self._hub([_change(1)])
+        with patch('repositories.book_watch_hub.threading.Thread'):
+            subscription = hub.subscribe()
+        events = iter(subscription)
+
+        log.changes.append(_change(51, txid=100))
+        hub._dispatch()
+        log.changes.append(_change(50, txid=101))
+        hub._dispatch()
+        assert [next(events)['seq'], next(events)['seq']] == [51, 50]
+
+        resumed = iter(hub.subscribe(since_seq=51))
+        assert next(resumed)['seq'] == 50
+
+    def test_subscriber_limit(self):
+        """Test streams beyond the per-process limit are rejected"""
+        hub, _ = self._hub([])
+        with patch('repositories.book_watch_hub.threading.Thread'):
+            hub.subscribe()
+            second = hub.subscribe()
+            with pytest.raises(TooManyWatchers):
+                hub.subscribe()
+            second.close()
+            hub.subscribe()
+
+
 class TestMemberService:
     """Unit tests for MemberService"""
 
@@ -153,11 +1095,8 @@ class TestLibraryService:
             mock_book_repo.is_book_available.return_value = True
             mock_member_repo.member_exists.return_value = True
 
-            # Mock borrow operation
-            mock_book_repo.borrow_book.return_value = {'id': 1, 'title': 'Book'}
-
-            # Mock ledger creation
-            mock_ledger_repo.create_ledger_entry.return_value = {
+            # Mock borrow operation (writes the ledger entry in the same transaction)
+            mock_book_repo.borrow_book.return_value = {
                 'id': 1,
                 'book_id': 1,
                 'member_id': 1,
@@ -171,8 +1110,7 @@ class TestLibraryService:
 
             mock_book_repo.is_book_available.assert_called_once_with(1)
             mock_member_repo.member_exists.assert_called_once_with(1)
-            mock_book_repo.borrow_book.assert_called_once_with(1, 1)
-            mock_ledger_repo.create_ledger_entry.assert_called_once()
+            mock_book_repo.borrow_book.assert_called_once_with(1, 1, due_date=ANY, idempotency_key=None)
             assert result['action_type'] == 'BORROW'
 
     def test_borrow_book_not_available(self):
@@ -220,11 +1158,8 @@ class TestLibraryService:
             # Mock successful validation
             mock_book_repo.is_book_borrowed_by_member.return_value = True
 
-            # Mock return operation
-            mock_book_repo.return_book.return_value = {'id': 1, 'title': 'Book'}
-
-            # Mock ledger creation
-            mock_ledger_repo.create_ledger_entry.return_value = {
+            # Mock return operation (writes the ledger entry in the same transaction)
+            mock_book_repo.return_book.return_value = {
                 'id': 2,
                 'book_id': 1,
                 'member_id': 1,
@@ -237,8 +1172,7 @@ class TestLibraryService:
             result = service.return_book(1, 1)
 
             mock_book_repo.is_book_borrowed_by_member.assert_called_once_with(1, 1)
-            mock_book_repo.return_book.assert_called_once_with(1, 1)
-            mock_ledger_repo.create_ledger_entry.assert_called_once()
+            mock_book_repo.return_book.assert_called_once_with(1, 1, idempotency_key=None)
             assert result['action_type'] == 'RETURN'
 
     def test_return_book_not_borrowed_by_member(self):
@@ -251,4 +1185,263 @@ class TestLibraryService:
             service = LibraryService()
 
             with pytest.raises(ValueError, match="Book is not borrowed by this member"):
-                service.return_book(1, 1)
\ No newline at end of file
+                service.return_book(1, 1)
+
+    def test_borrow_hot_book_rejects_queued_borrows(self):
+        """Test borrows queued behind a successful borrow are rejected without DB calls"""
+        with patch('services.library_service.BookRepository') as mock_book_repo_class, \
+             patch('services.library_service.MemberRepository') as mock_member_repo_class, \
+             patch('services.library_service.LedgerRepository') as mock_ledger_repo_class:
+
+            mock_book_repo = Mock()
+            mock_book_repo_class.return_value = mock_book_repo
+            mock_member_repo_class.return_value = Mock()
+            mock_ledger_repo_class.return_value = Mock()
+
+            mock_book_repo.is_book_available.return_value = True
+            mock_book_repo.borrow_book.side_effect = lambda book_id, member_id, due_date=None, idempotency_key=None: time.sleep(0.2)
+
+            service = LibraryService()
+            errors = []
+            barrier = threading.Barrier(5)
+
+            def borrow(member_id):
+                barrier.wait()
+                try:
+                    service.borrow_book(1, member_id)
+                except ValueError as e:
+                    errors.append(str(e))
+
+            threads = [threading.Thread(target=borrow, args=(member_id,)) for member_id in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            mock_book_repo.borrow_book.assert_called_once()
+            assert mock_book_repo.is_book_available.call_count == 1
+            assert errors == ["Book is already borrowed"] * 4
+
+    def test_borrow_with_known_idempotency_key_replays_without_locking(self):
+        """Test a retried borrow returns the stored ledger entry without touching the book"""
+        with patch('services.library_service.BookRepository') as mock_book_repo_class, \
+             patch('services.library_service.IdempotencyRepository') as mock_key_repo_class:
+            mock_book_repo = Mock()
+            mock_key_repo = Mock()
+            mock_book_repo_class.return_value = mock_book_repo
+            mock_key_repo_class.return_value = mock_key_repo
+            entry = {'id': 7, 'book_id': 1, 'member_id': 2, 'action_type': 'BORROW'}
+            mock_key_repo.lookup.return_value = {'operation': 'borrow', 'book_id': 1, 'member_id': 2,
+                                                 'ledger_entry': entry}
+
+            service = LibraryService()
+
+            assert service.borrow_book(1, 2, idempotency_key='k1') == entry
+            mock_book_repo.is_book_available.assert_not_called()
+            mock_book_repo.borrow_book.assert_not_called()
+            with pytest.raises(ValueError, match="already used for another request"):
+                service.borrow_book(3, 2, idempotency_key='k1')
+            with pytest.raises(ValueError, match="already used for another request"):
+                service.return_book(1, 2, idempotency_key='k1')
+
+    def test_borrow_losing_race_to_same_key_replays(self):
+        """Test a retry that loses the race to its original call answers with the original's entry"""
+        with patch('services.library_service.BookRepository') as mock_book_repo_class, \
+             patch('services.library_service.IdempotencyRepository') as mock_key_repo_class:
+            mock_book_repo = Mock()
+            mock_key_repo = Mock()
+            mock_book_repo_class.return_value = mock_book_repo
+            mock_key_repo_class.return_value = mock_key_repo
+            entry = {'id': 7, 'book_id': 1, 'member_id': 2, 'action_type': 'BORROW'}
+            # Not stored yet when the retry arrives; stored once the original commits
+            mock_key_repo.lookup.side_effect = [None, {'operation': 'borrow', 'book_id': 1, 'member_id': 2,
+                                                       'ledger_entry': entry}]
+            mock_book_repo.is_book_available.return_value = False
+
+            service = LibraryService()
+
+            assert service.borrow_book(1, 2, idempotency_key='k1') == entry
+            with pytest.raises(ValueError, match="at most"):
+                service.borrow_book(1, 2, idempotency_key='k' * (Config.IDEMPOTENCY_KEY_MAX_LENGTH + 1))
+
+    def test_circulation_rollup_defaults_and_truncation(self):
+        """Test the rollup query defaults to the last 30 days and flags truncated results"""
+        with patch('services.library_service.LedgerRollupRepository') as mock_rollup_repo_class, \
+             patch.object(Config, 'ROLLUP_QUERY_MAX_ROWS', 2):
+            mock_rollup_repo = Mock()
+            mock_rollup_repo_class.return_value = mock_rollup_repo
+            mock_rollup_repo.list_rollups.return_value = [{'day': '2024-01-01'}] * 3
+
+            service = LibraryService()
+            rows, truncated = service.get_circulation_rollup('author')
+
+            assert len(rows) == 2 and truncated
+            dimension, key, start, end, limit = mock_rollup_repo.list_rollups.call_args.args
+            assert (dimension, key, limit) == ('author', None, 3)
+            assert (end - start).days == 30 and end > datetime.utcnow().date()
+
+    def test_circulation_rollup_rejects_bad_arguments(self):
+        """Test unknown dimensions and empty date ranges are rejected"""
+        with patch('services.library_service.LedgerRollupRepository'):
+            service = LibraryService()
+            with pytest.raises(ValueError, match="Dimension"):
+                service.get_circulation_rollup('genre')
+            with pytest.raises(ValueError, match="Start date"):
+                service.get_circulation_rollup('all', start_date=date(2024, 2, 1), end_date=date(2024, 1, 1))
+
+    def test_list_changes_clamps_limit(self):
+        """Test the change feed page size is capped and negative sequences are rejected"""
+        with patch('services.library_service.ChangeLogRepository') as mock_change_repo_class, \
+             patch.object(Config, 'CHANGE_LOG_PAGE_MAX', 50):
+            mock_change_repo = Mock()
+            mock_change_repo_class.return_value = mock_change_repo
+            mock_change_repo.list_changes.return_value = ([], 7, False)
+
+            service = LibraryService()
+
+            assert service.list_changes(7, 10000) == ([], 7, False)
+            mock_change_repo.list_changes.assert_called_once_with(7, 50)
+            with pytest.raises(ValueError, match="negative"):
+                service.list_changes(-1)
+
+    def test_change_log_record_serializes_timestamps(self):
+        """Test change rows store JSON-ready data in the caller's session"""
+        session = Mock()
+
+        ChangeLogRepository().record(session, 'loan', 3, 'return', {'returned_at': datetime(2024, 1, 2, 3, 4, 5)})
+
+        change = session.add.call_args.args[0]
+        assert (change.entity, change.entity_id, change.operation) == ('loan', 3, 'return')
+        assert change.data == {'returned_at': '2024-01-02T03:04:05Z'}
+
+    def test_list_changes_has_more_only_for_settled_rows(self):
+        """Test a page cut short by a change still in flight does not report has_more"""
+        def row(seq, settled):
+            return Mock(seq=seq, txid=seq, entity='book', entity_id=1, operation='update', data={},
+                        changed_at=datetime(2024, 1, 1), settled=settled)
+
+        def session(*rows):
+            listed, watermarks = Mock(), Mock()
+            listed.all.return_value = list(rows)
+            watermarks.all.return_value = []
+            return Mock(**{'execute.side_effect': [listed, watermarks]})
+
+        repository = ChangeLogRepository()
+        changes, has_more = repository._list(session(row(1, True), row(2, False)), (0, 0), 5)
+        assert [change['seq'] for change in changes] == [1] and not has_more
+
+        assert repository._list(session(row(1, False)), (0, 0), 5) == ([], False)
+        assert repository._list(session(row(1, True), row(2, False)), (0, 0), 1)[1] is False
+        assert repository._list(session(row(1, True), row(2, True)), (0, 0), 1)[1] is True
+
+
+class TestIdempotencyCache:
+    """Unit tests for the in-process idempotency key LRU"""
+
+    def test_evicts_least_recently_used(self):
+        cache = IdempotencyCache(max_size=2)
+        cache.put('a', {'id': 1})
+        cache.put('b', {'id': 2})
+        assert cache.get('a') == {'id': 1}
+        cache.put('c', {'id': 3})
+
+        assert cache.get('b') is None
+        assert cache.get('a') == {'id': 1}
+        assert cache.get('c') == {'id': 3}
+
+
+class TestKeyedSerializer:
+    """Unit tests for KeyedSerializer"""
+
+    def test_slot_is_released_when_idle(self):
+        """Test slots are dropped once no caller holds or waits on the key"""
+        serializer = KeyedSerializer()
+
+        with serializer.hold('book-1'):
+            assert serializer.pending('book-1') == 1
+
+        assert serializer.pending('book-1') == 0
+
+    def test_rejects_when_queue_is_full(self):
+        """Test callers beyond max_waiters are turned away"""
+        serializer = KeyedSerializer(max_waiters=1)
+
+        with serializer.hold('book-1'):
+            with pytest.raises(ConcurrencyConflict):
+                with serializer.hold('book-1'):
+                    pass
+
+        with serializer.hold('book-2'):
+            pass
+
+
+class TestLedgerPartitions:
+    """Unit tests for the monthly ledger partition helpers"""
+
+    def test_add_months_crosses_year_boundaries(self):
+        """Test month arithmetic forwards and backwards across years"""
+        assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+        assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+        assert add_months(month_start(date(2024, 5, 31)), 0) == date(2024, 5, 1)
+
+    def test_partition_name(self):
+        """Test partition names sort chronologically"""
+        assert partition_name(date(2024, 3, 1)) == 'ledger_y2024m03'
+        assert partition_name(date(2024, 3, 1)) < partition_name(date(2024, 11, 1))
+
+
+class TestDueDatePolicy:
+    """Unit tests for DueDatePolicy"""
+
+    def test_due_after_loan_period(self):
+        """Test loans are due the configured number of days after borrowing"""
+        policy = DueDatePolicy(loan_period_days=14, due_end_of_day=False)
+
+        assert policy.due_date(datetime(2024, 1, 30, 10, 15)) == datetime(2024, 2, 13, 10, 15)
+
+    def test_due_end_of_day(self):
+        """Test end-of-day rounding moves the due time to the last second of the day"""
+        policy = DueDatePolicy(loan_period_days=7, due_end_of_day=True)
+
+        assert policy.due_date(datetime(2024, 12, 28, 9, 0, 0, 500)) == datetime(2025, 1, 4, 23, 59, 59)
+
+    def test_rejects_non_positive_period(self):
+        """Test a loan period below one day is rejected"""
+        with pytest.raises(ValueError, match="at least one day"):
+            DueDatePolicy(loan_period_days=0)
+
+
+class TestFineSchedule:
+    """Unit tests for the vectorized fines engine"""
+
+    def test_tiered_amounts(self):
+        """Test each overdue day is charged at its tier's rate, up to the cap"""
+        schedule = FineSchedule([(1, 25), (8, 50), (31, 100)], max_cents=2000)
+
+        amounts = schedule.amounts(np.array([0, 1, 7, 10, 31, 365]))
+
+        assert amounts.tolist() == [0, 25, 175, 325, 1425, 2000]
+
+    def test_partial_days_count_in_full(self):
+        """Test an hour past the due date is one day overdue and an early return is none"""
+        due = np.array(['2024-01-10T00:00:00', '2024-01-10T00:00:00'], dtype='datetime64[s]')
+        end = np.array(['2024-01-10T01:00:00', '2024-01-09T12:00:00'], dtype='datetime64[s]')
+
+        assert FineSchedule.days_overdue(due, end).tolist() == [1, 0]
+
+    def test_price_keeps_only_loans_owing(self):
+        """Test pricing drops loans that owe nothing"""
+        with patch('jobs.fines.FineRepository'):
+            job = FinesJob(schedule=FineSchedule([(1, 25), (8, 50)]))
+        day = 86400
+        loans = np.array([[1, 5, 0, 10 * day], [2, 6, 0, 0]], dtype=np.int64)
+
+        assert job.price(loans).tolist() == [[1, 5, 10, 325]]
+
+    def test_copy_binary_payload(self):
+        """Test the COPY payload has the binary header, big-endian int4 fields and trailer"""
+        payload = to_copy_binary(np.array([[1, 5, 10, 325]], dtype=np.int64)).getvalue()
+
+        assert payload.startswith(b'PGCOPY\n\xff\r\n\x00')
+        assert payload[19:] == (b'\x00\x04' + b''.join(b'\x00\x00\x00\x04' + v.to_bytes(4, 'big')
+                                                      for v in (1, 5, 10, 325)) + b'\xff\xff')
\ No newline at end of file
@@ -0,0 +1,348 @@
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from config import Config
+from logger import logger
+from metrics import registry
+
+SERVICE_NAME = 'library-backend'
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+spans_dropped_total = registry.counter(
+    'library_trace_spans_dropped_total', 'Finished spans dropped because the trace export queue was full')
+
+
+class Span:
+    """One timed operation of a sampled trace
+
+    Only sampled traces create spans at all; everything under an unsampled
+    root sees no current span and skips tracing.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, kind: int = KIND_INTERNAL,
+                 start_ns: Optional[int] = None, **attributes: Any):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns() if start_ns is None else start_ns
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.error: Optional[str] = None
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, start_ns: Optional[int] = None, **attributes: Any) -> 'Span':
+        return Span(name, self.trace_id, self.span_id, kind, start_ns, **attributes)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_time(self, key: str, elapsed_ns: int) -> None:
+        """Accumulate time spent in a step too frequent to get its own spans (``<key>.ms`` / ``<key>.calls``)"""
+        self.attributes[f"{key}.ms"] = self.attributes.get(f"{key}.ms", 0.0) + elapsed_ns / 1e6
+        self.attributes[f"{key}.calls"] = self.attributes.get(f"{key}.calls", 0) + 1
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': STATUS_ERROR, 'message': self.error} if self.error else {'code': STATUS_OK},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file as OTLP/JSON, one ExportTraceServiceRequest per line
+
+    Spans are queued by the request threads and written by a daemon thread
+    every ``flush_seconds``, so requests never wait on file I/O. The format
+    is what the OpenTelemetry Collector's file receiver/exporter reads.
+    """
+
+    def __init__(self, path: str = Config.TRACE_FILE, flush_seconds: float = Config.TRACE_FLUSH_SECONDS,
+                 queue_size: int = Config.TRACE_QUEUE_SIZE):
+        self._path = path
+        self._flush_seconds = flush_seconds
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, span: Span) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            spans_dropped_total.inc()
+
+    def flush(self) -> int:
+        """Write every queued span; returns the number written"""
+        spans: List[Span] = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not spans:
+            return 0
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self._path, 'a') as file:
+            file.write(json.dumps(request) + '\n')
+        return len(spans)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self._flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Writing traces to {self._path} failed: {str(e)}")
+
+
+exporter = JsonLinesExporter()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None if absent/invalid"""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Optional[Span]:
+    """Start a root (server) span, or return None when the request is not sampled
+
+    A valid ``traceparent`` continues the caller's trace and its sampled flag
+    decides; otherwise a new trace is sampled at TRACE_SAMPLE_RATE.
+    """
+    incoming = parse_traceparent(traceparent)
+    if incoming:
+        trace_id, parent_id, sampled = incoming
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+        sampled = random.random() < Config.TRACE_SAMPLE_RATE
+    if not sampled:
+        return None
+    return Span(name, trace_id, parent_id, KIND_SERVER, **attributes)
+
+
+@contextmanager
+def activate(span: Optional[Span]) -> Iterator[Optional[Span]]:
+    """Make ``span`` current for the block (ending it is up to the caller)"""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span; a no-op outside a sampled trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name, **attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator running the function inside ``span(name)``"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_public_methods(cls: type) -> type:
+    """Wrap every public method defined on ``cls`` in a span named '<class>.<method>'"""
+    for attr, value in list(vars(cls).items()):
+        if not attr.startswith('_') and callable(value) and not isinstance(value, (staticmethod, classmethod, type)):
+            setattr(cls, attr, traced(f"{cls.__name__}.{attr}")(value))
+    return cls
+
+
+@contextmanager
+def timed(key: str) -> Iterator[None]:
+    """Add the block's duration to the current span's ``key`` totals (see Span.add_time)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        parent.add_time(key, time.perf_counter_ns() - start)
+
+
+def timed_calls(key: str) -> Callable[[Callable], Callable]:
+    """Decorator accumulating the function's time on the current span (see ``timed``)"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with timed(key):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_session(session: Session) -> None:
+    """Give a repository session a 'db.session' span that ends when the session is closed
+
+    Pool checkout and the session's SQL statements are recorded as its children.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return
+    session_span = parent.child('db.session')
+    session.info['trace_span'] = session_span
+    close = session.close
+
+    def close_and_end():
+        try:
+            close()
+        finally:
+            session_span.end()
+
+    session.close = close_and_end
+
+
+@event.listens_for(Session, 'after_transaction_create')
+def _mark_checkout_start(session, transaction) -> None:
+    if transaction.parent is None and 'trace_span' in session.info:
+        session.info['trace_checkout_ns'] = time.time_ns()
+
+
+@event.listens_for(Session, 'after_begin')
+def _record_checkout(session, transaction, connection) -> None:
+    session_span = session.info.get('trace_span')
+    if session_span is None:
+        return
+    start_ns = session.info.pop('trace_checkout_ns', None)
+    if start_ns is not None:
+        # From the transaction's creation to its connection being ready:
+        # pool checkout (and pre-ping) plus BEGIN
+        session_span.child('db.checkout', start_ns=start_ns).end()
+    connection.info['trace_span'] = session_span
+
+
+@event.listens_for(Pool, 'checkin')
+def _forget_session_span(dbapi_connection, connection_record) -> None:
+    if connection_record is not None:
+        connection_record.info.pop('trace_span', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    parent = conn.info.get('trace_span') or _current_span.get()
+    if parent is None or context is None:
+        return
+    context._trace_span = parent.child('db.query', KIND_CLIENT, **{
+        'db.system': 'postgresql',
+        'db.statement': statement[:Config.TRACE_SQL_MAX_LENGTH],
+    })
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    statement_span = getattr(context, '_trace_span', None)
+    if statement_span is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            statement_span.set_attribute('db.rows', cursor.rowcount)
+        statement_span.end()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_statement(exception_context) -> None:
+    statement_span = getattr(exception_context.execution_context, '_trace_span', None)
+    if statement_span is not None:
+        statement_span.set_error(str(exception_context.original_exception))
+        statement_span.end()
@@ -24,6 +24,11 @@ const validateBookId = (req, res, next) => {
     next();
 };
 
+const parseIdList = (value) => {
+    if (!value) return [];
+    return String(value).split(',').map(id => parseInt(id)).filter(id => !isNaN(id));
+};
+
 // Import client from main server
 let client;
 const setClient = (grpcClient) => {
@@ -79,6 +84,28 @@ router.get('/', async (req, res) => {
     }
 });
 
+router.get('/batch', async (req, res) => {
+    const ids = parseIdList(req.query.ids);
+    logger.info(`GET /api/books/batch - BatchGetBooks operation started for ${ids.length} ids`);
+    if (ids.length === 0) {
+        return handleValidationError('INVALID_BOOK_IDS', 'At least one valid book ID is required', res);
+    }
+    try {
+        const response = await promisifyGrpcCall(client.BatchGetBooks, { ids });
+        logger.info(`GET /api/books/batch - BatchGetBooks operation successful for ${ids.length} ids`);
+        res.json({
+            results: response.results.map(result => ({
+                id: result.id,
+                found: result.found,
+                book: result.found ? result.book : null
+            }))
+        });
+    } catch (error) {
+        logger.error(`${config.ERROR_KEYWORD} GET /api/books/batch - BatchGetBooks operation failed: ${error.message}`);
+        handleGrpcError(error, res);
+    }
+});
+
 router.post('/', validateBookInput, async (req, res) => {
     const { title, author } = req.body;
     logger.info(`POST /api/books - CreateBook operation started for title: ${title}, author: ${author}`);
@@ -115,8 +142,8 @@ router.patch('/:id', validateBookId, async (req, res) => {
     logger.info(`PATCH /api/books/${id} - PartialUpdateBook operation started for book ID: ${id}`);
     try {
         // Get current book data
-        const listResponse = await promisifyGrpcCall(client.ListBooks, {});
-        const currentBook = listResponse.books.find(book => book.id === parseInt(id));
+        const batchResponse = await promisifyGrpcCall(client.BatchGetBooks, { ids: [parseInt(id)] });
+        const currentBook = batchResponse.results[0].found ? batchResponse.results[0].book : null;
 
         if (!currentBook) {
             logger.warning(`PATCH /api/books/${id} - Book not found for ID: ${id}`);
@@ -24,6 +24,11 @@ const validateMemberId = (req, res, next) => {
     next();
 };
 
+const parseIdList = (value) => {
+    if (!value) return [];
+    return String(value).split(',').map(id => parseInt(id)).filter(id => !isNaN(id));
+};
+
 // Import client from main server
 let client;
 const setClient = (grpcClient) => {
@@ -83,6 +88,28 @@ router.get('/search', async (req, res) => {
     }
 });
 
+router.get('/batch', async (req, res) => {
+    const ids = parseIdList(req.query.ids);
+    logger.info(`GET /api/members/batch - BatchGetMembers operation started for ${ids.length} ids`);
+    if (ids.length === 0) {
+        return handleValidationError('INVALID_MEMBER_IDS', 'At least one valid member ID is required', res);
+    }
+    try {
+        const response = await promisifyGrpcCall(client.BatchGetMembers, { ids });
+        logger.info(`GET /api/members/batch - BatchGetMembers operation successful for ${ids.length} ids`);
+        res.json({
+            results: response.results.map(result => ({
+                id: result.id,
+                found: result.found,
+                member: result.found ? result.member : null
+            }))
+        });
+    } catch (error) {
+        logger.error(`${config.ERROR_KEYWORD} GET /api/members/batch - BatchGetMembers operation failed: ${error.message}`);
+        handleGrpcError(error, res);
+    }
+});
+
 router.post('/', validateMemberInput, async (req, res) => {
     const { name, email } = req.body;
     logger.info(`POST /api/members - CreateMember operation started for name: ${name}, email: ${email}`);
@@ -16,24 +16,170 @@ CREATE TABLE book (
     author TEXT NOT NULL,
     is_borrowed BOOLEAN DEFAULT FALSE,
     current_member_id INTEGER REFERENCES member(id),
+    version INTEGER NOT NULL DEFAULT 0, -- Compare-and-swap guard for borrow/return
+    borrow_count INTEGER NOT NULL DEFAULT 0, -- Incremented by every borrow, drives the 'popular' order
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- 3. Transaction Ledger: Tracking history and return deltas
+-- Append-only and range-partitioned by month on log_date. Partitions are
+-- created ahead of time (and old ones archived) by the backend; see
+-- backend/repositories/ledger_partition_repository.py.
 CREATE TABLE ledger (
-    id SERIAL PRIMARY KEY,
-    book_id INTEGER REFERENCES book(id),
-    member_id INTEGER REFERENCES member(id),
+    id SERIAL,
+    book_id INTEGER NOT NULL REFERENCES book(id),
+    member_id INTEGER NOT NULL REFERENCES member(id),
     action_type TEXT NOT NULL, -- 'BORROW' or 'RETURN'
-    log_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    due_date_snapshot TIMESTAMP -- Added for O(1) delay calculation
+    log_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    due_date_snapshot TIMESTAMP, -- Added for O(1) delay calculation
+    PRIMARY KEY (id, log_date)
+) PARTITION BY RANGE (log_date);
+
+-- Current month and the next three; the backend keeps this window rolling
+DO $$
+DECLARE
+    month DATE := date_trunc('month', CURRENT_DATE);
+BEGIN
+    FOR i IN 0..3 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ledger FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, '"ledger_y"YYYY"m"MM'), month, month + INTERVAL '1 month'
+        );
+        month := month + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+-- 4. Loans: one row per borrow, closed by the return. Written in the same
+-- transaction as the ledger entries, so borrowed_at/returned_at match their log_date.
+CREATE TABLE loan (
+    id SERIAL PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES book(id),
+    member_id INTEGER NOT NULL REFERENCES member(id),
+    borrowed_at TIMESTAMP NOT NULL,
+    due_at TIMESTAMP,
+    returned_at TIMESTAMP -- NULL while the loan is open
 );
 
--- Create indexes for better query performance
-CREATE INDEX idx_book_is_borrowed ON book(is_borrowed);
-CREATE INDEX idx_book_current_member ON book(current_member_id);
-CREATE INDEX idx_ledger_book_id ON ledger(book_id);
-CREATE INDEX idx_ledger_member_id ON ledger(member_id);
-CREATE INDEX idx_ledger_action_type ON ledger(action_type);
+-- 5. Fines: late fee per loan, recomputed in bulk by the backend fines job.
+-- member_id is copied from loan so member balances need no join.
+CREATE TABLE fine (
+    loan_id INTEGER PRIMARY KEY REFERENCES loan(id),
+    member_id INTEGER NOT NULL,
+    days_overdue INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    computed_at TIMESTAMP NOT NULL
+);
 
+-- 6. Catalog statistics, maintained in the same transaction as book changes.
+-- Each counter is split over shard rows (summed on read) so concurrent
+-- borrows rarely update the same row.
+CREATE TABLE catalog_stats (
+    name TEXT NOT NULL, -- 'total_books', 'borrowed_books' or 'active_borrowers'
+    shard INTEGER NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, shard)
+);
+
+CREATE TABLE author_stats (
+    author TEXT PRIMARY KEY,
+    book_count BIGINT NOT NULL DEFAULT 0
+);
+
+-- 7. Daily circulation rollups, folded incrementally from the ledger by
+-- jobs.ledger_rollup. rollup_watermark holds the highest ledger.id counted.
+CREATE TABLE ledger_daily_rollup (
+    dimension TEXT NOT NULL, -- 'all', 'author' or 'cohort'
+    dimension_key TEXT NOT NULL, -- '' for 'all', author name, or member sign-up month 'YYYY-MM'
+    day DATE NOT NULL,
+    borrows BIGINT NOT NULL DEFAULT 0,
+    returns BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, dimension_key, day)
+);
+
+CREATE TABLE rollup_watermark (
+    name TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0
+);
+
+-- 8. "Also borrowed" recommendations, built incrementally from the ledger by
+-- jobs.related_books (watermark row 'book_cooccurrence' in rollup_watermark).
+-- book_cooccurrence is the sparse matrix of distinct members who borrowed
+-- both books; related_books keeps each book's top K as one row.
+CREATE TABLE book_cooccurrence (
+    book_id INTEGER NOT NULL,
+    related_book_id INTEGER NOT NULL,
+    members INTEGER NOT NULL,
+    PRIMARY KEY (book_id, related_book_id)
+);
+
+CREATE TABLE related_books (
+    book_id INTEGER PRIMARY KEY,
+    related_ids INTEGER[] NOT NULL, -- Most shared members first
+    members INTEGER[] NOT NULL, -- Shared member count per related_ids entry
+    computed_at TIMESTAMP NOT NULL
+);
+
+-- 9. Change log (transactional outbox) of book, member and loan changes,
+-- written in the same transaction as each change and served by ListChanges.
+-- Rows are served in (txid, seq) order once txid is below the snapshot xmin,
+-- so a change that commits later never sorts before one already served.
+CREATE TABLE change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    entity TEXT NOT NULL, -- 'book', 'member' or 'loan'
+    entity_id INTEGER NOT NULL,
+    operation TEXT NOT NULL, -- 'create', 'update', 'borrow' or 'return'
+    data JSONB NOT NULL, -- Changed fields; every field on 'create'
+    changed_at TIMESTAMP NOT NULL,
+    txid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint
+);
+
+-- 10. Idempotency keys of BorrowBook/ReturnBook calls and the ledger entry
+-- each produced, written in the same transaction (the partitioned ledger
+-- cannot hold a unique key without log_date). Expired keys are swept in batches.
+CREATE TABLE idempotency_key (
+    key TEXT PRIMARY KEY,
+    operation TEXT NOT NULL, -- 'borrow' or 'return'
+    book_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    ledger_entry JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+-- 11. Applied migrations. The backend checks max(version) on startup; this
+-- schema matches migrations/ up to and including 014.
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO schema_version (version) VALUES (14);
+
+-- Create indexes for better query performance
+-- Partial indexes cover only open loans (is_borrowed), which is what the
+-- borrowed-books and 'borrowed' filter queries read.
+CREATE INDEX idx_book_open_loans_member ON book(current_member_id, id) WHERE is_borrowed;
+CREATE INDEX idx_book_open_loans ON book(id) WHERE is_borrowed;
+-- Foreign key lookups from member deletes, which have no is_borrowed predicate
+CREATE INDEX idx_book_current_member_fk ON book(current_member_id) WHERE current_member_id IS NOT NULL;
+CREATE INDEX idx_book_updated_at_id ON book(updated_at, id);
+CREATE INDEX idx_book_borrow_count ON book(borrow_count DESC, id);
+-- Ledger history indexes, keyset-paged on (log_date, id); INCLUDE columns make
+-- member/book history pages index-only scans.
+CREATE INDEX idx_ledger_member_history ON ledger(member_id, log_date DESC, id DESC) INCLUDE (book_id, action_type, due_date_snapshot);
+CREATE INDEX idx_ledger_book_history ON ledger(book_id, log_date DESC, id DESC) INCLUDE (member_id, action_type, due_date_snapshot);
+CREATE INDEX idx_ledger_log_date ON ledger(log_date DESC, id DESC);
+-- Loan lookups: book history (also the backfill's natural key), the single
+-- open loan per book, member history and loans started in a date range.
+CREATE UNIQUE INDEX idx_loan_book_borrowed_at ON loan(book_id, borrowed_at);
+CREATE UNIQUE INDEX idx_loan_open_book ON loan(book_id) WHERE returned_at IS NULL;
+CREATE INDEX idx_loan_member_history ON loan(member_id, borrowed_at DESC, id DESC);
+CREATE INDEX idx_loan_borrowed_at ON loan(borrowed_at, id);
+-- Overdue report: open loans only, oldest due date first
+CREATE INDEX idx_loan_open_due ON loan(due_at, id) WHERE returned_at IS NULL;
+-- Recently returned loans, read by the fines job
+CREATE INDEX idx_loan_returned_at ON loan(returned_at) WHERE returned_at IS NOT NULL;
+CREATE INDEX idx_fine_member ON fine(member_id, loan_id) INCLUDE (amount_cents);
+CREATE INDEX idx_author_stats_book_count ON author_stats(book_count DESC, author);
+CREATE INDEX idx_ledger_rollup_dimension_day ON ledger_daily_rollup(dimension, day);
+CREATE INDEX idx_idempotency_key_created_at ON idempotency_key(created_at);
+CREATE INDEX idx_change_log_txid_seq ON change_log(txid, seq);